@@ -0,0 +1,226 @@
+"""Inter-annotator agreement on source relevance and rank.
+
+Every answer record is one annotator's pass over a question, and its
+`url_ratings` are that annotator's labels for the question's URLs. Ratings
+saved from /best-answers are the exception: one submission copied onto every
+answer of the question, flagged `fanout`. The copies are one annotator's
+labels, not independent ones, so agreement leaves them out.
+
+Two tables of counts, kept current by triggers on `url_ratings`, hold all
+that agreement needs:
+
+- `agreement_items` counts, per URL, how many annotators rated it and how
+  many of them marked it relevant. Fleiss' kappa and Krippendorff's alpha
+  come from these counts alone.
+- `agreement_pairs` holds, per pair of annotators of a question, the 2x2
+  relevance contingency table over the URLs both rated. Cohen's kappa comes
+  from it. The pair row also holds sums of both annotators' ranks over the
+  URLs both ranked, which give the Spearman correlation of their rankings.
+
+A new rating touches one item row and one pair row per other annotator of
+the URL. A fan-out write replaces every annotator's rating of a URL at once,
+which one row at a time would cost a pair row update per two annotators. So
+the triggers skip ratings turning into fan-out copies, and whoever writes
+them calls `rebuild_agreement` for the question in the same transaction; with
+the real ratings gone that is quick. The agreement figures are then array
+operations over the count rows, per question or for the whole dataset.
+"""
+import itertools
+
+import numpy as np
+
+AGREEMENT_NAMES = ["fleiss_kappa", "krippendorff_alpha", "cohen_kappa", "spearman_rho"]
+
+AGREEMENT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS agreement_items (
+    url_id INTEGER PRIMARY KEY,
+    question_id INTEGER NOT NULL,
+    raters INTEGER NOT NULL,
+    relevant INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_agreement_items_question ON agreement_items(question_id);
+
+-- answer_a < answer_b; n01 counts URLs answer_a marked not relevant and answer_b relevant
+CREATE TABLE IF NOT EXISTS agreement_pairs (
+    answer_a INTEGER NOT NULL,
+    answer_b INTEGER NOT NULL,
+    question_id INTEGER NOT NULL,
+    n00 INTEGER NOT NULL, n01 INTEGER NOT NULL, n10 INTEGER NOT NULL, n11 INTEGER NOT NULL,
+    ranked INTEGER NOT NULL,
+    sx INTEGER NOT NULL, sy INTEGER NOT NULL, sxx INTEGER NOT NULL, syy INTEGER NOT NULL, sxy INTEGER NOT NULL,
+    PRIMARY KEY (answer_a, answer_b)
+);
+CREATE INDEX IF NOT EXISTS idx_agreement_pairs_b ON agreement_pairs(answer_b);
+CREATE INDEX IF NOT EXISTS idx_agreement_pairs_question ON agreement_pairs(question_id);
+"""
+
+# The rating `{r}` paired with each other annotator's rating of its URL, oriented by answer id. Rank 0 means
+# "not ranked" and leaves the pair out of the rank sums. `{r}` itself is excluded by rowid, which an UPDATE keeps
+_PAIR_CELLS = """
+    SELECT a, b, (SELECT question_id FROM answers WHERE id = {r}.answer_id) AS question_id,
+           x = 0 AND y = 0 AS n00, x = 0 AND y = 1 AS n01, x = 1 AND y = 0 AS n10, x = 1 AND y = 1 AS n11,
+           ranked, ranked * rx AS sx, ranked * ry AS sy, ranked * rx * rx AS sxx, ranked * ry * ry AS syy,
+           ranked * rx * ry AS sxy
+    FROM (SELECT MIN(o.answer_id, {r}.answer_id) AS a, MAX(o.answer_id, {r}.answer_id) AS b,
+                 IIF(o.answer_id < {r}.answer_id, o.relevant, {r}.relevant) AS x,
+                 IIF(o.answer_id < {r}.answer_id, {r}.relevant, o.relevant) AS y,
+                 IIF(o.answer_id < {r}.answer_id, o.rank, {r}.rank) AS rx,
+                 IIF(o.answer_id < {r}.answer_id, {r}.rank, o.rank) AS ry,
+                 o.rank > 0 AND {r}.rank > 0 AS ranked
+          FROM url_ratings o WHERE o.url_id = {r}.url_id AND o.answer_id != {r}.answer_id AND o.rowid != {r}.rowid
+                AND NOT o.fanout)
+"""
+
+_COUNTS = ["n00", "n01", "n10", "n11", "ranked", "sx", "sy", "sxx", "syy", "sxy"]
+
+# Both only count an annotator's own rating, not a fan-out copy
+_ADD_RATING = f"""
+    INSERT INTO agreement_items (url_id, question_id, raters, relevant)
+    SELECT id, question_id, 1, {{r}}.relevant FROM urls WHERE id = {{r}}.url_id AND NOT {{r}}.fanout
+    ON CONFLICT (url_id) DO UPDATE SET raters = raters + 1, relevant = relevant + excluded.relevant;
+    INSERT INTO agreement_pairs (answer_a, answer_b, question_id, {', '.join(_COUNTS)})
+    {_PAIR_CELLS} WHERE NOT {{r}}.fanout
+    ON CONFLICT (answer_a, answer_b) DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in _COUNTS)};
+"""
+
+_REMOVE_RATING = f"""
+    UPDATE agreement_items SET raters = raters - 1, relevant = relevant - {{r}}.relevant
+    WHERE url_id = {{r}}.url_id AND NOT {{r}}.fanout;
+    DELETE FROM agreement_items WHERE url_id = {{r}}.url_id AND raters <= 0;
+    UPDATE agreement_pairs SET {', '.join(f'{c} = agreement_pairs.{c} - d.{c}' for c in _COUNTS)}
+    FROM ({_PAIR_CELLS}) d WHERE answer_a = d.a AND answer_b = d.b AND NOT {{r}}.fanout;
+    DELETE FROM agreement_pairs WHERE n00 + n01 + n10 + n11 <= 0
+        AND (answer_a = {{r}}.answer_id OR answer_b = {{r}}.answer_id);
+"""
+
+AGREEMENT_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS url_ratings_agreement_insert AFTER INSERT ON url_ratings WHEN NOT NEW.fanout BEGIN
+    {_ADD_RATING.format(r='NEW')}
+END;
+CREATE TRIGGER IF NOT EXISTS url_ratings_agreement_delete AFTER DELETE ON url_ratings WHEN NOT OLD.fanout BEGIN
+    {_REMOVE_RATING.format(r='OLD')}
+END;
+-- A rating turning into a fan-out copy is left to `rebuild_agreement`; see the module docstring
+CREATE TRIGGER IF NOT EXISTS url_ratings_agreement_update AFTER UPDATE ON url_ratings WHEN NOT NEW.fanout BEGIN
+    {_REMOVE_RATING.format(r='OLD')}
+    {_ADD_RATING.format(r='NEW')}
+END;
+"""
+AGREEMENT_TRIGGER_NAMES = ["url_ratings_agreement_insert", "url_ratings_agreement_delete", "url_ratings_agreement_update"]
+
+def create_agreement(db):
+    "Create the agreement count tables and the triggers that maintain them"
+    # The triggers tell fan-out copies from annotators' own ratings by this flag
+    if "fanout" not in db.t.url_ratings.columns_dict:
+        db.execute("ALTER TABLE url_ratings ADD COLUMN fanout INTEGER NOT NULL DEFAULT 0")
+    db.executescript(AGREEMENT_SCHEMA)
+    db.executescript(AGREEMENT_TRIGGERS)
+
+def rebuild_agreement(db, question_id: int | None = None):
+    "Recompute the agreement counts from the annotators' own `url_ratings`, for one question or all of them"
+    where, args = ("WHERE question_id = ?", [question_id]) if question_id is not None else ("", [])
+    with db.conn:
+        db.execute(f"DELETE FROM agreement_items {where}", args)
+        db.execute(f"DELETE FROM agreement_pairs {where}", args)
+        db.execute(f"""
+            INSERT INTO agreement_items (url_id, question_id, raters, relevant)
+            SELECT u.id, u.question_id, COUNT(*), SUM(r.relevant)
+            FROM url_ratings r JOIN urls u ON u.id = r.url_id
+            WHERE NOT r.fanout {where.replace('WHERE question_id', 'AND u.question_id')}
+            GROUP BY u.id
+        """, args)
+        db.execute(f"""
+            INSERT INTO agreement_pairs (answer_a, answer_b, question_id, {', '.join(_COUNTS)})
+            SELECT answer_a, answer_b, question_id,
+                   SUM(relevant = 0 AND relevant_b = 0), SUM(relevant = 0 AND relevant_b = 1),
+                   SUM(relevant = 1 AND relevant_b = 0), SUM(relevant = 1 AND relevant_b = 1),
+                   SUM(ranked), SUM(ranked * rx), SUM(ranked * ry), SUM(ranked * rx * rx),
+                   SUM(ranked * ry * ry), SUM(ranked * rx * ry)
+            FROM (SELECT x.answer_id AS answer_a, y.answer_id AS answer_b, a.question_id, x.relevant, y.relevant AS relevant_b,
+                         x.rank AS rx, y.rank AS ry, x.rank > 0 AND y.rank > 0 AS ranked
+                  FROM url_ratings x JOIN url_ratings y ON y.url_id = x.url_id AND y.answer_id > x.answer_id AND NOT y.fanout
+                  JOIN answers a ON a.id = x.answer_id
+                  WHERE NOT x.fanout {where.replace('WHERE question_id', 'AND a.question_id')})
+            GROUP BY answer_a, answer_b
+        """, args)
+
+def _ratio(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    return np.divide(num, den, out=np.full(np.shape(num), np.nan), where=den != 0)
+
+def _sums(groups: np.ndarray, keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    "Sum of `values` per entry of the sorted `keys`, by each value's group"
+    return np.bincount(np.searchsorted(keys, groups), weights=values, minlength=len(keys))
+
+def item_agreement(question_ids: np.ndarray, raters: np.ndarray, relevant: np.ndarray, keys: np.ndarray) -> dict:
+    "Fleiss' kappa and Krippendorff's alpha per group in `keys`, from per-URL rater and relevant counts"
+    # Only URLs with two or more ratings carry information about agreement
+    multi = raters >= 2
+    q, n, r = question_ids[multi], raters[multi].astype(np.float64), relevant[multi].astype(np.float64)
+    items, ratings, relevant_total = _sums(q, keys, np.ones(len(q))), _sums(q, keys, n), _sums(q, keys, r)
+    # Fleiss: the share of agreeing rater pairs per URL, against chance agreement from the pooled relevance rate
+    agreeing = _sums(q, keys, (r * (r - 1) + (n - r) * (n - r - 1)) / (n * (n - 1)))
+    observed, p = _ratio(agreeing, items), _ratio(relevant_total, ratings)
+    chance = p ** 2 + (1 - p) ** 2
+    fleiss = _ratio(observed - chance, 1 - chance)
+    # Krippendorff (nominal): alpha = 1 - (N - 1) * o01 / (N0 * N1), from the coincidences of values within URLs
+    disagreeing = _sums(q, keys, r * (n - r) / (n - 1))
+    alpha = 1 - _ratio((ratings - 1) * disagreeing, relevant_total * (ratings - relevant_total))
+    return dict(items=items, fleiss_kappa=fleiss, krippendorff_alpha=alpha)
+
+def pair_agreement(pairs: dict) -> dict:
+    "Cohen's kappa and Spearman's rho for each annotator pair, from the `agreement_pairs` columns"
+    n00, n01, n10, n11 = (pairs[c].astype(np.float64) for c in ("n00", "n01", "n10", "n11"))
+    n = n00 + n01 + n10 + n11
+    observed = _ratio(n00 + n11, n)
+    chance = _ratio((n10 + n11) * (n01 + n11) + (n00 + n01) * (n00 + n10), n * n)
+    # Ranks are already ranks, so their Pearson correlation over shared URLs is Spearman's rho
+    m, sx, sy, sxx, syy, sxy = (pairs[c].astype(np.float64) for c in ("ranked", "sx", "sy", "sxx", "syy", "sxy"))
+    vx, vy = m * sxx - sx * sx, m * syy - sy * sy
+    spearman = _ratio(m * sxy - sx * sy, np.sqrt(np.maximum(vx * vy, 0)))
+    return dict(cohen_kappa=_ratio(observed - chance, 1 - chance), spearman_rho=np.where(m >= 2, spearman, np.nan))
+
+def _group_nanmeans(groups: np.ndarray, keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    defined = ~np.isnan(values)
+    return _ratio(_sums(groups[defined], keys, values[defined]), _sums(groups[defined], keys, np.ones(defined.sum())))
+
+def _matrix(cursor, columns: int) -> np.ndarray:
+    return np.fromiter(itertools.chain.from_iterable(cursor), np.int64).reshape(-1, columns)
+
+def _load(db, question_id: int | None):
+    "Item counts of URLs rated at least twice, and pair counts, for one question or all"
+    where, args = ("AND question_id = ?", [question_id]) if question_id is not None else ("", [])
+    items = _matrix(db.execute(f"SELECT question_id, raters, relevant FROM agreement_items WHERE raters >= 2 {where}", args), 3)
+    pairs = _matrix(db.execute(f"SELECT question_id, {', '.join(_COUNTS)} FROM agreement_pairs WHERE true {where}", args),
+                    1 + len(_COUNTS))
+    return items, dict(question_id=pairs[:, 0], **{c: pairs[:, i + 1] for i, c in enumerate(_COUNTS)})
+
+def _agreement(items: np.ndarray, pairs: dict, groups: tuple[np.ndarray, np.ndarray], keys: np.ndarray) -> dict:
+    "Every agreement figure per entry of `keys`; items and pairs are grouped by the matching `groups` arrays"
+    per_item = item_agreement(groups[0], items[:, 1], items[:, 2], keys)
+    per_pair = pair_agreement(pairs)
+    counted = pairs['n00'] + pairs['n01'] + pairs['n10'] + pairs['n11'] > 0
+    return dict(per_item, pairs=_sums(groups[1][counted], keys, np.ones(counted.sum())),
+                **{name: _group_nanmeans(groups[1], keys, values) for name, values in per_pair.items()})
+
+def _first(values: dict) -> dict:
+    "The first group of an `_agreement` result as plain numbers, with None for undefined figures"
+    return {name: int(v[0]) if name in ("items", "pairs") else None if np.isnan(v[0]) else float(v[0])
+            for name, v in values.items()}
+
+def question_agreement(db, question_id: int) -> dict:
+    "Agreement among one question's annotators; figures are None where fewer than two annotators overlap"
+    items, pairs = _load(db, question_id)
+    keys = np.array([question_id])
+    return _first(_agreement(items, pairs, (items[:, 0], pairs['question_id']), keys))
+
+def dataset_agreement(db) -> dict:
+    """Agreement per question and over the whole dataset.
+
+    Dataset kappa and alpha pool every URL; Cohen's kappa and Spearman's rho are means over all annotator pairs."""
+    items, pairs = _load(db, None)
+    question_ids = np.union1d(items[:, 0], pairs['question_id'])
+    per_question = _agreement(items, pairs, (items[:, 0], pairs['question_id']), question_ids)
+    # The whole dataset is a single group
+    everything = (np.zeros(len(items), np.int64), np.zeros(len(pairs['question_id']), np.int64))
+    overall = _agreement(items, pairs, everything, np.zeros(1, np.int64))
+    return dict(question_ids=question_ids, per_question=per_question, overall=_first(overall))
@@ -0,0 +1,218 @@
+"""Similarity scores between the user, LLM and final answer of every answer row.
+
+For each row the LLM answer is scored against the user's answer and against
+the final answer, and the user's answer against the final answer, with token
+F1, ROUGE-L and TF-IDF cosine similarity. Rows are scored in batches: texts
+become token-id arrays once, F1 and cosine come from sparse bag-of-words
+vectors keyed `pair * vocabulary + token` and intersected in one call, and
+the ROUGE-L longest common subsequence runs its dynamic programme one row at
+a time over a whole batch of pairs, padded to similar lengths.
+
+`answer_scores` holds one row per scored answer. Triggers drop that row when
+any of the three texts change, so `score_missing` only ever scores new or
+edited answers. Document frequencies for the IDF weights accumulate in
+`answer_score_terms` as rows are scored. When a score is dropped the texts it
+was counted for are kept in `answer_score_retired`, and the next
+`score_missing` subtracts them again, so the counts always match the scored
+texts.
+"""
+import json, re
+from collections import Counter
+from itertools import chain
+from typing import List
+
+import numpy as np
+
+# Only texts that were scored were counted; an answer edited twice before it is rescored is retired once
+_RETIRE = """
+    INSERT INTO answer_score_retired SELECT OLD.user_answer, OLD.llm_answer, OLD.final_answer
+    WHERE EXISTS (SELECT 1 FROM answer_scores WHERE answer_id = OLD.id);
+    DELETE FROM answer_scores WHERE answer_id = OLD.id;
+"""
+
+SCORE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS answer_scores (
+    answer_id INTEGER PRIMARY KEY,
+    question_id INTEGER NOT NULL,
+    llm_user_f1 REAL, llm_user_rouge_l REAL, llm_user_cosine REAL,
+    llm_final_f1 REAL, llm_final_rouge_l REAL, llm_final_cosine REAL,
+    user_final_f1 REAL, user_final_rouge_l REAL, user_final_cosine REAL
+);
+CREATE INDEX IF NOT EXISTS idx_answer_scores_question ON answer_scores(question_id);
+
+-- Document frequency per token; the empty token counts the documents themselves
+CREATE TABLE IF NOT EXISTS answer_score_terms (
+    term TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+
+-- Texts whose scores were dropped, until their terms are taken out of the document frequencies
+CREATE TABLE IF NOT EXISTS answer_score_retired (
+    user_answer TEXT, llm_answer TEXT, final_answer TEXT
+);
+
+CREATE TRIGGER IF NOT EXISTS answer_scores_stale AFTER UPDATE OF user_answer, llm_answer, final_answer ON answers
+WHEN OLD.user_answer IS NOT NEW.user_answer OR OLD.llm_answer IS NOT NEW.llm_answer OR OLD.final_answer IS NOT NEW.final_answer
+BEGIN{_RETIRE}END;
+
+CREATE TRIGGER IF NOT EXISTS answer_scores_delete AFTER DELETE ON answers BEGIN{_RETIRE}END;
+"""
+SCORE_TRIGGERS = ["answer_scores_stale", "answer_scores_delete"]
+
+# (candidate, reference) columns of `answers` for each scored pair, and the column prefix it is stored under
+PAIRS = [("llm_answer", "user_answer", "llm_user"), ("llm_answer", "final_answer", "llm_final"),
+         ("user_answer", "final_answer", "user_final")]
+METRICS = ["f1", "rouge_l", "cosine"]
+SCORE_COLUMNS = [f"{prefix}_{metric}" for _, _, prefix in PAIRS for metric in METRICS]
+
+# Longer answers are cut off for ROUGE-L, whose cost grows with the product of the two lengths
+MAX_LCS_TOKENS = 512
+LCS_CHUNK = 256
+
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+def overlap_and_cosine(cand: List[np.ndarray], ref: List[np.ndarray], idf: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    "Clipped token overlap and TF-IDF cosine for each `(cand[i], ref[i])` pair of token-id arrays"
+    n, vocab = len(cand), len(idf)
+    def bag(docs):
+        pair = np.repeat(np.arange(n), [len(d) for d in docs])
+        keys, counts = np.unique(pair * vocab + np.concatenate(docs + [np.zeros(0, np.int64)]), return_counts=True)
+        weights = counts * idf[keys % vocab]
+        norms = np.sqrt(np.bincount(keys // vocab, weights=weights ** 2, minlength=n))
+        return keys, counts, weights, norms
+    c_keys, c_counts, c_weights, c_norms = bag(cand)
+    r_keys, r_counts, r_weights, r_norms = bag(ref)
+    shared, ci, ri = np.intersect1d(c_keys, r_keys, assume_unique=True, return_indices=True)
+    pair = shared // vocab
+    overlap = np.bincount(pair, weights=np.minimum(c_counts[ci], r_counts[ri]), minlength=n)
+    dot = np.bincount(pair, weights=c_weights[ci] * r_weights[ri], minlength=n)
+    norms = c_norms * r_norms
+    return overlap, np.divide(dot, norms, out=np.zeros(n), where=norms > 0)
+
+def lcs_lengths(cand: List[np.ndarray], ref: List[np.ndarray]) -> np.ndarray:
+    "Longest common subsequence length of each `(cand[i], ref[i])` pair"
+    n = len(cand)
+    lengths = np.zeros(n)
+    # Pairs of similar lengths share a chunk, so little of each padded matrix is wasted
+    order = sorted(range(n), key=lambda i: (len(cand[i]), len(ref[i])))
+    for start in range(0, n, LCS_CHUNK):
+        chunk = order[start:start + LCS_CHUNK]
+        rows, cols = max(len(cand[i]) for i in chunk), max(len(ref[i]) for i in chunk)
+        if not rows or not cols: continue
+        # Different padding values on each side never match each other
+        a, b = np.full((len(chunk), rows), -1), np.full((len(chunk), cols), -2)
+        for k, i in enumerate(chunk):
+            a[k, :len(cand[i])], b[k, :len(ref[i])] = cand[i], ref[i]
+        # L[i][j] = max(L[i-1][j], L[i][j-1], L[i-1][j-1] + match), i.e. a running max along j of the first and last
+        prev = np.zeros((len(chunk), cols + 1), np.int32)
+        for i in range(rows):
+            step = np.maximum(prev[:, 1:], prev[:, :-1] + (a[:, i:i + 1] == b))
+            prev[:, 1:] = np.maximum.accumulate(step, axis=1)
+        lengths[chunk] = prev[:, -1]
+    return lengths
+
+def f_measure(matched: np.ndarray, cand_len: np.ndarray, ref_len: np.ndarray) -> np.ndarray:
+    "Harmonic mean of `matched / cand_len` and `matched / ref_len`, which is `2 * matched / (cand_len + ref_len)`"
+    total = cand_len + ref_len
+    return np.divide(2 * matched, total, out=np.zeros(len(matched)), where=total > 0)
+
+def _term_counts(tokens: List[List[str]]) -> dict[str, int]:
+    "Number of documents of `tokens` each term occurs in, under `''` the number of non-empty documents"
+    counts = Counter(chain.from_iterable(map(set, tokens)))
+    counts[""] = sum(1 for t in tokens if t)
+    return counts
+
+def _forget_retired(db):
+    "Take the texts of dropped scores out of the document frequencies"
+    rows = db.execute("SELECT user_answer, llm_answer, final_answer FROM answer_score_retired").fetchall()
+    if not rows: return
+    counts = _term_counts([tokenize(text) for row in rows for text in row])
+    db.conn.cursor().executemany("UPDATE answer_score_terms SET df = df - ? WHERE term = ?",
+                                 [(n, term) for term, n in counts.items()])
+    db.execute("DELETE FROM answer_score_retired")
+
+def _idf(db, tokens: List[List[str]]) -> dict[str, float]:
+    "Add each non-empty document of `tokens` to the document frequencies and return the updated IDF of its terms"
+    counts = _term_counts(tokens)
+    db.conn.cursor().executemany(
+        "INSERT INTO answer_score_terms (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+        list(counts.items()))
+    df = dict(db.execute("SELECT t.term, t.df FROM answer_score_terms t JOIN json_each(?) j ON t.term = j.value",
+                         [json.dumps(list(counts))]).fetchall())
+    documents = df.pop("")
+    # Smoothed as if one extra document contained every term, so no weight is zero or infinite
+    return {term: float(np.log((1 + documents) / (1 + n)) + 1) for term, n in df.items()}
+
+def score_rows(db, rows) -> List[tuple]:
+    "Score `(id, question_id, user_answer, llm_answer, final_answer)` rows; one result tuple per row for `answer_scores`"
+    fields = {"user_answer": 2, "llm_answer": 3, "final_answer": 4}
+    tokens = {(r[0], f): tokenize(r[i]) for r in rows for f, i in fields.items()}
+    idf = _idf(db, list(tokens.values()))
+    vocab = {term: k for k, term in enumerate(idf)}
+    ids = {key: np.fromiter((vocab[t] for t in doc), np.int64, len(doc)) for key, doc in tokens.items()}
+    idf_array = np.fromiter(idf.values(), np.float64, len(idf))
+
+    scores = np.full((len(rows), len(SCORE_COLUMNS)), np.nan)
+    for p, (cand_field, ref_field, _) in enumerate(PAIRS):
+        # Pairs with an empty side stay NULL
+        scored = [k for k, r in enumerate(rows) if tokens[(r[0], cand_field)] and tokens[(r[0], ref_field)]]
+        if not scored: continue
+        cand = [ids[(rows[k][0], cand_field)] for k in scored]
+        ref = [ids[(rows[k][0], ref_field)] for k in scored]
+        cand_len, ref_len = np.array([len(c) for c in cand]), np.array([len(r) for r in ref])
+        overlap, cosine = overlap_and_cosine(cand, ref, idf_array)
+        lcs = lcs_lengths([c[:MAX_LCS_TOKENS] for c in cand], [r[:MAX_LCS_TOKENS] for r in ref])
+        col = p * len(METRICS)
+        scores[scored, col] = f_measure(overlap, cand_len, ref_len)
+        scores[scored, col + 1] = f_measure(lcs, np.minimum(cand_len, MAX_LCS_TOKENS), np.minimum(ref_len, MAX_LCS_TOKENS))
+        scores[scored, col + 2] = cosine
+    return [(r[0], r[1], *[None if np.isnan(v) else float(v) for v in s]) for r, s in zip(rows, scores.tolist())]
+
+def score_missing(db, question_id: int | None = None, batch_size: int = 2000, limit: int | None = None) -> int:
+    "Score answers that have no scores yet, optionally only one question's and at most `limit`, and return how many"
+    where, args = ("AND a.question_id = ?", [question_id]) if question_id is not None else ("", [])
+    count = 0
+    while (limit is None or count < limit) and (rows := db.execute(f"""
+            SELECT a.id, a.question_id, a.user_answer, a.llm_answer, a.final_answer FROM answers a
+            WHERE a.id NOT IN (SELECT answer_id FROM answer_scores) {where}
+            ORDER BY a.id LIMIT ?""", [*args, batch_size if limit is None else min(batch_size, limit - count)]).fetchall()):
+        with db.conn:
+            _forget_retired(db)
+            db.conn.cursor().executemany(
+                f"INSERT OR REPLACE INTO answer_scores VALUES ({', '.join('?' * (2 + len(SCORE_COLUMNS)))})",
+                score_rows(db, rows))
+        count += len(rows)
+    return count
+
+def rescore_all(db, batch_size: int = 2000) -> int:
+    "Drop all scores and document frequencies and score every answer again"
+    with db.conn:
+        db.execute("DELETE FROM answer_scores")
+        db.execute("DELETE FROM answer_score_terms")
+        db.execute("DELETE FROM answer_score_retired")
+    return score_missing(db, batch_size=batch_size)
+
+def recount_terms(db, batch_size: int = 2000):
+    "Count the document frequencies again from the texts of the scored answers"
+    counts, last = Counter(), 0
+    while rows := db.execute("""
+            SELECT a.id, a.user_answer, a.llm_answer, a.final_answer FROM answers a JOIN answer_scores s ON s.answer_id = a.id
+            WHERE a.id > ? ORDER BY a.id LIMIT ?""", [last, batch_size]).fetchall():
+        counts.update(_term_counts([tokenize(text) for row in rows for text in row[1:]]))
+        last = rows[-1][0]
+    with db.conn:
+        db.execute("DELETE FROM answer_score_terms")
+        db.execute("DELETE FROM answer_score_retired")
+        db.conn.cursor().executemany("INSERT INTO answer_score_terms (term, df) VALUES (?, ?)", list(counts.items()))
+
+def score_summary(db, question_id: int | None = None) -> dict:
+    "Mean of every score over the answers where it is defined, plus scored and pending counts, for one question or all"
+    where, args = ("question_id = ?", [question_id]) if question_id is not None else ("1", [])
+    means = db.q(f"SELECT COUNT(*) AS scored, {', '.join(f'AVG({c}) AS {c}' for c in SCORE_COLUMNS)} "
+                 f"FROM answer_scores WHERE {where}", args)[0]
+    pending = db.execute(f"SELECT COUNT(*) FROM answers WHERE id NOT IN (SELECT answer_id FROM answer_scores) AND {where}",
+                         args).fetchone()[0]
+    return dict(means, pending=pending)
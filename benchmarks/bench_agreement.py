@@ -0,0 +1,155 @@
+"""Time inter-annotator agreement as the number of annotators per question grows.
+
+For each `--annotators` count, one question with `--urls` URLs is rated by
+that many annotators, each rating every URL. It reports the cost the
+triggers add to each rating write, against recounting the question from
+`url_ratings` after every write. It also times the per-question agreement
+read behind /top-answers/{id}, against a pairwise Python loop over the raw
+ratings; both give the same figures.
+
+It then times single clicks through the app, on a question with
+`--click-answers` answers and `--click-urls` URLs, all rated by their own
+annotator. A click on /questions/{id}/final-answer/{aid} re-rates a single
+answer, which pairs with every other annotator; /top-answers/{id} is
+rendered afresh after each, with the fragment cache off. A click on
+/best-answers/{id}/rate-sources then copies one set of ratings onto every
+answer: the first replaces all the annotators' own ratings, later ones only
+the copies. Last, it times the dataset-wide computation on a generated
+database.
+
+Usage: python benchmarks/bench_agreement.py [--annotators 2 8 32 128] [--urls 20] [--click-answers 400] [--click-urls 10] [--scale 100k]
+"""
+import argparse, asyncio, importlib, itertools, os, random, statistics, sys, tempfile, time
+from dataclasses import replace
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+import numpy as np
+from fastlite import database
+
+from agreement import dataset_agreement, question_agreement, rebuild_agreement
+from config import AppConfig
+from generate import SCALES, open_generated
+from migrations import migrate
+
+def rated_question(annotators: int, n_urls: int, seed: int, recount: bool, path: str = ":memory:") -> tuple:
+    "A fresh database with one question rated by `annotators`, and the seconds spent writing its ratings"
+    rng = random.Random(seed)
+    db = database(path)
+    migrate(db)
+    db.execute("INSERT INTO questions (id, text) VALUES (1, 'q')")
+    db.conn.cursor().executemany("INSERT INTO urls (id, question_id, url, source) VALUES (?, 1, ?, 'user')",
+                                 [(u, f"https://example.com/{u}") for u in range(1, n_urls + 1)])
+    elapsed = 0.0
+    for a in range(1, annotators + 1):
+        db.execute("INSERT INTO answers (id, question_id, user_answer, llm_answer, llm_sources, final_answer, url_ranking, "
+                   "url_relevance) VALUES (?, 1, '', '', '', '', '', '')", [a])
+        ranks = rng.sample(range(1, n_urls + 1), n_urls)
+        ratings = [(a, u, rank, int(rng.random() < 0.6)) for u, rank in zip(range(1, n_urls + 1), ranks)]
+        start = time.perf_counter()
+        with db.conn:
+            db.conn.cursor().executemany("INSERT INTO url_ratings (answer_id, url_id, rank, relevant) VALUES (?, ?, ?, ?)", ratings)
+        if recount: rebuild_agreement(db, 1)
+        elapsed += time.perf_counter() - start
+    return db, elapsed
+
+def loop_agreement(db) -> tuple[float, float]:
+    "Mean pairwise Cohen's kappa and Spearman's rho, one annotator pair at a time"
+    by_answer = {}
+    for answer_id, url_id, rank, relevant in db.execute("SELECT answer_id, url_id, rank, relevant FROM url_ratings"):
+        by_answer.setdefault(answer_id, {})[url_id] = (rank, relevant)
+    kappas, rhos = [], []
+    for a, b in itertools.combinations(sorted(by_answer), 2):
+        shared = by_answer[a].keys() & by_answer[b].keys()
+        x, y = [by_answer[a][u][1] for u in shared], [by_answer[b][u][1] for u in shared]
+        px, py = sum(x) / len(x), sum(y) / len(y)
+        observed, chance = sum(i == j for i, j in zip(x, y)) / len(x), px * py + (1 - px) * (1 - py)
+        if chance != 1: kappas.append((observed - chance) / (1 - chance))
+        rx, ry = [by_answer[a][u][0] for u in shared], [by_answer[b][u][0] for u in shared]
+        rhos.append(np.corrcoef(rx, ry)[0, 1])
+    return float(np.mean(kappas)), float(np.mean(rhos))
+
+async def clicks(app, n_answers: int, n_urls: int, n: int, seed: int) -> dict:
+    "Milliseconds per click on each rating route, and per render of the question's /top-answers page"
+    rng = random.Random(seed)
+    times = dict(final_answer=[], top_answers=[], rate_sources=[])
+    def form():
+        # Fresh ratings each time, so that every click changes every rating it writes
+        ranks = rng.sample(range(1, n_urls + 1), n_urls)
+        return {**{f"rank_{u}": str(r) for u, r in zip(range(1, n_urls + 1), ranks)},
+                **{f"relevant_{u}": "on" for u in range(1, n_urls + 1) if rng.random() < 0.6}}
+    async def timed(name, request):
+        start = time.perf_counter()
+        r = await request
+        times[name].append((time.perf_counter() - start) * 1000)
+        assert r.status_code == 200, (name, r.status_code)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for i in range(n):
+            await timed("final_answer", client.post(f"/questions/1/final-answer/{rng.randint(1, n_answers)}",
+                                                    data=dict(form(), final_answer=f"final {i}")))
+            await timed("top_answers", client.get("/top-answers/1"))
+        for i in range(n): await timed("rate_sources", client.post("/best-answers/1/rate-sources", data=form()))
+    return dict(first_rate_sources=times["rate_sources"][0],
+                **{name: statistics.median(ms[1:] if name == "rate_sources" else ms) for name, ms in times.items()})
+
+def best_of(repeat: int, fn, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--annotators", type=int, nargs="+", default=[2, 8, 32, 128])
+    parser.add_argument("--urls", type=int, default=20, help="URLs per question, each rated by every annotator")
+    parser.add_argument("--click-answers", type=int, default=400, help="Answers to the question the timed clicks rate")
+    parser.add_argument("--click-urls", type=int, default=10)
+    parser.add_argument("--clicks", type=int, default=10, help="Timed clicks per route")
+    parser.add_argument("--scale", choices=SCALES, default="100k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache-dir", default=os.path.join(ROOT, "benchmarks", ".data"),
+                        help="Where generated databases are kept between runs")
+    args = parser.parse_args()
+
+    print(f"{'annotators':>10}{'write/rating us':>17}{'recount/rating us':>19}{'pairs':>8}{'read ms':>9}{'loop ms':>9}")
+    for m in args.annotators:
+        db, write_s = rated_question(m, args.urls, args.seed, recount=False)
+        _, recount_s = rated_question(m, args.urls, args.seed, recount=True)
+        read_s, result = best_of(args.repeat, question_agreement, db, 1)
+        loop_s, (kappa, rho) = best_of(args.repeat, loop_agreement, db)
+        assert np.isclose(result['cohen_kappa'], kappa) and np.isclose(result['spearman_rho'], rho)
+        ratings = m * args.urls
+        print(f"{m:>10}{write_s / ratings * 1e6:>17.1f}{recount_s / ratings * 1e6:>19.1f}{result['pairs']:>8}"
+              f"{read_s * 1000:>9.2f}{loop_s * 1000:>9.2f}")
+
+    main_module = importlib.import_module("main")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "clicks.db")
+        rated_question(args.click_answers, args.click_urls, args.seed, recount=False, path=path)[0].conn.close()
+        app = main_module.create_app(replace(AppConfig.from_env(), db_path=path, fragment_cache=False, pregenerate=False))
+        ms = asyncio.run(clicks(app, args.click_answers, args.click_urls, args.clicks, args.seed))
+        asyncio.run(main_module.close_resources())
+    print(f"\none question, {args.click_answers} answers x {args.click_urls} URLs, median of {args.clicks} clicks per route")
+    print(f"POST final-answer  {ms['final_answer']:9.1f} ms  ({args.click_urls} ratings rewritten)")
+    print(f"GET top-answers    {ms['top_answers']:9.1f} ms  (agreement over "
+          f"{args.click_answers * (args.click_answers - 1) // 2} annotator pairs)")
+    print(f"POST rate-sources  {ms['first_rate_sources']:9.1f} ms  first, replacing "
+          f"{args.click_answers * args.click_urls} ratings of {args.click_answers} annotators")
+    print(f"POST rate-sources  {ms['rate_sources']:9.1f} ms  later, rewriting the copies")
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    db = open_generated(os.path.join(args.cache_dir, f"{args.scale}-seed{args.seed}.db"), args.scale, args.seed)
+    dataset_s, result = best_of(args.repeat, dataset_agreement, db)
+    rebuild_s, _ = best_of(1, rebuild_agreement, db)
+    overall = result['overall']
+    print(f"\nscale {args.scale}: {overall['items']} URLs rated twice or more, {overall['pairs']} annotator pairs")
+    print(f"dataset agreement   {dataset_s * 1000:9.1f} ms")
+    print(f"recount from ratings{rebuild_s * 1000:9.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Throughput as the number of simultaneous annotators grows, with and without the connection pool.
+
+Runs the load test's route mix against a generated database at each
+`--concurrency` level, once per `--readers` setting: 0 runs every query inline
+on the event loop over a single connection, as before the pool existed; other
+values read through that many pooled connections while writes go through the
+single writer thread. Each setting runs in a fresh process on a fresh copy of
+the database, so they start from identical rows. Besides requests per second
+it reports event-loop lag, how late a 5 ms timer fires: a loop blocked by
+SQLite cannot serve anyone else, including open SSE streams. Run it at
+`--scale 100k` or larger, where queries rather than rendering dominate.
+
+Usage: python benchmarks/bench_concurrency.py [--scale 1k] [--readers 0 4] [--concurrency 1 4 16 64] [--requests 1000]
+"""
+import argparse, asyncio, importlib, json, os, shutil, statistics, subprocess, sys, tempfile, time
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate import SCALES, open_generated
+from load import drive, route_mix
+
+async def measure(app, mix, concurrency: int, n_requests: int, seed: int) -> tuple[float, dict, list[float]]:
+    "`drive` while sampling how late a 5 ms timer fires, i.e. how long the event loop goes without a turn"
+    loop, lags = asyncio.get_running_loop(), []
+    expected = loop.time()
+    async def sample():
+        nonlocal expected
+        while True:
+            expected = loop.time() + 0.005
+            await asyncio.sleep(0.005)
+            lags.append(max(0.0, loop.time() - expected))
+    sampler = asyncio.create_task(sample())
+    try: elapsed, routes = await drive(app, mix, concurrency, n_requests, seed)
+    finally: sampler.cancel()
+    # A loop that never yielded to the sampler is as late as the whole run
+    lags.append(max(0.0, loop.time() - expected))
+    return elapsed, routes, lags
+
+def run_setting(source: str, scale: str, concurrency: list[int], n_requests: int, seed: int) -> list[dict]:
+    "Drive the app once per concurrency level in this process; RAG_DB_READERS is already set"
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "data"))
+        shutil.copy(source, os.path.join(tmp, "data", "rag.db"))
+        os.chdir(tmp)
+        main_module = importlib.import_module("main")
+        app = main_module.create_app()
+        main_module.open_resources()
+        # The client side has a connection of its own; the app's writer connection belongs to its writer thread
+        mix = route_mix(main_module.pool.open(), SCALES[scale])
+        runs = []
+        for c in concurrency:
+            elapsed, routes, lags = asyncio.run(measure(app, mix, c, n_requests, seed))
+            lag_ms = sorted(l * 1000 for l in lags) or [0.0]
+            runs.append(dict(concurrency=c, throughput=n_requests / elapsed, errors=sum(r['errors'] for r in routes.values()),
+                             loop_lag_p99_ms=statistics.quantiles(lag_ms, n=100)[98] if len(lag_ms) > 1 else lag_ms[0],
+                             loop_lag_max_ms=lag_ms[-1]))
+        main_module.pool.close()
+        return runs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--readers", type=int, nargs="+", default=[0, 4])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per concurrency level")
+    parser.add_argument("--cache-dir", default=os.path.join(ROOT, "benchmarks", ".data"),
+                        help="Where generated databases are kept between runs")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    source = os.path.join(args.cache_dir, f"{args.scale}-seed{args.seed}.db")
+    if args.child:
+        print(json.dumps(run_setting(source, args.scale, args.concurrency, args.requests, args.seed)))
+        return
+
+    start = time.perf_counter()
+    open_generated(source, args.scale, args.seed).conn.close()
+    print(f"{args.scale} database ready in {time.perf_counter() - start:.1f}s ({source})")
+
+    results = {}
+    for readers in args.readers:
+        # A process per setting, since main serves one app, with one pool, per process
+        env = dict(os.environ, RAG_DB_READERS=str(readers), RAG_STREAM_LLM=os.environ.get("RAG_STREAM_LLM", "0"))
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", "--scale", args.scale, "--seed", str(args.seed),
+               "--requests", str(args.requests), "--cache-dir", args.cache_dir, "--concurrency", *map(str, args.concurrency)]
+        out = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+        results[readers] = json.loads(out.strip().splitlines()[-1])
+
+    print(f"\n{'readers':>8}{'annotators':>12}{'req/s':>10}{'loop lag p99 ms':>17}{'max ms':>9}{'errors':>8}")
+    for readers, runs in results.items():
+        for r in runs:
+            print(f"{readers:>8}{r['concurrency']:>12}{r['throughput']:>10.1f}{r['loop_lag_p99_ms']:>17.1f}"
+                  f"{r['loop_lag_max_ms']:>9.1f}{r['errors']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Cost of revalidating a question page with If-None-Match, against rendering it in full.
+
+Requests `--pages` random question pages on each conditional route of a
+generated database, through httpx's ASGI transport with gzip accepted. Each
+route is timed three ways:
+- a full render with the fragment cache off;
+- a render from a warm fragment cache;
+- a revalidation with the page's own ETag, which is answered with a 304.
+Every request logs the SQL it ran. The benchmark checks that no 304 ran a
+statement on the answers, urls or url_ratings tables. GETs do not write, so
+the generated database is used in place.
+
+Usage: python benchmarks/bench_conditional.py [--scale 100k] [--pages 300]
+"""
+import argparse, asyncio, importlib, logging, os, random, re, statistics, sys, time
+from dataclasses import replace
+
+import httpx
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import AppConfig
+from generate import SCALES, open_generated
+
+ROUTES = ["/questions/{id}", "/best-answers/{id}", "/top-answers/{id}"]
+PAGE_TABLES = re.compile(r"\b(answers|urls|url_ratings)\b", re.I)
+
+class QueryLog(logging.Handler):
+    "Collects the statement count and statements of each request that `Metrics` logs, in request order"
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+    def emit(self, record):
+        self.requests.append((record.args[3], record.args[-1]))
+
+async def timed(app, paths: list[str], etags: dict | None = None) -> tuple[list[float], list[int], list[int], dict]:
+    "Request each path in turn; latencies, statuses, bytes on the wire and the ETag of each path"
+    latencies, statuses, sizes, tags = [], [], [], {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                 headers={"accept-encoding": "gzip"}) as client:
+        for path in paths:
+            headers = {"if-none-match": etags[path]} if etags else {}
+            start = time.perf_counter()
+            r = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(r.status_code)
+            sizes.append(int(r.headers.get("content-length", 0)))
+            tags[path] = r.headers.get("etag")
+    return latencies, statuses, sizes, tags
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="100k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pages", type=int, default=300, help="Questions requested per route and mode")
+    parser.add_argument("--cache-dir", default=os.path.join(ROOT, "benchmarks", ".data"),
+                        help="Where generated databases are kept between runs")
+    args = parser.parse_args()
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    source = os.path.join(args.cache_dir, f"{args.scale}-seed{args.seed}.db")
+    open_generated(source, args.scale, args.seed).conn.close()
+
+    # A 0 ms threshold logs every request with its statements
+    queries = QueryLog()
+    metrics_log = logging.getLogger("rag-eval.metrics")
+    metrics_log.addHandler(queries)
+    metrics_log.propagate = False
+    main_module = importlib.import_module("main")
+    rng = random.Random(args.seed)
+    ids = [rng.randint(1, SCALES[args.scale]) for _ in range(args.pages)]
+
+    print(f"{args.pages} pages per route at scale {args.scale}, gzip accepted (medians; p95 in brackets)")
+    print(f"{'route':<20}{'mode':<14}{'ms':>16}{'bytes':>8}{'SQL/request':>13}")
+    for route in ROUTES:
+        paths = [route.format(id=i) for i in ids]
+        results = {}
+        for mode, fragment_cache in [("full render", False), ("cached", True), ("revalidate", True)]:
+            app = main_module.create_app(replace(AppConfig.from_env(), db_path=source, slow_request_ms=0.0,
+                                                 fragment_cache=fragment_cache, pregenerate=False))
+            etags = None
+            if mode != "full render":
+                # Warms the fragment cache, and collects the ETags a browser would keep
+                _, _, _, etags = asyncio.run(timed(app, paths))
+                if mode == "cached": etags = None
+            queries.requests.clear()
+            latencies, statuses, sizes, _ = asyncio.run(timed(app, paths, etags))
+            asyncio.run(main_module.close_resources())
+            expected = 304 if mode == "revalidate" else 200
+            assert all(s == expected for s in statuses), (mode, route, set(statuses))
+            if mode == "revalidate":
+                touched = {t.lower() for _, statements in queries.requests for t in PAGE_TABLES.findall(statements)}
+                assert not touched, f"304s on {route} read {touched}"
+            ms = sorted(l * 1000 for l in latencies)
+            results[mode] = statistics.median(ms)
+            print(f"{route:<20}{mode:<14}{statistics.median(ms):>7.2f} [{ms[int(len(ms) * 0.95) - 1]:>6.2f}]"
+                  f"{statistics.median(sizes):>8.0f}{statistics.fmean(n for n, _ in queries.requests):>13.1f}")
+        print(f"{'':<20}revalidation is {results['full render'] / results['revalidate']:.1f}x faster than a full render, "
+              f"{results['cached'] / results['revalidate']:.1f}x faster than a cached one")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Build and query the local BM25 corpus index over a seeded synthetic corpus.
+
+Writes `--docs` documents under the cache directory, once per seed and size.
+Each document mixes common filler words with topic words drawn from the
+generator's made-up vocabulary. Queries are generated questions about the
+same topics. The build is timed end to end, from reading the files to
+swapping in the finished index. Queries run one at a time against the
+memory-mapped index. A scan that scores every document for each query is
+timed on a sample of the queries as the baseline; both return the same
+documents.
+
+Usage: python benchmarks/bench_corpus.py [--docs 100000] [--queries 2000] [-k 5]
+"""
+import argparse, math, os, random, shutil, statistics, sys, time
+from collections import Counter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from answer_scores import tokenize
+from corpus import CorpusIndex, build_index, corpus_files, read_document
+from generate import TEMPLATES, WORDS, vocabulary
+
+def write_corpus(path: str, n_docs: int, seed: int) -> list[str]:
+    "Write the synthetic corpus unless it is already there, and return its topic vocabulary"
+    rng = random.Random(seed)
+    topics = vocabulary(rng)
+    if os.path.isdir(path) and len(os.listdir(path)) == n_docs: return topics
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    for i in range(n_docs):
+        words = rng.choices(WORDS, k=rng.randint(50, 400)) + rng.choices(rng.sample(topics, 8), k=rng.randint(5, 40))
+        rng.shuffle(words)
+        with open(os.path.join(path, f"doc{i:07d}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"https://corpus.example.org/doc{i}\n{' '.join(words)}\n")
+    return topics
+
+def scan(documents: list[Counter], lengths: list[int], df: Counter, query: str, k: int, k1=1.2, b=0.75) -> list[int]:
+    "BM25 by scoring every document in turn"
+    n, average = len(documents), sum(lengths) / len(lengths)
+    terms = set(tokenize(query))
+    scores = []
+    for i, (counts, length) in enumerate(zip(documents, lengths)):
+        score = sum(math.log1p((n - df[t] + 0.5) / (df[t] + 0.5)) * counts[t] * (k1 + 1)
+                    / (counts[t] + k1 * (1 - b + b * length / average)) for t in terms if counts[t])
+        if score > 0: scores.append((-score, i))
+    return [i for _, i in sorted(scores)[:k]]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--scan-queries", type=int, default=20, help="Queries also answered by the full scan")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", default=os.path.join(ROOT, "benchmarks", ".data"),
+                        help="Where the generated corpus and index are kept")
+    args = parser.parse_args()
+
+    corpus_dir = os.path.join(args.cache_dir, f"corpus-{args.docs}-seed{args.seed}")
+    index_dir = corpus_dir + ".index"
+    start = time.perf_counter()
+    topics = write_corpus(corpus_dir, args.docs, args.seed)
+    print(f"{args.docs} documents ready in {time.perf_counter() - start:.1f}s ({corpus_dir})")
+
+    start = time.perf_counter()
+    meta = build_index(corpus_dir, index_dir)
+    build_s = time.perf_counter() - start
+    size = sum(os.path.getsize(os.path.join(index_dir, f)) for f in os.listdir(index_dir))
+    print(f"build              {build_s:9.2f} s  ({meta['documents'] / build_s:.0f} docs/s, {meta['postings']} postings, "
+          f"{size / 2**20:.1f} MiB on disk)")
+
+    start = time.perf_counter()
+    index = CorpusIndex(index_dir)
+    print(f"open               {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+    rng = random.Random(args.seed + 1)
+    queries = [rng.choice(TEMPLATES).format(t=" ".join(rng.sample(topics, 3))) for _ in range(args.queries)]
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, args.k)
+        latencies.append(time.perf_counter() - start)
+    ms = sorted(l * 1000 for l in latencies)
+    print(f"query p50          {statistics.median(ms):9.2f} ms")
+    print(f"query p99          {ms[int(len(ms) * 0.99) - 1]:9.2f} ms  ({len(ms) / sum(latencies):.0f} queries/s)")
+
+    documents, lengths = [], []
+    for path in corpus_files(corpus_dir):
+        tokens = tokenize(read_document(path)[1])
+        documents.append(Counter(tokens))
+        lengths.append(len(tokens))
+    df = Counter(t for counts in documents for t in counts)
+    start = time.perf_counter()
+    for query in queries[:args.scan_queries]:
+        expected = [index.urls[i] for i in scan(documents, lengths, df, query, args.k)]
+        assert [url for url, _ in index.search(query, args.k)] == expected, query
+    scan_ms = (time.perf_counter() - start) * 1000 / args.scan_queries
+    print(f"full scan          {scan_ms:9.2f} ms per query  ({scan_ms / statistics.median(ms):.0f}x the indexed median)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Per-route query timings on a large database, before and after the index migration.
+
+Usage: python benchmarks/bench_indexes.py [--questions 100000]
+"""
+import argparse, os, random, sys, tempfile, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastlite import database
+from migrations import migrate
+
+def populate(db, n_questions: int, seed: int = 0):
+    rng = random.Random(seed)
+    db.begin()
+    db.conn.cursor().executemany("INSERT INTO questions (id, text) VALUES (?, ?)",
+        ((i, f"Question {i} about topic {rng.randrange(1000)}?") for i in range(1, n_questions + 1)))
+    db.conn.cursor().executemany("INSERT INTO urls (question_id, url, source) VALUES (?, ?, ?)",
+        ((q, f"https://example.com/{q}/{k}", "user") for q in range(1, n_questions + 1) for k in range(3)))
+    db.conn.cursor().executemany(
+        "INSERT INTO answers (question_id, user_answer, llm_answer, llm_sources, final_answer, url_ranking, url_relevance) "
+        "VALUES (?, 'user', 'llm', '', '', '', '')",
+        ((q,) for q in range(1, n_questions + 1) for _ in range(2)))
+    db.commit()
+
+def route_queries(n_questions: int):
+    "The lookups each route performs, as (route, sql, args) with a random question"
+    q = random.randrange(1, n_questions + 1)
+    return [
+        ("POST /questions", "SELECT * FROM questions WHERE text = ?", [f"Question {q} about topic 0?"]),
+        ("GET /questions/{id}", "SELECT * FROM urls WHERE question_id = ?", [q]),
+        ("POST /questions/{id}/user-answer", "SELECT * FROM urls WHERE url = ? AND question_id = ?", [f"https://example.com/{q}/0", q]),
+        ("GET /top-answers/{id}", "SELECT * FROM answers WHERE question_id = ?", [q]),
+    ]
+
+def time_routes(db, n_questions: int, repeats: int) -> dict:
+    totals = {}
+    for _ in range(repeats):
+        for route, sql, args in route_queries(n_questions):
+            start = time.perf_counter()
+            db.execute(sql, args).fetchall()
+            totals[route] = totals.get(route, 0.0) + time.perf_counter() - start
+    return {route: total / repeats * 1000 for route, total in totals.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = database(os.path.join(tmp, "bench.db"))
+        migrate(db, target=1)
+        populate(db, args.questions)
+        before = time_routes(db, args.questions, args.repeats)
+        start = time.perf_counter()
+        migrate(db)
+        upgrade = time.perf_counter() - start
+        after = time_routes(db, args.questions, args.repeats)
+
+    print(f"{args.questions} questions, in-place upgrade took {upgrade:.2f}s")
+    print(f"{'route':<36}{'before ms':>12}{'after ms':>12}")
+    for route in before:
+        print(f"{route:<36}{before[route]:>12.3f}{after[route]:>12.3f}")
+
+if __name__ == "__main__":
+    main()
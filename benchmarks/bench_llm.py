@@ -0,0 +1,53 @@
+"""Throughput of the HTTP LLM client against the local stub server.
+
+Usage: python benchmarks/bench_llm.py [--requests 400] [--latency 0.05]
+"""
+import argparse, asyncio, os, statistics, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm import HTTPLLM
+from llm_stub import start_stub
+
+async def run(client: HTTPLLM, n_requests: int) -> tuple[float, list[float], list[float]]:
+    "Wall time, plus per request the wait for a concurrency slot and the HTTP request latency"
+    waits, latencies, started = [], [], {}
+    post = client.client.post
+    async def timed_post(*args, **kwargs):
+        # Called by `_post` once it holds the semaphore, in the task of the request being timed
+        sent = time.perf_counter()
+        waits.append(sent - started[asyncio.current_task()])
+        try: return await post(*args, **kwargs)
+        finally: latencies.append(time.perf_counter() - sent)
+    client.client.post = timed_post
+    async def one(i):
+        started[asyncio.current_task()] = time.perf_counter()
+        await client.generate(f"Question {i}?", [f"https://example.com/{i}"])
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_requests)))
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    return elapsed, waits, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub response latency in seconds")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    server = start_stub(args.port, latency=args.latency)
+    print(f"{args.requests} requests, stub latency {args.latency * 1000:.0f}ms")
+    print(f"{'':>22}{'queue wait':>20}{'request':>20}")
+    print(f"{'concurrency':>12}{'req/s':>10}" + f"{'p50 ms':>10}{'p95 ms':>10}" * 2)
+    for concurrency in args.concurrency:
+        client = HTTPLLM(f"http://127.0.0.1:{args.port}/v1", "stub", max_concurrency=concurrency)
+        elapsed, waits, latencies = asyncio.run(run(client, args.requests))
+        w, q = statistics.quantiles(waits, n=20), statistics.quantiles(latencies, n=20)
+        print(f"{concurrency:>12}{args.requests / elapsed:>10.1f}{w[9] * 1000:>10.1f}{w[18] * 1000:>10.1f}"
+              f"{q[9] * 1000:>10.1f}{q[18] * 1000:>10.1f}")
+    server.should_exit = True
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Bytes transferred per full page, before and after moving the stylesheet out and compressing responses.
+
+"Inline" is the page as it was served before: uncompressed, with the
+stylesheet inlined in a <style> block. "Now" is the page compressed with the
+best encoding the app offers, linking the stylesheet, which is fetched
+(compressed) once and then served from the browser cache.
+
+Usage: python benchmarks/bench_page_bytes.py [--questions 50]
+"""
+import argparse, importlib, os, sys, tempfile
+
+from starlette.testclient import TestClient
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import brotli
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "data"))
+        os.chdir(tmp)
+        app = importlib.import_module("main")
+        client = TestClient(app.create_app())
+        for i in range(args.questions):
+            client.post("/questions", data={"question": f"Benchmark question {i} about topic {i * 7919 % 1000}?"})
+        for u in range(3): client.post("/questions/1/urls", data={"url": f"https://example.com/source/{u}"})
+        for a in range(2): client.post("/questions/1/user-answer", data={"user_answer": f"Reference answer {a}"})
+
+        inline_style = len(f"<style>{app.STYLESHEET.decode()}</style>".encode())
+        encoding = "br, gzip" if brotli else "gzip"
+        stylesheet = client.get(f"/stylesheet/{app.STYLESHEET_DIGEST}", headers={"accept-encoding": encoding})
+        print(f"stylesheet: {len(app.STYLESHEET)} bytes, {stylesheet.headers['content-length']} "
+              f"{stylesheet.headers.get('content-encoding', 'identity')} once per browser cache lifetime")
+        print(f"{'page':<20}{'inline bytes':>14}{'now bytes':>11}{'saved':>8}")
+        for path in ["/", "/best-answers", "/best-answers/1", "/top-answers", "/top-answers/1"]:
+            plain = client.get(path, headers={"accept-encoding": "identity"})
+            # httpx transparently decodes, so the on-the-wire size comes from Content-Length
+            packed = client.get(path, headers={"accept-encoding": encoding})
+            before = len(plain.content) + inline_style
+            after = int(packed.headers["content-length"])
+            print(f"{path:<20}{before:>14}{after:>11}{1 - after / before:>8.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Time the retrieval-metrics engine on a generated database, against a per-answer Python loop.
+
+Loading the rankings (SQL plus matching cited sources to ratings) is timed
+separately from computing the metrics, which is where the array version and
+the loop differ; both produce the same numbers.
+
+Usage: python benchmarks/bench_retrieval_metrics.py [--scale 100k] [--repeat 3]
+"""
+import argparse, math, os, sys, time
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from generate import SCALES, open_generated
+from retrieval_metrics import DEFAULT_KS, answer_metrics, load_rankings
+
+def loop_metrics(rankings, ks=DEFAULT_KS) -> dict[str, list[float]]:
+    "The same metrics, one answer at a time"
+    out = {f"{m}@{k}": [] for m in ("precision", "recall", "ndcg") for k in ks}
+    out["mrr"] = []
+    for rel, gain, ideal, relevant in zip(rankings['relevance'].tolist(), rankings['gain'].tolist(),
+                                          rankings['ideal'].tolist(), rankings['relevant'].tolist()):
+        for k in ks:
+            hits = sum(rel[:k])
+            dcg = sum(g / math.log2(i + 2) for i, g in enumerate(gain[:k]))
+            idcg = sum(g / math.log2(i + 2) for i, g in enumerate(ideal[:k]))
+            out[f"precision@{k}"].append(hits / k)
+            out[f"recall@{k}"].append(hits / relevant if relevant else math.nan)
+            out[f"ndcg@{k}"].append(dcg / idcg if idcg else math.nan)
+        first = next((i for i, r in enumerate(rel) if r), None)
+        out["mrr"].append(math.nan if not relevant else 1 / (first + 1) if first is not None else 0.0)
+    return out
+
+def best_of(repeat: int, fn, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="100k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache-dir", default=os.path.join(ROOT, "benchmarks", ".data"),
+                        help="Where generated databases are kept between runs")
+    args = parser.parse_args()
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    db = open_generated(os.path.join(args.cache_dir, f"{args.scale}-seed{args.seed}.db"), args.scale, args.seed)
+    load_s, rankings = best_of(args.repeat, load_rankings, db)
+    array_s, vectorized = best_of(args.repeat, answer_metrics, rankings)
+    loop_s, looped = best_of(args.repeat, loop_metrics, rankings)
+    for name, values in vectorized.items(): np.testing.assert_allclose(values, looped[name], equal_nan=True)
+
+    n = len(rankings['question_ids'])
+    print(f"{n} rated answers at scale {args.scale}")
+    print(f"load rankings      {load_s * 1000:9.1f} ms")
+    print(f"metrics, arrays    {array_s * 1000:9.1f} ms")
+    print(f"metrics, loop      {loop_s * 1000:9.1f} ms  ({loop_s / array_s:.0f}x slower)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Startup time of the app, and throughput as `cli.py serve` adds worker processes.
+
+Each startup sample runs in a fresh Python process on a fresh copy of a
+generated database. It times three phases separately: importing `main`,
+`create_app`, and the first request, which opens the database and LLM client
+lazily. Importing and building the app touch neither. The import is mostly
+FastHTML's own.
+
+For scaling, `cli.py serve --workers N` is started on a copy of the same
+database for each `--workers` value. The benchmark records how long the server
+takes to answer its first request. After a warm-up round it drives the load
+test's route mix over real HTTP from `--concurrency` clients. All workers
+share the one SQLite file: reads run in parallel, and each worker's writer
+waits its turn for the write lock. Throughput can only scale up to the number
+of cores, which is printed with the results.
+
+Usage: python benchmarks/bench_startup.py [--scale 1k] [--samples 5] [--workers 1 2 4] [--concurrency 32] [--requests 2000]
+"""
+import argparse, asyncio, json, os, shutil, statistics, subprocess, sys, tempfile, time
+
+import httpx
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastlite import database
+
+from generate import SCALES, crowded_question, open_generated
+from load import drive, route_mix
+
+# Run in a fresh interpreter so nothing is imported or cached yet; prints its timings as JSON
+STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import main
+imported = time.perf_counter()
+app = main.create_app()
+created = time.perf_counter()
+from starlette.testclient import TestClient
+r = TestClient(app).get("/")
+assert r.status_code == 200, r.status_code
+print(json.dumps(dict(import_ms=(imported - start) * 1000, create_ms=(created - imported) * 1000,
+                      first_request_ms=(time.perf_counter() - created) * 1000)))
+"""
+
+def startup_sample(source: str, env: dict) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "data"))
+        shutil.copy(source, os.path.join(tmp, "data", "rag.db"))
+        out = subprocess.run([sys.executable, "-c", STARTUP.format(root=ROOT)], cwd=tmp, env=env,
+                             stdout=subprocess.PIPE, text=True, check=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+
+def serve_run(source: str, workers: int, port: int, args, env: dict) -> dict:
+    "Start `cli.py serve` on a copy of `source`, time its first answer, then drive the route mix at it"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "rag.db")
+        shutil.copy(source, path)
+        db = database(path)
+        crowded = crowded_question(db, args.crowded_answers, seed=args.seed)
+        db.conn.close()
+        url = f"http://127.0.0.1:{port}"
+        start = time.perf_counter()
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, "cli.py"), "--db", path, "serve", "--workers", str(workers),
+                                   "--port", str(port), "--log-level", "warning"], env=env)
+        try:
+            while True:
+                if server.poll() is not None: raise RuntimeError(f"cli.py serve exited with {server.returncode}")
+                try:
+                    if httpx.get(url, timeout=5).status_code == 200: break
+                except httpx.TransportError: time.sleep(0.02)
+            ready_s = time.perf_counter() - start
+            db = database(path)
+            mix = route_mix(db, SCALES[args.scale], crowded)
+            # A warm-up round, so that every worker has started and opened its database before the timed run
+            asyncio.run(drive(url, mix, args.concurrency, args.concurrency * workers * 4, args.seed + 1))
+            elapsed, routes = asyncio.run(drive(url, mix, args.concurrency, args.requests, args.seed))
+            db.conn.close()
+        finally:
+            server.terminate()
+            server.wait()
+        return dict(workers=workers, ready_s=ready_s, throughput=args.requests / elapsed,
+                    errors=sum(r['errors'] for r in routes.values()), worst_p95_ms=max(r['p95_ms'] for r in routes.values()))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=5, help="Fresh processes timed for startup")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per worker count")
+    parser.add_argument("--crowded-answers", type=int, default=300,
+                        help="Answers to the question that best-answer selections and source ratings go to")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--cache-dir", default=os.path.join(ROOT, "benchmarks", ".data"),
+                        help="Where generated databases are kept between runs")
+    args = parser.parse_args()
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    source = os.path.join(args.cache_dir, f"{args.scale}-seed{args.seed}.db")
+    open_generated(source, args.scale, args.seed).conn.close()
+    # Blocking mode makes each user-answer a single request, like a client without SSE; no background work
+    env = dict(os.environ, RAG_STREAM_LLM=os.environ.get("RAG_STREAM_LLM", "0"), RAG_PREGENERATE="0")
+
+    samples = [startup_sample(source, env) for _ in range(args.samples)]
+    print(f"startup, median of {args.samples} fresh processes ({args.scale} database)")
+    for phase, label in [("import_ms", "import main"), ("create_ms", "create_app"), ("first_request_ms", "first request")]:
+        print(f"  {label:<16}{statistics.median(s[phase] for s in samples):9.1f} ms")
+
+    print(f"\nthroughput over HTTP, {args.concurrency} clients, {args.requests} requests, {os.cpu_count()} cores")
+    print(f"{'workers':>8}{'ready s':>9}{'req/s':>9}{'speedup':>9}{'worst p95 ms':>14}{'errors':>8}")
+    base = None
+    for i, workers in enumerate(args.workers):
+        r = serve_run(source, workers, args.port + i, args, env)
+        base = base or r['throughput']
+        print(f"{workers:>8}{r['ready_s']:>9.2f}{r['throughput']:>9.1f}{r['throughput'] / base:>8.2f}x"
+              f"{r['worst_p95_ms']:>14.1f}{r['errors']:>8}")
+
+if __name__ == "__main__":
+    main()
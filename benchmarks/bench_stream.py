@@ -0,0 +1,78 @@
+"""Time to first byte of the comparison view, with and without LLM streaming.
+
+Serves the app with uvicorn in a background thread, backed by the local stub
+LLM server, and reads responses incrementally with httpx. Without streaming
+the first byte waits for the whole LLM answer; with streaming the card returns
+at once and the first LLM token follows over SSE.
+
+Usage: python benchmarks/bench_stream.py [--requests 20] [--latency 0.2] [--token-delay 0.02]
+"""
+import argparse, importlib, os, statistics, sys, tempfile, threading, time
+
+import httpx, uvicorn
+from dataclasses import replace
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import AppConfig
+from llm_stub import start_stub
+
+def measure(stream: bool, n_requests: int, port: int) -> dict:
+    main = importlib.import_module("main")
+    app = main.create_app(replace(AppConfig.from_env(), stream_llm=stream))
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started: time.sleep(0.01)
+
+    card_ms, first_token_ms, complete_ms = [], [], []
+    with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+        client.post("/questions", data={"question": "What is retrieval augmented generation?"})
+        for i in range(n_requests):
+            start = time.perf_counter()
+            with client.stream("POST", "/questions/1/user-answer", data={"user_answer": f"answer {i}"}) as r:
+                chunks = r.iter_bytes()
+                body = next(chunks)
+                card_ms.append((time.perf_counter() - start) * 1000)
+                body += b"".join(chunks)
+            if not stream:
+                first_token_ms.append(card_ms[-1])
+                complete_ms.append((time.perf_counter() - start) * 1000)
+                continue
+            aid = body.decode().split("/llm-stream/")[1].split('"')[0]
+            with client.stream("GET", f"/questions/1/llm-stream/{aid}") as events:
+                for line in events.iter_lines():
+                    if line == "event: token" and len(first_token_ms) < len(card_ms):
+                        first_token_ms.append((time.perf_counter() - start) * 1000)
+            complete_ms.append((time.perf_counter() - start) * 1000)
+    # The next mode builds a new app, so this one must finish closing its resources first
+    server.should_exit = True
+    thread.join()
+    return dict(card=statistics.median(card_ms), first_token=statistics.median(first_token_ms),
+                complete=statistics.median(complete_ms))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="Stub time to first token in seconds")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Stub delay between tokens in seconds")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    server = start_stub(args.port, latency=args.latency, token_delay=args.token_delay)
+    os.environ.update(RAG_DEBUG_MODE="0", LLM_BASE_URL=f"http://127.0.0.1:{args.port}/v1", LLM_MODEL="stub")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "data"))
+        os.chdir(tmp)
+        results = {mode: measure(mode == "streaming", args.requests, args.port + 1 + i)
+                   for i, mode in enumerate(("blocking", "streaming"))}
+    server.should_exit = True
+
+    print(f"{args.requests} answers, stub latency {args.latency * 1000:.0f}ms + {args.token_delay * 1000:.0f}ms/token (medians)")
+    print(f"{'mode':<12}{'first byte ms':>15}{'first token ms':>16}{'complete ms':>14}")
+    for mode, r in results.items():
+        print(f"{mode:<12}{r['card']:>15.1f}{r['first_token']:>16.1f}{r['complete']:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Seeded synthetic evaluation database for benchmarks.
+
+Fills `questions`, `urls`, `answers` and `url_ratings` at a named scale; the
+same seed and scale always produce the same rows. Each question gets 2-5
+candidate URLs (some of them LLM sources) and 1-4 answer records. Most
+answers carry a final answer drawn from a small set per question, and a
+rating of every URL, stored both as `url_ratings` rows and in the legacy
+`url_ranking`/`url_relevance` strings. Writes go through the normal schema,
+so the summary, search and version triggers populate their tables as well,
+and the new answers are scored for similarity.
+
+Usage: python benchmarks/generate.py data/bench.db [--scale 100k] [--seed 0]
+"""
+import argparse, os, random, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastlite import database
+
+from answer_scores import score_missing
+from canonical_urls import url_hash
+from dedupe import index_missing
+from migrations import migrate
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vi", "zo", "pe", "shi", "dra", "qu", "mon", "tel", "bar", "cin"]
+TEMPLATES = ["What is {t}?", "How does {t} work?", "Why does {t} matter?", "Explain {t} to a beginner.",
+             "What are common misconceptions about {t}?", "How has our understanding of {t} changed?"]
+DOMAINS = ["en.wikipedia.org/wiki", "www.britannica.com/topic", "arxiv.org/abs", "docs.python.org/3/library",
+           "www.nature.com/articles", "example.com/guides"]
+WORDS = ("the of and to in is that it for as with was on are by this be from or an have not they which "
+         "process energy system cells model data theory evidence result effect change rate level").split()
+
+def vocabulary(rng, size: int = 3000) -> list[str]:
+    "Pronounceable made-up words, so question texts vary like real ones instead of repeating a few topics"
+    return sorted({"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)})
+
+def sentence(rng, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+def generate(db, n_questions: int, seed: int = 0, batch_size: int = 10_000):
+    "Append `n_questions` synthetic questions with their URLs, answers and ratings"
+    rng = random.Random(seed)
+    topics, seen = vocabulary(rng), {t for (t,) in db.execute("SELECT text FROM questions")}
+    first = db.execute("SELECT COALESCE(MAX(id), 0) FROM questions").fetchone()[0] + 1
+    url_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM urls").fetchone()[0]
+    answer_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM answers").fetchone()[0]
+    for start in range(first, first + n_questions, batch_size):
+        questions, urls, answers, ratings = [], [], [], []
+        for qid in range(start, min(start + batch_size, first + n_questions)):
+            text = None
+            while text is None or text in seen:
+                topic = " ".join(rng.sample(topics, 3))
+                text = rng.choice(TEMPLATES).format(t=topic)
+            seen.add(text)
+            questions.append((qid, text))
+            q_urls = []
+            for k in range(rng.randint(2, 5)):
+                url_id += 1
+                url = f"https://{rng.choice(DOMAINS)}/{topic.replace(' ', '_')}-{qid}-{k}"
+                source = "llm" if k >= 2 and rng.random() < 0.5 else "user"
+                urls.append((url_id, qid, url, source, url_hash(url)))
+                q_urls.append((url_id, url))
+            finals = [sentence(rng, rng.randint(8, 30)) for _ in range(rng.randint(1, 3))]
+            for _ in range(rng.randint(1, 4)):
+                answer_id += 1
+                rated = rng.random() < 0.8
+                ranks = rng.sample(range(1, len(q_urls) + 1), len(q_urls))
+                rows = [(uid, rank, int(rng.random() < 0.6)) for (uid, _), rank in zip(q_urls, ranks)] if rated else []
+                answers.append((answer_id, qid, sentence(rng, rng.randint(20, 80)), sentence(rng, rng.randint(20, 80)),
+                                ",".join(u for _, u in q_urls[:2]), rng.choice(finals) if rated else "",
+                                ",".join(f"{u}:{rank}:{rel}" for (_, u), (_, rank, rel) in zip(q_urls, rows)),
+                                ",".join(f"{u}:{rel}" for (_, u), (_, _, rel) in zip(q_urls, rows))))
+                ratings.extend((answer_id, uid, rank, rel) for uid, rank, rel in rows)
+        with db.conn:
+            cur = db.conn.cursor()
+            cur.executemany("INSERT INTO questions (id, text) VALUES (?, ?)", questions)
+            cur.executemany("INSERT INTO urls (id, question_id, url, source, canonical_hash) VALUES (?, ?, ?, ?, ?)", urls)
+            cur.executemany("""INSERT INTO answers (id, question_id, user_answer, llm_answer, llm_sources, final_answer,
+                               url_ranking, url_relevance) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", answers)
+            cur.executemany("INSERT INTO url_ratings (answer_id, url_id, rank, relevant) VALUES (?, ?, ?, ?)", ratings)
+    index_missing(db)
+    score_missing(db)
+
+def crowded_question(db, n_answers: int, n_urls: int = 10, seed: int = 0) -> int:
+    "Append one question with `n_answers` answers, each rating all of its `n_urls` URLs, and return its id"
+    rng = random.Random(seed)
+    qid = db.execute("SELECT COALESCE(MAX(id), 0) FROM questions").fetchone()[0] + 1
+    urls = [f"https://{rng.choice(DOMAINS)}/crowded-{qid}-{k}" for k in range(n_urls)]
+    finals = [sentence(rng, rng.randint(8, 30)) for _ in range(3)]
+    with db.conn:
+        db.execute("INSERT INTO questions (id, text) VALUES (?, ?)", [qid, f"Which sources do {n_answers} annotators agree on? ({qid})"])
+        cur = db.conn.cursor()
+        cur.executemany("INSERT INTO urls (question_id, url, source, canonical_hash) VALUES (?, ?, 'user', ?)",
+                        [(qid, url, url_hash(url)) for url in urls])
+        url_ids = [u for (u,) in db.execute("SELECT id FROM urls WHERE question_id = ? ORDER BY id", [qid])]
+        for _ in range(n_answers):
+            answer_id = db.execute("""INSERT INTO answers (question_id, user_answer, llm_answer, llm_sources, final_answer,
+                                      url_ranking, url_relevance) VALUES (?, ?, ?, ?, ?, '', '') RETURNING id""",
+                                   [qid, sentence(rng, rng.randint(20, 80)), sentence(rng, rng.randint(20, 80)),
+                                    ",".join(urls[:2]), rng.choice(finals)]).fetchone()[0]
+            ranks = rng.sample(range(1, n_urls + 1), n_urls)
+            cur.executemany("INSERT INTO url_ratings (answer_id, url_id, rank, relevant) VALUES (?, ?, ?, ?)",
+                            [(answer_id, u, rank, int(rng.random() < 0.6)) for u, rank in zip(url_ids, ranks)])
+    index_missing(db)
+    score_missing(db, qid)
+    return qid
+
+def open_generated(path: str, scale: str, seed: int = 0):
+    "The database at `path`, generated at `scale` first unless it already holds questions"
+    db = database(path)
+    migrate(db)
+    if not db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]: generate(db, SCALES[scale], seed)
+    return db
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="SQLite file to create or extend")
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    db = database(args.path)
+    migrate(db)
+    start = time.perf_counter()
+    generate(db, SCALES[args.scale], args.seed)
+    counts = {t: db.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("questions", "urls", "answers", "url_ratings")}
+    print(f"Generated {args.scale} in {time.perf_counter() - start:.1f}s:", ", ".join(f"{n} {t}" for t, n in counts.items()))
+
+if __name__ == "__main__":
+    main()
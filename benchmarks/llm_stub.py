@@ -0,0 +1,56 @@
+"""Local stand-in for an OpenAI-compatible `/v1/chat/completions` endpoint.
+
+Answers after a fixed latency plus a per-token delay, citing the candidate URLs
+from the prompt. Honours `"stream": true` by sending the answer as SSE chunks.
+It can be told to fail its first requests, or a fraction of all requests, to
+exercise retries and the circuit breaker. Used by the LLM benchmarks and for trying `HTTPLLM` without a real backend.
+
+Usage: python benchmarks/llm_stub.py [--port 8001] [--latency 0.05] [--token-delay 0] [--failure-rate 0]
+"""
+import argparse, asyncio, json, random, threading, time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+def stub_app(latency: float = 0.05, failure_rate: float = 0.0, token_delay: float = 0.0, fail_first: int = 0) -> Starlette:
+    served = 0
+    async def completions(request):
+        nonlocal served
+        body = await request.json()
+        served += 1
+        await asyncio.sleep(latency)
+        if served <= fail_first or random.random() < failure_rate:
+            return JSONResponse({"error": "stub failure"}, status_code=503)
+        prompt = body["messages"][-1]["content"]
+        urls = [line for line in prompt.splitlines() if line.startswith("http")]
+        content = "Stub answer to the question, based on " + (", ".join(urls) or "no sources") + "."
+        tokens = [w + " " for w in content.split(" ")]
+        if body.get("stream"):
+            async def chunks():
+                for token in tokens:
+                    yield f"data: {json.dumps({'choices': [{'delta': {'content': token}}]})}\n\n"
+                    await asyncio.sleep(token_delay)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+        await asyncio.sleep(token_delay * len(tokens))
+        return JSONResponse({"model": body.get("model"), "choices": [{"message": {"role": "assistant", "content": content}}]})
+    return Starlette(routes=[Route("/v1/chat/completions", completions, methods=["POST"])])
+
+def start_stub(port: int = 8001, **kwargs) -> uvicorn.Server:
+    "Run the stub in a background thread and return its server once it accepts connections"
+    server = uvicorn.Server(uvicorn.Config(stub_app(**kwargs), port=port, log_level="warning"))
+    # With port 0 the OS picks a free port: read it from `server.servers[0].sockets[0].getsockname()`
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started: time.sleep(0.01)
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub LLM server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(stub_app(args.latency, args.failure_rate, args.token_delay), port=args.port)
@@ -0,0 +1,167 @@
+"""In-process load test of every route against a generated database.
+
+Generates (or reuses) a seeded database at the chosen scale, copies it so each
+run starts from the same rows, and drives the app through httpx's ASGI
+transport from `--concurrency` simultaneous clients. Each client picks routes
+from a fixed mix weighted like an annotation session: mostly page views, with
+answer submissions and final answers in between. Now and then a reviewer
+selects a best answer or rates the sources for every answer at once; those
+clicks go to one question that `--crowded-answers` annotators have answered,
+as they rewrite every answer of the question. Reports throughput and
+p50/p95/p99 latency per route and writes them as JSON; pass an earlier result
+file to `--compare` to print the change.
+
+Usage: python benchmarks/load.py [--scale 1k] [--concurrency 1 8 32] [--requests 2000] [--crowded-answers 300] [--compare old.json]
+"""
+import argparse, asyncio, importlib, json, os, platform, random, shutil, statistics, subprocess, sys, tempfile, time
+
+import httpx
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate import SCALES, crowded_question, open_generated
+
+def route_mix(db, n_questions: int, crowded: int | None = None):
+    """`(name, weight, build)` per route; `build(rng)` returns `(method, path, form_data)`.
+
+    Best-answer selections and source ratings go to question `crowded`, or to random questions without one."""
+    def answer_of(qid):
+        row = db.execute("SELECT id FROM answers WHERE question_id = ? LIMIT 1", [qid]).fetchone()
+        return row[0] if row else 1
+    def ratings(rng, qid):
+        url_ids = [u for (u,) in db.execute("SELECT id FROM urls WHERE question_id = ?", [qid])]
+        form = {}
+        for u in url_ids:
+            form[f"rank_{u}"] = str(rng.randint(1, len(url_ids)))
+            if rng.random() < 0.5: form[f"relevant_{u}"] = "on"
+        return form
+    def final_answer(rng):
+        qid = rng.randint(1, n_questions)
+        form = {"final_answer": f"Final answer {rng.random()}", **ratings(rng, qid)}
+        return "POST", f"/questions/{qid}/final-answer/{answer_of(qid)}", form
+    q = lambda rng: rng.randint(1, n_questions)
+    reviewed = lambda rng: crowded or q(rng)
+    def select(rng):
+        qid = reviewed(rng)
+        answer_ids = [a for (a,) in db.execute("SELECT id FROM answers WHERE question_id = ?", [qid])] or [1]
+        return "POST", f"/best-answers/{qid}/select", {"answer_id": str(rng.choice(answer_ids)),
+                                                       "answer_type": rng.choice(["user", "llm"])}
+    def rate_sources(rng):
+        qid = reviewed(rng)
+        return "POST", f"/best-answers/{qid}/rate-sources", ratings(rng, qid)
+    return [
+        ("GET /", 10, lambda rng: ("GET", "/", None)),
+        ("GET /search", 10, lambda rng: ("GET", "/search", {"q": rng.choice(["what", "how does", "explain", "ka", "mi"])})),
+        ("GET /questions/{id}", 20, lambda rng: ("GET", f"/questions/{q(rng)}", None)),
+        ("POST /questions/{id}/user-answer", 8, lambda rng: ("POST", f"/questions/{q(rng)}/user-answer",
+                                                             {"user_answer": f"Load test answer {rng.random()}"})),
+        ("POST /questions/{qid}/final-answer/{aid}", 8, final_answer),
+        ("GET /best-answers", 8, lambda rng: ("GET", "/best-answers", None)),
+        ("GET /best-answers/{id}", 12, lambda rng: ("GET", f"/best-answers/{q(rng)}", None)),
+        ("GET /top-answers", 8, lambda rng: ("GET", "/top-answers", None)),
+        ("GET /top-answers/{id}", 16, lambda rng: ("GET", f"/top-answers/{q(rng)}", None)),
+        ("POST /best-answers/{id}/select", 2, select),
+        ("POST /best-answers/{id}/rate-sources", 2, rate_sources),
+    ]
+
+async def drive(app, mix, concurrency: int, n_requests: int, seed: int) -> tuple[float, dict]:
+    "Run the mix against an ASGI app in this process, or against the base URL of a running server"
+    names, weights = [m[0] for m in mix], [m[1] for m in mix]
+    builders = {m[0]: m[2] for m in mix}
+    latencies, errors = {name: [] for name in names}, {name: 0 for name in names}
+    remaining = n_requests
+
+    async def client_loop(i, client):
+        nonlocal remaining
+        rng = random.Random(seed * 1000 + i)
+        while remaining > 0:
+            remaining -= 1
+            name = rng.choices(names, weights)[0]
+            method, path, data = builders[name](rng)
+            start = time.perf_counter()
+            if method == "GET": r = await client.get(path, params=data)
+            else: r = await client.post(path, data=data)
+            latencies[name].append(time.perf_counter() - start)
+            if r.status_code >= 400: errors[name] += 1
+
+    target = dict(base_url=app) if isinstance(app, str) else dict(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+    async with httpx.AsyncClient(**target, follow_redirects=True, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(i, client) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return elapsed, {name: summarize(latencies[name], errors[name], elapsed) for name in names if latencies[name]}
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    ms = sorted(l * 1000 for l in latencies)
+    cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else [ms[0]] * 99
+    return dict(requests=len(ms), errors=errors, throughput=len(ms) / elapsed, mean_ms=statistics.fmean(ms),
+                p50_ms=cuts[49], p95_ms=cuts[94], p99_ms=cuts[98], max_ms=ms[-1])
+
+def git_commit() -> str | None:
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError: return None
+
+def print_run(run: dict, baseline: dict | None):
+    print(f"\nconcurrency {run['concurrency']}: {run['requests']} requests in {run['seconds']:.2f}s, "
+          f"{run['throughput']:.1f} req/s")
+    print(f"{'route':<42}{'n':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err':>5}" + ("  p95 vs baseline" if baseline else ""))
+    for name, r in run['routes'].items():
+        line = f"{name:<42}{r['requests']:>6}{r['throughput']:>9.1f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['errors']:>5}"
+        if baseline and (old := baseline['routes'].get(name)): line += f"  {r['p95_ms'] / old['p95_ms'] - 1:+.0%}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per concurrency level")
+    parser.add_argument("--crowded-answers", type=int, default=300,
+                        help="Answers to the question that best-answer selections and source ratings go to")
+    parser.add_argument("--cache-dir", default=os.path.join(ROOT, "benchmarks", ".data"),
+                        help="Where generated databases are kept between runs")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/load-<scale>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare p95 latencies with")
+    args = parser.parse_args()
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    source = os.path.join(args.cache_dir, f"{args.scale}-seed{args.seed}.db")
+    start = time.perf_counter()
+    db = open_generated(source, args.scale, args.seed)
+    db.conn.close()
+    print(f"{args.scale} database ready in {time.perf_counter() - start:.1f}s ({source})")
+
+    # Blocking mode makes each user-answer a single request, like a client without SSE
+    os.environ.setdefault("RAG_STREAM_LLM", "0")
+    results = dict(scale=args.scale, seed=args.seed, commit=git_commit(), python=platform.python_version(),
+                   timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"), runs=[])
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "data"))
+        shutil.copy(source, os.path.join(tmp, "data", "rag.db"))
+        copy = open_generated(os.path.join(tmp, "data", "rag.db"), args.scale, args.seed)
+        crowded = crowded_question(copy, args.crowded_answers, seed=args.seed)
+        copy.conn.close()
+        os.chdir(tmp)
+        main_module = importlib.import_module("main")
+        app = main_module.create_app()
+        main_module.open_resources()
+        # The client side has a connection of its own; the app's writer connection belongs to its writer thread
+        mix = route_mix(main_module.pool.open(), SCALES[args.scale], crowded)
+        for concurrency in args.concurrency:
+            elapsed, routes = asyncio.run(drive(app, mix, concurrency, args.requests, args.seed))
+            results['runs'].append(dict(concurrency=concurrency, requests=args.requests, seconds=elapsed,
+                                        throughput=args.requests / elapsed, routes=routes))
+
+    baseline = json.load(open(args.compare)) if args.compare else None
+    for run in results['runs']:
+        old = next((r for r in baseline['runs'] if r['concurrency'] == run['concurrency']), None) if baseline else None
+        print_run(run, old)
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"load-{args.scale}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f: json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Bulk import of questions and their candidate URLs from JSONL or CSV.
+
+JSONL lines look like `{"question": "...", "urls": ["https://...", ...]}`.
+CSV files have a `question` column and an optional `url` column; repeating a
+question on several rows attaches several URLs. Input is read as a stream and
+written in chunks, one transaction and a handful of `executemany` calls per
+chunk. Questions that already exist (by exact text) are reused, and URLs a
+question already has (after canonicalization) are skipped.
+"""
+import csv, json, time
+from itertools import islice
+from typing import IO, Iterable, Iterator, List
+
+from canonical_urls import url_hash
+from dedupe import index_questions
+from transactions import transaction
+
+def read_jsonl(f: IO[str]) -> Iterator[tuple[str, List[str]]]:
+    for line in f:
+        if not line.strip(): continue
+        record = json.loads(line)
+        yield record.get("question") or record.get("text") or "", list(record.get("urls") or [])
+
+def read_csv(f: IO[str]) -> Iterator[tuple[str, List[str]]]:
+    for row in csv.DictReader(f):
+        yield row.get("question") or "", [row["url"]] if row.get("url") else []
+
+def read_records(f: IO[str], fmt: str) -> Iterator[tuple[str, List[str]]]:
+    "`(question, urls)` pairs from a `jsonl` or `csv` text stream"
+    if fmt not in ("jsonl", "csv"): raise ValueError(f"Unsupported import format: {fmt!r}")
+    return read_jsonl(f) if fmt == "jsonl" else read_csv(f)
+
+def format_for(filename: str) -> str:
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+def _import_chunk(db, chunk, stats):
+    texts = list(dict.fromkeys(q for q, _ in chunk if q))
+    marks = ",".join("?" * len(texts))
+    last_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM questions").fetchone()[0]
+    # The unique index on questions.text skips texts that already exist
+    db.conn.cursor().executemany("INSERT OR IGNORE INTO questions (text) VALUES (?)", [(t,) for t in texts])
+    ids = dict(db.execute(f"SELECT text, id FROM questions WHERE text IN ({marks})", texts).fetchall()) if texts else {}
+    # Questions inserted by this chunk are the ones past the previous maximum id
+    # (total_changes() would also count the rows the questions' triggers write)
+    new_questions = [(qid, text) for text, qid in ids.items() if qid > last_id]
+    stats['questions_inserted'] += len(new_questions)
+    index_questions(db, new_questions)
+
+    # The unique (question_id, canonical_hash) index skips URLs a question already has, in any spelling
+    last_url = db.execute("SELECT COALESCE(MAX(id), 0) FROM urls").fetchone()[0]
+    db.conn.cursor().executemany(
+        "INSERT OR IGNORE INTO urls (question_id, url, source, canonical_hash) VALUES (?, ?, 'user', ?)",
+        [(ids[q], u, url_hash(u)) for q, urls in chunk if q for u in urls])
+    stats['urls_inserted'] += db.execute("SELECT COUNT(*) FROM urls WHERE id > ?", [last_url]).fetchone()[0]
+
+def import_records(db, records: Iterable[tuple[str, List[str]]], chunk_size: int = 5000) -> dict:
+    "Import `(question, urls)` records in chunked transactions and return counts and throughput"
+    stats = dict(rows=0, questions_inserted=0, urls_inserted=0)
+    start = time.perf_counter()
+    records = iter(records)
+    while chunk := list(islice(records, chunk_size)):
+        with transaction(db, "import chunk"): _import_chunk(db, chunk, stats)
+        stats['rows'] += len(chunk)
+    stats['seconds'] = time.perf_counter() - start
+    stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
@@ -0,0 +1,30 @@
+"""URL canonicalization, so the same source typed differently counts as one URL.
+
+`canonical_url` lower-cases the scheme and host, drops default ports,
+fragments, trailing slashes and tracking parameters, and sorts the remaining
+query parameters. `urls.canonical_hash` stores `url_hash` of that form, and a
+unique index on `(question_id, canonical_hash)` keeps one row per source and
+question; the first spelling seen is the one displayed.
+"""
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_hsenc", "_hsmi"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def canonical_url(url: str) -> str:
+    url = url.strip()
+    if "://" not in url: url = "http://" + url
+    try: parts = urlsplit(url)
+    except ValueError: return url
+    scheme, host = parts.scheme.lower(), (parts.hostname or "").rstrip(".")
+    try: port = parts.port
+    except ValueError: port = None
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f"{host}:{port}"
+    if parts.username: netloc = f"{parts.username}@{netloc}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k.lower() not in TRACKING_PARAMS and not k.lower().startswith("utm_"))
+    return urlunsplit((scheme, netloc, parts.path.rstrip("/"), urlencode(query), ""))
+
+def url_hash(url: str) -> str:
+    return hashlib.sha256(canonical_url(url).encode()).hexdigest()[:32]
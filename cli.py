@@ -0,0 +1,191 @@
+"""Command-line maintenance tasks for the RAG evaluation database.
+
+Usage: python cli.py [--db data/rag.db] <command> [options]
+"""
+import argparse, asyncio, os, sys
+
+from fastlite import database
+
+from agreement import dataset_agreement, rebuild_agreement
+from answer_scores import rescore_all, score_missing
+from bulk_import import format_for, import_records, read_records
+from config import AppConfig
+from corpus import CorpusIndex, CorpusLLM, build_index
+from dedupe import duplicate_clusters, index_missing
+from export import export_chunks
+from fragment_cache import touch_questions
+from llm import client_from_env
+from migrations import migrate
+from pregenerate import pregenerate
+from retrieval_metrics import dataset_metrics, export_lines
+from search import rebuild_search
+from summaries import rebuild_summaries
+
+def open_db(path: str):
+    db = database(path)
+    migrate(db)
+    return db
+
+def rebuild_summaries_cmd(args):
+    db = open_db(args.db)
+    rebuild_summaries(db, args.question)
+    print("Rebuilt summaries for", f"question {args.question}" if args.question is not None else "all questions")
+
+def rebuild_search_cmd(args):
+    db = open_db(args.db)
+    rebuild_search(db)
+    print("Rebuilt the question search index")
+
+def duplicates_cmd(args):
+    db = open_db(args.db)
+    index_missing(db)
+    clusters = duplicate_clusters(db, args.threshold)
+    for cluster in clusters:
+        texts = dict(db.execute(f"SELECT id, text FROM questions WHERE id IN ({','.join('?' * len(cluster))})", cluster).fetchall())
+        print(f"Cluster of {len(cluster)}:")
+        for qid in cluster: print(f"  {qid}: {texts[qid]}")
+    print(f"{len(clusters)} clusters, {sum(map(len, clusters))} questions")
+
+def pregenerate_cmd(args):
+    db = open_db(args.db)
+    config = AppConfig.from_env()
+    client = client_from_env(config.debug_mode)
+    # Same candidate sources as the app, so its lookups match the staged answers
+    if config.corpus_index: client = CorpusLLM(client, CorpusIndex(config.corpus_index), k=config.corpus_top_k)
+    report = lambda t: print(f"up to question {t['last_question_id']}: "
+                             f"{t['generated']} generated, {t['skipped']} up to date, {t['failed']} failed")
+    async def run():
+        try: return await pregenerate(db, client, args.workers, args.batch_size, args.rate, args.restart, report)
+        finally: await client.aclose()
+    asyncio.run(run())
+
+def import_cmd(args):
+    db = open_db(args.db)
+    with open(args.file, newline="", encoding="utf-8-sig") as f:
+        stats = import_records(db, read_records(f, args.format or format_for(args.file)), args.chunk_size)
+    print(f"Imported {stats['rows']} rows in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s): "
+          f"{stats['questions_inserted']} new questions, {stats['urls_inserted']} new URLs")
+
+def export_cmd(args):
+    db = open_db(args.db)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_chunks(db, args.format): out.write(chunk)
+    finally:
+        if args.output: out.close()
+
+def retrieval_metrics_cmd(args):
+    db = open_db(args.db)
+    result = dataset_metrics(db)
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            for line in export_lines(result, args.format): f.write(line)
+    print(f"{result['answers']} rated answers across {result['questions']} questions")
+    for name, value in result['overall'].items(): print(f"  {name:<14}{value:.3f}" if value is not None else f"  {name:<14}-")
+
+def score_answers_cmd(args):
+    db = open_db(args.db)
+    count = rescore_all(db) if args.all else score_missing(db)
+    # Question pages show the scores, but the version triggers do not watch them
+    if count: touch_questions(db)
+    print(f"Scored {count} answer records")
+
+def agreement_cmd(args):
+    db = open_db(args.db)
+    if args.rebuild: rebuild_agreement(db)
+    overall = dataset_agreement(db)['overall']
+    print(f"{overall['items']} URLs rated by two or more annotators, {overall['pairs']} annotator pairs")
+    for name, value in overall.items():
+        if name not in ("items", "pairs"): print(f"  {name:<20}{value:.3f}" if value is not None else f"  {name:<20}-")
+
+def index_corpus_cmd(args):
+    meta = build_index(args.corpus, args.output)
+    print(f"Indexed {meta['documents']} documents, {meta['terms']} terms, {meta['postings']} postings into {args.output}")
+
+def search_corpus_cmd(args):
+    for url, score in CorpusIndex(args.index).search(args.query, args.k): print(f"{score:8.3f}  {url}")
+
+def serve_cmd(args):
+    import uvicorn
+    # Migrated once here, before any worker opens it
+    open_db(args.db).close()
+    # Workers are fresh processes that build their app with `main.create_app` from the environment
+    os.environ["RAG_DB_PATH"] = args.db
+    if args.workers > 1 and AppConfig.from_env().pregenerate:
+        print("RAG_PREGENERATE is ignored with several workers; run `cli.py pregenerate` alongside instead", file=sys.stderr)
+        os.environ["RAG_PREGENERATE"] = "0"
+    uvicorn.run("main:create_app", factory=True, host=args.host, port=args.port, workers=args.workers,
+                app_dir=os.path.dirname(os.path.abspath(__file__)), log_level=args.log_level)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RAG evaluation database tasks")
+    parser.add_argument("--db", default="data/rag.db", help="Path to the SQLite database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-summaries", help="Recompute the /top-answers summary tables")
+    rebuild.add_argument("--question", type=int, help="Only rebuild this question id")
+    rebuild.set_defaults(func=rebuild_summaries_cmd)
+
+    search = commands.add_parser("rebuild-search", help="Recompute the full-text question search index")
+    search.set_defaults(func=rebuild_search_cmd)
+
+    dupes = commands.add_parser("duplicates", help="List clusters of near-duplicate questions")
+    dupes.add_argument("--threshold", type=float, default=0.8, help="Minimum estimated shingle similarity")
+    dupes.set_defaults(func=duplicates_cmd)
+
+    pregen = commands.add_parser("pregenerate", help="Pre-generate LLM answers for all questions")
+    pregen.add_argument("--workers", type=int, default=8, help="Concurrent LLM requests")
+    pregen.add_argument("--batch-size", type=int, default=64, help="Questions per batch; progress is saved after each")
+    pregen.add_argument("--rate", type=float, help="Maximum LLM requests per second")
+    pregen.add_argument("--restart", action="store_true",
+                        help="Walk all questions again instead of resuming; answers still matching their URLs are kept")
+    pregen.set_defaults(func=pregenerate_cmd)
+
+    bulk = commands.add_parser("import", help="Bulk import questions and URLs from JSONL or CSV")
+    bulk.add_argument("file", help="JSONL with question/urls keys, or CSV with question/url columns")
+    bulk.add_argument("--format", choices=["jsonl", "csv"], help="Defaults to the file extension")
+    bulk.add_argument("--chunk-size", type=int, default=5000, help="Rows per transaction")
+    bulk.set_defaults(func=import_cmd)
+
+    export = commands.add_parser("export", help="Export one record per question as JSONL or CSV")
+    export.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    export.add_argument("-o", "--output", help="Output file (default: stdout)")
+    export.set_defaults(func=export_cmd)
+
+    retrieval = commands.add_parser("retrieval-metrics", help="Precision, recall, MRR and nDCG of LLM sources against ratings")
+    retrieval.add_argument("--format", choices=["jsonl", "csv"], default="csv", help="Format of the per-question export")
+    retrieval.add_argument("-o", "--output", help="Also write per-question metrics to this file")
+    retrieval.set_defaults(func=retrieval_metrics_cmd)
+
+    scores = commands.add_parser("score-answers", help="Score answers not scored yet for user/LLM/final similarity")
+    scores.add_argument("--all", action="store_true", help="Rescore every answer, recounting the IDF weights")
+    scores.set_defaults(func=score_answers_cmd)
+
+    agreement = commands.add_parser("agreement", help="Inter-annotator agreement on source relevance and rank")
+    agreement.add_argument("--rebuild", action="store_true", help="Recompute the agreement counts from the ratings first")
+    agreement.set_defaults(func=agreement_cmd)
+
+    index = commands.add_parser("index-corpus", help="Build the BM25 index of a directory of local documents")
+    index.add_argument("corpus", help="Directory of .txt, .md and .html documents; a first line holding a URL names the source")
+    index.add_argument("-o", "--output", default="data/corpus-index", help="Index directory, replaced if it exists")
+    index.set_defaults(func=index_corpus_cmd)
+
+    search_corpus = commands.add_parser("search-corpus", help="Query the local BM25 index")
+    search_corpus.add_argument("query")
+    search_corpus.add_argument("--index", default="data/corpus-index")
+    search_corpus.add_argument("-k", type=int, default=5, help="Number of documents")
+    search_corpus.set_defaults(func=search_corpus_cmd)
+
+    serve = commands.add_parser("serve", help="Serve the app from one or more worker processes")
+    serve.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                       help="Worker processes sharing the database; defaults to one per core")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=5001)
+    serve.add_argument("--log-level", default="info")
+    serve.set_defaults(func=serve_cmd)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Response compression middleware.
+
+Compresses complete text responses (HTML fragments and pages, CSS, JSON)
+with brotli when the client accepts it and the `brotli` package is installed,
+and with gzip otherwise. Streamed responses such as the SSE answer stream and
+the dataset export pass through untouched, so their chunks still reach the
+client as soon as they are produced.
+
+A compressed response is a different representation from the plain one, so
+its strong ETag gets the encoding appended, as in `"tag-gzip"`, and so does a
+304 to a client that accepts it. The suffix is stripped from `If-None-Match`
+before the app sees it, so handlers compare their own tags only.
+"""
+import gzip, re
+
+try: import brotli
+except ImportError: brotli = None
+
+COMPRESSIBLE_TYPES = ("text/html", "text/css", "text/plain", "application/json", "application/javascript")
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if brotli and "br" in accepted: return "br"
+    if "gzip" in accepted: return "gzip"
+    return None
+
+_ENCODED_TAG = re.compile(rb'-(?:br|gzip)"')
+
+def encoded_etags(headers: list, encoding: str) -> list:
+    "Response headers with the strong ETag among them marked with `encoding`"
+    return [(k, v[:-1] + b"-" + encoding.encode() + b'"' if k.lower() == b"etag" and v[:1] == b'"' else v) for k, v in headers]
+
+def compress(body: bytes, encoding: str) -> bytes:
+    return brotli.compress(body, quality=5) if encoding == "br" else gzip.compress(body, compresslevel=6)
+
+class CompressionMiddleware:
+    "ASGI middleware compressing single-message text responses of at least `minimum_size` bytes"
+    def __init__(self, app, minimum_size: int = 500):
+        self.app, self.minimum_size = app, minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http": return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        if b"if-none-match" in headers:
+            scope = dict(scope, headers=[(k, _ENCODED_TAG.sub(b'"', v) if k == b"if-none-match" else v) for k, v in scope["headers"]])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if not encoding: return await self.app(scope, receive, send)
+
+        start = None
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # Held back until we know whether the body arrives in one piece
+                return
+            if start is None: return await send(message)
+            held, start = start, None
+            response_headers = [(k, v) for k, v in held["headers"]]
+            names = {k.lower(): v for k, v in response_headers}
+            body = message.get("body", b"")
+            if held["status"] == 304:
+                await send(dict(held, headers=encoded_etags(response_headers, encoding) + [(b"vary", b"Accept-Encoding")]))
+                return await send(message)
+            if (message.get("more_body") or b"content-encoding" in names or len(body) < self.minimum_size
+                    or not names.get(b"content-type", b"").decode("latin-1").startswith(COMPRESSIBLE_TYPES)):
+                await send(held)
+                return await send(message)
+            body = compress(body, encoding)
+            response_headers = [(k, v) for k, v in encoded_etags(response_headers, encoding) if k.lower() != b"content-length"]
+            response_headers += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode()),
+                                 (b"vary", b"Accept-Encoding")]
+            await send(dict(held, headers=response_headers))
+            await send(dict(message, body=body))
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,51 @@
+"""Conditional GET for pages that change only when their question does.
+
+A page's strong ETag names its route and question, the question's version
+counter from `question_versions`, and whether htmx asked for it (htmx gets
+the page without its layout). It also carries a digest of the app's code and
+static files, so a deploy changes every tag. `Last-Modified` is the time of
+the question's latest version. `not_modified` checks a request's
+`If-None-Match`, or failing that its `If-Modified-Since`, against them. A page
+that is still current costs one primary-key lookup. `CompressionMiddleware`
+marks tags of compressed responses with their encoding and strips the mark
+from `If-None-Match` again, so the tags made here never carry it.
+"""
+import email.utils, functools, hashlib, os, time
+from pathlib import Path
+
+@functools.cache
+def build_digest() -> str:
+    "Digest of the app's Python modules and static files, which together render every page"
+    root, digest = Path(os.path.dirname(os.path.abspath(__file__))), hashlib.sha256()
+    for path in sorted([*root.glob("*.py"), *(p for p in (root / "static").rglob("*") if p.is_file())]):
+        digest.update(path.relative_to(root).as_posix().encode() + b"\0" + path.read_bytes())
+    return digest.hexdigest()[:12]
+
+def page_etag(route: str, question_id: int, version: int, htmx: bool) -> str:
+    return f'"{route}-{question_id}-v{version}-{"hx" if htmx else "page"}-{build_digest()}"'
+
+def http_date(timestamp: float) -> str:
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+def _dated(modified: int) -> bool:
+    # A second write within the same second would keep its Last-Modified, so the date is only a validator once the second is over
+    return 0 < modified < int(time.time())
+
+def validators(etag: str, modified: int) -> dict:
+    "Response headers for a page with this tag, last changed at Unix time `modified`"
+    # no-cache: browsers keep the page but revalidate it on every use, which the 304 makes cheap
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "HX-Request"}
+    if _dated(modified): headers["Last-Modified"] = http_date(modified)
+    return headers
+
+def not_modified(headers, etag: str, modified: int) -> bool:
+    "Whether the client's copy, as described by the request's validators, is the current one"
+    if (if_none_match := headers.get("if-none-match")) is not None:
+        # If-None-Match uses the weak comparison, so W/ prefixes are ignored; a client sending it ignores the date
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if _dated(modified) and (if_modified_since := headers.get("if-modified-since")):
+        try: since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError): return False
+        return modified <= since
+    return False
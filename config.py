@@ -0,0 +1,60 @@
+"""Settings for the RAG evaluation app.
+
+`AppConfig` holds everything `main.create_app` needs. `AppConfig.from_env`
+reads the `RAG_*` environment variables named next to each field, so worker
+processes started by `cli.py serve` configure themselves the same way. The
+HTTP LLM backend keeps its own `LLM_*` variables; see `llm.HTTPLLM.from_env`.
+"""
+import os
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class AppConfig:
+    "Settings for `main.create_app`; `from_env` reads them from the environment"
+    # RAG_DB_PATH: the SQLite database, shared by every worker process
+    db_path: str = "data/rag.db"
+    # RAG_DB_READERS: read-only pooled connections per process; 0 runs queries inline on one connection
+    db_readers: int = 4
+    # RAG_DEBUG_MODE: simulate the LLM; 0 uses the HTTP backend configured by the LLM_* variables
+    debug_mode: bool = True
+    # LLM_CACHE_MEMORY, LLM_CACHE_TTL, LLM_CACHE_MAX_ROWS: the LLM answer cache; see llm_cache.py
+    llm_cache_memory: int = 256
+    llm_cache_ttl: float = 7 * 86400
+    llm_cache_max_rows: int = 10_000
+    # RAG_FRAGMENT_CACHE, RAG_FRAGMENT_CACHE_BYTES: cache rendered pages until their question changes
+    fragment_cache: bool = True
+    fragment_cache_bytes: int = 16 * 1024 * 1024
+    # RAG_PREGENERATE, RAG_PREGENERATE_WORKERS, RAG_PREGENERATE_RATE: pre-generate LLM answers in the background
+    pregenerate: bool = False
+    pregenerate_workers: int = 4
+    pregenerate_rate: float | None = None
+    # RAG_STREAM_LLM: stream the LLM answer into the comparison view over SSE; 0 waits for the whole answer
+    stream_llm: bool = True
+    # RAG_SLOW_REQUEST_MS: log requests slower than this with their queries
+    slow_request_ms: float | None = None
+    # RAG_CORPUS_INDEX, RAG_CORPUS_TOP_K: offer the best-matching documents of a local BM25 index as LLM sources
+    corpus_index: str | None = None
+    corpus_top_k: int = 5
+
+    @classmethod
+    def from_env(cls, env=os.environ) -> "AppConfig":
+        "The defaults, overridden by whichever variables are set"
+        flag = lambda name, default: env.get(name, "1" if default else "0") != "0"
+        optional = lambda name: float(env[name]) if env.get(name) else None
+        return cls(
+            db_path=env.get("RAG_DB_PATH", cls.db_path),
+            db_readers=int(env.get("RAG_DB_READERS", cls.db_readers)),
+            debug_mode=flag("RAG_DEBUG_MODE", cls.debug_mode),
+            llm_cache_memory=int(env.get("LLM_CACHE_MEMORY", cls.llm_cache_memory)),
+            llm_cache_ttl=float(env.get("LLM_CACHE_TTL", cls.llm_cache_ttl)),
+            llm_cache_max_rows=int(env.get("LLM_CACHE_MAX_ROWS", cls.llm_cache_max_rows)),
+            fragment_cache=flag("RAG_FRAGMENT_CACHE", cls.fragment_cache),
+            fragment_cache_bytes=int(env.get("RAG_FRAGMENT_CACHE_BYTES", cls.fragment_cache_bytes)),
+            pregenerate=env.get("RAG_PREGENERATE", "0") == "1",
+            pregenerate_workers=int(env.get("RAG_PREGENERATE_WORKERS", cls.pregenerate_workers)),
+            pregenerate_rate=optional("RAG_PREGENERATE_RATE"),
+            stream_llm=flag("RAG_STREAM_LLM", cls.stream_llm),
+            slow_request_ms=optional("RAG_SLOW_REQUEST_MS"),
+            corpus_index=env.get("RAG_CORPUS_INDEX") or None,
+            corpus_top_k=int(env.get("RAG_CORPUS_TOP_K", cls.corpus_top_k)),
+        )
@@ -0,0 +1,139 @@
+"""Local BM25 retrieval over a directory of documents, used to supply LLM sources offline.
+
+`build_index` reads every text, Markdown and HTML file under a directory
+and writes an inverted index into a directory of its own. Postings are
+stored as flat arrays, grouped by term: the document ids and term
+frequencies go in `doc_ids.npy` and `tfs.npy`. Term `t`'s postings lie
+between `offsets[t]` and `offsets[t + 1]`. Document lengths and source URLs
+sit alongside them. `CorpusIndex` memory-maps the arrays, so opening
+an index costs only its term list, and a query reads just the postings of
+its own terms. `search` scores those postings with BM25 in a few array
+operations.
+
+A document's source URL is its first line when that line is a bare http(s)
+URL, and otherwise its `file://` URI. `CorpusLLM` offers the top documents
+for each question to the wrapped LLM as candidate sources.
+"""
+import array, hashlib, html, json, os, re, shutil
+from collections import Counter
+from pathlib import Path
+from typing import AsyncIterator, List
+
+import numpy as np
+
+from answer_scores import tokenize
+from llm import LLMClient
+
+DOCUMENT_SUFFIXES = {".txt", ".md", ".html", ".htm"}
+
+_URL_LINE = re.compile(r"https?://\S+")
+_TAG = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.S | re.I)
+
+def read_document(path: Path) -> tuple[str, str]:
+    "The source URL and plain text of a corpus file"
+    text = path.read_text(encoding="utf-8", errors="replace")
+    first, _, rest = text.partition("\n")
+    url = first.strip() if _URL_LINE.fullmatch(first.strip()) else None
+    if url: text = rest
+    if path.suffix.lower() in (".html", ".htm"): text = html.unescape(_TAG.sub(" ", text))
+    return url or path.resolve().as_uri(), text
+
+def corpus_files(corpus_dir: str) -> List[Path]:
+    return sorted(p for p in Path(corpus_dir).rglob("*") if p.is_file() and p.suffix.lower() in DOCUMENT_SUFFIXES)
+
+def build_index(corpus_dir: str, index_dir: str) -> dict:
+    "Index every document under `corpus_dir` into `index_dir`, replacing any index there, and return its statistics"
+    term_ids, terms, urls = {}, [], []
+    # Postings in document order, as compact typed arrays until they are sorted by term
+    doc_col, term_col, tf_col, lengths = array.array("i"), array.array("i"), array.array("i"), array.array("i")
+    digest = hashlib.sha256()
+    for doc_id, path in enumerate(corpus_files(corpus_dir)):
+        url, text = read_document(path)
+        digest.update(f"{url}\n{len(text)}\n".encode())
+        digest.update(text.encode())
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            if (t := term_ids.get(term)) is None:
+                t = term_ids[term] = len(terms)
+                terms.append(term)
+            term_col.append(t)
+            tf_col.append(tf)
+        doc_col.extend([doc_id] * len(counts))
+        lengths.append(len(tokens))
+        urls.append(url)
+
+    term_arr = np.frombuffer(term_col, np.int32)
+    # A stable sort keeps each term's postings in ascending document order
+    order = np.argsort(term_arr, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(term_arr, minlength=len(terms))))).astype(np.int64)
+    meta = dict(documents=len(urls), terms=len(terms), postings=len(term_arr),
+                average_length=float(np.mean(lengths)) if len(lengths) else 0.0, fingerprint=digest.hexdigest()[:16])
+
+    # Written next to the old index and swapped in, so a reader never sees a half-written one
+    tmp, old = f"{index_dir.rstrip(os.sep)}.tmp", f"{index_dir.rstrip(os.sep)}.old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp, "doc_ids.npy"), np.frombuffer(doc_col, np.int32)[order])
+    # Term frequencies above 65535 are clipped; BM25 saturates long before that
+    np.save(os.path.join(tmp, "tfs.npy"), np.minimum(np.frombuffer(tf_col, np.int32)[order], 65535).astype(np.uint16))
+    np.save(os.path.join(tmp, "lengths.npy"), np.frombuffer(lengths, np.int32))
+    with open(os.path.join(tmp, "terms.json"), "w", encoding="utf-8") as f: json.dump(terms, f)
+    with open(os.path.join(tmp, "urls.json"), "w", encoding="utf-8") as f: json.dump(urls, f)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f: json.dump(meta, f)
+    if os.path.exists(index_dir): os.replace(index_dir, old)
+    os.replace(tmp, index_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return meta
+
+class CorpusIndex:
+    "A BM25 index written by `build_index`, with its postings memory-mapped"
+    def __init__(self, index_dir: str):
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode="r")
+        self.offsets, self.doc_ids, self.tfs, self.lengths = (load(n) for n in ("offsets.npy", "doc_ids.npy", "tfs.npy", "lengths.npy"))
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f: self.meta = json.load(f)
+        with open(os.path.join(index_dir, "terms.json"), encoding="utf-8") as f: self.term_ids = {t: i for i, t in enumerate(json.load(f))}
+        with open(os.path.join(index_dir, "urls.json"), encoding="utf-8") as f: self.urls = json.load(f)
+        self.fingerprint = self.meta['fingerprint']
+
+    def search(self, query: str, k: int = 5, k1: float = 1.2, b: float = 0.75) -> List[tuple[str, float]]:
+        "The `k` best-scoring documents for `query` as `(url, score)`, best first"
+        ids = np.array(sorted({self.term_ids[t] for t in tokenize(query) if t in self.term_ids}), np.int64)
+        if not len(ids) or k <= 0: return []
+        starts, ends = self.offsets[ids], self.offsets[ids + 1]
+        df = (ends - starts).astype(np.float64)
+        # Lucene's IDF, which stays positive for terms in more than half the documents
+        idf = np.log1p((self.meta['documents'] - df + 0.5) / (df + 0.5))
+        docs = np.concatenate([self.doc_ids[s:e] for s, e in zip(starts, ends)])
+        tf = np.concatenate([self.tfs[s:e] for s, e in zip(starts, ends)]).astype(np.float64)
+        norm = k1 * (1 - b + b * self.lengths[docs] / max(self.meta['average_length'], 1e-9))
+        weights = np.repeat(idf, (ends - starts)) * tf * (k1 + 1) / (tf + norm)
+        # Accumulating into one slot per document is cheaper than sorting the postings by document
+        scores = np.bincount(docs, weights=weights, minlength=self.meta['documents'])
+        # Every matching document scoring at least the k-th best, so ties at the cut go to the earlier document
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k] if len(scores) > k else 0
+        top = np.flatnonzero((scores >= kth) & (scores > 0))
+        top = top[np.lexsort((top, -scores[top]))][:k]
+        return [(self.urls[i], float(scores[i])) for i in top]
+
+class CorpusLLM:
+    "`LLMClient` that offers the top `k` corpus documents for the question as candidate sources, ahead of the given URLs"
+    def __init__(self, client: LLMClient, index: CorpusIndex, k: int = 5):
+        self.client, self.index, self.k = client, index, k
+        # Answers depend on the corpus, so cache and pre-generation keys must change with the index
+        self.model = f"{client.model}+bm25:{index.fingerprint}"
+
+    def candidates(self, question: str, urls: List[str]) -> List[str]:
+        return list(dict.fromkeys([url for url, _ in self.index.search(question, self.k)] + urls))
+
+    async def generate(self, question: str, urls: List[str]) -> tuple[str, List[str]]:
+        return await self.client.generate(question, self.candidates(question, urls))
+
+    def stream(self, question: str, urls: List[str]) -> AsyncIterator[str]:
+        return self.client.stream(question, self.candidates(question, urls))
+
+    def sources(self, answer: str, urls: List[str]) -> List[str]:
+        return self.client.sources(answer, urls)
+
+    async def aclose(self): await self.client.aclose()
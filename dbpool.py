@@ -0,0 +1,103 @@
+"""SQLite access for async handlers: WAL mode, a read pool and one writer.
+
+Every connection runs in WAL mode, so readers never wait for the writer and
+the writer never waits for readers. `DBPool.read` runs a function on one of
+`readers` threads, each with its own read-only connection; `DBPool.write`
+runs it on a single writer thread that owns the read-write connection, so
+writes are serialized without holding up the event loop. With `readers=0`
+both run inline on the writer connection, as before the pool existed. The app
+opens the read connections with `DBPool.open_readers` at startup, once its
+schema is migrated, so no request waits on opening one. Work outside request
+handlers, such as the LLM cache, gets its own connection from `DBPool.open` so
+it never touches the writer's. Several processes may share the file; their
+writes take turns, waiting up to the busy timeout.
+"""
+import asyncio, contextvars, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import apsw
+from fastlite import database
+
+PRAGMAS = [
+    "PRAGMA busy_timeout = 5000",  # First, so that workers opening a new database together wait for its WAL switch
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",  # Durable at each checkpoint; a power loss can only drop the latest commits
+    "PRAGMA cache_size = -16000",  # 16 MB page cache per connection
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+]
+
+def connect(path: str, timeout: float = 5.0):
+    "`database(path)`, retried while another process holds the lock"
+    # apsw's connection hooks run PRAGMA optimize with a 100 ms busy timeout, before PRAGMAS can raise it
+    deadline = time.monotonic() + timeout
+    while True:
+        try: return database(path)
+        except apsw.BusyError:
+            if time.monotonic() > deadline: raise
+            time.sleep(0.01)
+
+def configure(db, read_only: bool = False):
+    for pragma in PRAGMAS: db.execute(pragma).fetchall()
+    if read_only: db.execute("PRAGMA query_only = 1")
+    return db
+
+class DBPool:
+    "A writer connection plus per-thread read connections to the SQLite file at `path`"
+    def __init__(self, path: str, readers: int = 4, setup: Callable | None = None):
+        self.path, self.readers, self.setup = path, readers, setup
+        self.writer = configure(connect(path))
+        self._local = threading.local()
+        # Every reader thread's connection, closed with the pool
+        self._readers = []
+        self._read_pool = ThreadPoolExecutor(readers, thread_name_prefix="db-read") if readers else None
+        self._write_pool = ThreadPoolExecutor(1, thread_name_prefix="db-write") if readers else None
+
+    def open(self, read_only: bool = True):
+        "A new connection, set up like the pooled ones; the caller closes it"
+        db = configure(connect(self.path), read_only=read_only)
+        if self.setup: self.setup(db)
+        return db
+
+    def open_readers(self):
+        "Open every reader thread's connection now, rather than on its first read"
+        # A connection opened under load runs apsw's PRAGMA optimize hook while the writer may hold the lock;
+        # at startup `connect` can wait that out. The barrier keeps each open on a thread of its own
+        if not self._read_pool: return
+        opened = threading.Barrier(self.readers)
+        def open_reader():
+            try: self._reader()
+            except BaseException:
+                opened.abort()
+                raise
+            opened.wait()
+        for future in [self._read_pool.submit(open_reader) for _ in range(self.readers)]: future.result()
+
+    def _reader(self):
+        if (db := getattr(self._local, "db", None)) is None:
+            db = self._local.db = self.open()
+            self._readers.append(db)
+        return db
+
+    async def _run(self, pool, fn, *args):
+        # The copied context carries per-request state (such as metrics) into the worker thread
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(pool, ctx.run, fn, *args)
+
+    async def read(self, fn: Callable, *args):
+        "`fn(db, *args)` on a read-only connection"
+        if not self._read_pool: return fn(self.writer, *args)
+        return await self._run(self._read_pool, lambda: fn(self._reader(), *args))
+
+    async def write(self, fn: Callable, *args):
+        "`fn(*args)` on the writer thread, which alone uses `self.writer`"
+        if not self._write_pool: return fn(*args)
+        return await self._run(self._write_pool, fn, *args)
+
+    def close(self):
+        "Stop the worker threads, then close the writer and reader connections"
+        for pool in (self._read_pool, self._write_pool):
+            if pool: pool.shutdown(wait=True)
+        for db in (*self._readers, self.writer): db.conn.close()
+        self._readers.clear()
@@ -0,0 +1,127 @@
+"""Near-duplicate question detection with MinHash and locality-sensitive hashing.
+
+Question text is normalized (case, punctuation, whitespace) and split into
+character shingles. Each question gets a MinHash signature in
+`question_minhash`, and the signature's bands are bucketed in `question_lsh`,
+so questions sharing any band bucket are candidates. Finding the closest
+existing question therefore reads a handful of buckets rather than every row;
+candidates are then scored by the exact Jaccard similarity of their shingles.
+"""
+import hashlib, re, zlib
+from typing import Iterable
+
+import numpy as np
+
+NUM_PERM = 64
+BANDS, ROWS = 16, 4  # Questions become candidates from about 0.5 Jaccard similarity
+# Universal hashes (a * h + b) mod p over 32-bit shingle hashes; the products stay below 2**64
+_PRIME = (1 << 32) - 5
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+
+DEDUPE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS question_minhash (
+    question_id INTEGER PRIMARY KEY,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS question_lsh (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    question_id INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, question_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_question_lsh_question ON question_lsh(question_id);
+CREATE TRIGGER IF NOT EXISTS question_minhash_ad AFTER DELETE ON questions BEGIN
+    DELETE FROM question_minhash WHERE question_id = old.id;
+    DELETE FROM question_lsh WHERE question_id = old.id;
+END;
+"""
+
+def normalize(text: str) -> str:
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+def shingles(text: str, k: int = 3) -> set[str]:
+    "Character `k`-grams of the normalized text"
+    norm = normalize(text)
+    return {norm[i:i + k] for i in range(max(1, len(norm) - k + 1))}
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def signature(text: str) -> np.ndarray:
+    hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles(text)), dtype=np.uint64)
+    return ((_A * hashes + _B) % _PRIME).min(axis=1)
+
+def buckets(sig: np.ndarray) -> list[tuple[int, int]]:
+    "`(band, bucket)` pairs for a signature"
+    return [(band, int.from_bytes(hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).digest(),
+                                  'little', signed=True))
+            for band in range(BANDS)]
+
+def index_questions(db, rows: Iterable[tuple[int, str]]):
+    "Add or refresh the MinHash entries of `(question_id, text)` rows"
+    sigs, lsh = [], []
+    for qid, text in rows:
+        sig = signature(text)
+        sigs.append((qid, sig.tobytes()))
+        lsh.extend((band, bucket, qid) for band, bucket in buckets(sig))
+    if not sigs: return
+    cur = db.conn.cursor()
+    cur.executemany("DELETE FROM question_lsh WHERE question_id = ?", [(qid,) for qid, _ in sigs])
+    cur.executemany("INSERT OR REPLACE INTO question_minhash (question_id, signature) VALUES (?, ?)", sigs)
+    cur.executemany("INSERT OR IGNORE INTO question_lsh (band, bucket, question_id) VALUES (?, ?, ?)", lsh)
+
+def index_missing(db, batch_size: int = 5000) -> int:
+    "Index questions that have no MinHash entry yet and return how many there were"
+    count = 0
+    while rows := db.execute("""
+            SELECT id, text FROM questions WHERE id NOT IN (SELECT question_id FROM question_minhash)
+            LIMIT ?""", [batch_size]).fetchall():
+        with db.conn: index_questions(db, rows)
+        count += len(rows)
+    return count
+
+def closest_question(db, text: str, exclude: int | None = None, max_candidates: int = 50) -> tuple[int, str, float] | None:
+    "The `(id, text, similarity)` of the most similar indexed question sharing an LSH bucket with `text`"
+    pairs = buckets(signature(text))
+    # Questions sharing the most bands are the likeliest matches; only those are scored exactly
+    candidates = db.execute(f"""
+        SELECT q.id, q.text FROM questions q JOIN (
+            SELECT question_id, COUNT(*) AS shared FROM question_lsh
+            WHERE (band, bucket) IN (VALUES {','.join(['(?, ?)'] * len(pairs))})
+            GROUP BY question_id ORDER BY shared DESC LIMIT ?
+        ) c ON c.question_id = q.id
+    """, [v for pair in pairs for v in pair] + [max_candidates]).fetchall()
+    target = shingles(text)
+    scored = [(qid, qtext, jaccard(target, shingles(qtext))) for qid, qtext in candidates if qid != exclude]
+    return max(scored, key=lambda c: c[2], default=None)
+
+def duplicate_clusters(db, threshold: float = 0.8, window: int = 8) -> list[list[int]]:
+    "Groups of question ids whose estimated similarity to another group member is at least `threshold`"
+    parent = {}
+    def find(x):
+        while parent.setdefault(x, x) != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for band, members in db.execute("""
+            SELECT band, json_group_array(question_id) FROM question_lsh GROUP BY band, bucket HAVING COUNT(*) > 1"""):
+        rows = db.execute("SELECT question_id, signature FROM question_minhash WHERE question_id IN (SELECT value FROM json_each(?))",
+                          [members]).fetchall()
+        ids = np.array([qid for qid, _ in rows])
+        sigs = np.stack([np.frombuffer(sig, dtype=np.uint64) for _, sig in rows])
+        # Members agree on this band, so sort on the remaining components: near-identical signatures end up
+        # next to each other, and each member is only compared with the `window` members after it
+        rest = np.roll(sigs, -(band + 1) * ROWS, axis=1)[:, :NUM_PERM - ROWS]
+        order = np.lexsort(rest.T[::-1])
+        ids, sigs = ids[order], sigs[order]
+        for offset in range(1, min(window, len(ids) - 1) + 1):
+            similar = (sigs[:-offset] == sigs[offset:]).mean(axis=1) >= threshold
+            for a, b in zip(ids[:-offset][similar].tolist(), ids[offset:][similar].tolist()):
+                parent[find(b)] = find(a)
+
+    clusters = {}
+    for qid in parent: clusters.setdefault(find(qid), []).append(qid)
+    return sorted((sorted(c) for c in clusters.values() if len(c) > 1), key=lambda c: c[0])
@@ -0,0 +1,85 @@
+"""Streaming export of the evaluation dataset, one record per question.
+
+Each record carries the question, every answer row (user, LLM and final
+answer), how often each final answer was chosen, and the question's sources
+ranked by how often annotators marked them relevant. Records are assembled by
+walking three cursors ordered by question id side by side, so memory use does
+not grow with the size of the database and output starts immediately.
+"""
+import csv, io, json
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterator
+
+CSV_COLUMNS = ["question_id", "question", "final_answers", "answers", "sources"]
+
+def _groups(rows):
+    "`(question_id, rows)` for rows ordered by their first column"
+    for qid, group in groupby(rows, key=itemgetter(0)): yield qid, list(group)
+
+def _take(groups, pending, qid):
+    "Rows of `groups` for `qid`, skipping groups of ids smaller than `qid`; `pending` holds the peeked group"
+    while pending[0] is None or pending[0][0] < qid:
+        pending[0] = next(groups, (float('inf'), []))
+    return pending[0][1] if pending[0][0] == qid else []
+
+def export_records(db) -> Iterator[dict]:
+    "Yield one dict per question in id order"
+    answer_groups = _groups(db.execute("""
+        SELECT question_id, id, user_answer, llm_answer, llm_sources, final_answer
+        FROM answers ORDER BY question_id, id"""))
+    source_groups = _groups(db.execute("""
+        SELECT u.question_id, u.url, u.source, s.relevant_count, s.rating_count,
+               s.rank_sum * 1.0 / NULLIF(s.rank_count, 0)
+        FROM urls u LEFT JOIN source_counts s ON s.question_id = u.question_id AND s.url = u.url
+        ORDER BY u.question_id, u.id"""))
+    answers_peek, sources_peek = [None], [None]
+
+    for qid, text in db.execute("SELECT id, text FROM questions ORDER BY id"):
+        answer_rows = _take(answer_groups, answers_peek, qid)
+        sources = {}
+        for _, url, source, relevant, ratings, avg_rank in _take(source_groups, sources_peek, qid):
+            sources.setdefault(url, dict(url=url, source=source, relevant_count=relevant or 0,
+                                         rating_count=ratings or 0, avg_rank=avg_rank))
+        ranked = sorted(sources.values(), key=lambda s: (-s['relevant_count'], s['avg_rank'] is None, s['avg_rank'] or 0))
+        finals = Counter(r[5] for r in answer_rows if r[5])
+        yield dict(
+            question_id=qid,
+            question=text,
+            final_answers=[dict(answer=a, count=n) for a, n in finals.most_common()],
+            answers=[dict(id=r[1], user_answer=r[2], llm_answer=r[3],
+                          llm_sources=[s for s in (r[4] or "").split(",") if s], final_answer=r[5])
+                     for r in answer_rows],
+            sources=ranked,
+        )
+
+def jsonl_lines(records) -> Iterator[str]:
+    for r in records: yield json.dumps(r, ensure_ascii=False) + "\n"
+
+def csv_lines(records) -> Iterator[str]:
+    "CSV rows with the nested lists JSON-encoded in their cells"
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CSV_COLUMNS)
+    yield buf.getvalue()
+    for r in records:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow([r['question_id'], r['question']] +
+                        [json.dumps(r[c], ensure_ascii=False) for c in CSV_COLUMNS[2:]])
+        yield buf.getvalue()
+
+def export_chunks(db, fmt: str = "jsonl", chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    "The encoded export in chunks of roughly `chunk_size` bytes"
+    if fmt not in ("jsonl", "csv"): raise ValueError(f"Unsupported export format: {fmt!r}")
+    lines = (jsonl_lines if fmt == "jsonl" else csv_lines)(export_records(db))
+    buf, size = [], 0
+    for line in lines:
+        data = line.encode()
+        buf.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf: yield b"".join(buf)
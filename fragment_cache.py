@@ -0,0 +1,108 @@
+"""Cache of rendered page fragments, invalidated by per-question version counters.
+
+`question_versions` holds a counter per question that triggers bump on every
+write to the question, its URLs, its answers or their ratings, along with the
+time of that write; row 0 counts changes to the question list itself. Because the counters live in the
+database, writes from other processes (the CLI, other workers) invalidate
+fragments too. `FragmentCache` keys rendered HTML on route, question id and
+the current version, so stale entries are never served and simply age out of
+the LRU, which is bounded by total size in bytes.
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from fasthtml.common import NotStr, to_xml
+
+VERSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS question_versions (
+    question_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    -- Unix time of the latest version
+    modified INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_BUMP = """
+    INSERT INTO question_versions (question_id, version, modified) VALUES ({q}, 1, CAST(strftime('%s', 'now') AS INTEGER))
+    ON CONFLICT (question_id) DO UPDATE SET version = version + 1, modified = excluded.modified;
+"""
+
+_RATED_QUESTION = "(SELECT question_id FROM answers WHERE id = {r}.answer_id)"
+
+# Name, event, table and the questions each write changes
+_TRIGGERS = [
+    ("question_versions_qi", "INSERT", "questions", "new.id", "0"),
+    ("question_versions_qu", "UPDATE", "questions", "new.id", "0"),
+    ("question_versions_qd", "DELETE", "questions", "old.id", "0"),
+    ("question_versions_ui", "INSERT", "urls", "new.question_id"),
+    ("question_versions_uu", "UPDATE", "urls", "old.question_id", "new.question_id"),
+    ("question_versions_ud", "DELETE", "urls", "old.question_id"),
+    ("question_versions_ai", "INSERT", "answers", "new.question_id"),
+    ("question_versions_au", "UPDATE", "answers", "old.question_id", "new.question_id"),
+    ("question_versions_ad", "DELETE", "answers", "old.question_id"),
+    ("question_versions_ri", "INSERT", "url_ratings", _RATED_QUESTION.format(r="new")),
+    ("question_versions_ru", "UPDATE", "url_ratings", _RATED_QUESTION.format(r="new")),
+    ("question_versions_rd", "DELETE", "url_ratings", _RATED_QUESTION.format(r="old")),
+]
+
+VERSION_TRIGGERS = "".join(
+    f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN{''.join(_BUMP.format(q=q) for q in questions)}END;\n"
+    for name, event, table, *questions in _TRIGGERS)
+
+def create_versions(db):
+    db.executescript(VERSION_SCHEMA + VERSION_TRIGGERS)
+
+def replace_version_triggers(db):
+    "Recreate the triggers, for databases whose triggers predate the current `_BUMP`"
+    db.executescript("".join(f"DROP TRIGGER IF EXISTS {name};\n" for name, *_ in _TRIGGERS) + VERSION_TRIGGERS)
+
+def question_version(db, question_id: int) -> int:
+    "The question's change counter; question id 0 is the question list"
+    return question_stamp(db, question_id)[0]
+
+def question_stamp(db, question_id: int) -> tuple[int, int]:
+    "The question's change counter and the Unix time it last changed, or `(0, 0)` if it never has"
+    row = db.execute("SELECT version, modified FROM question_versions WHERE question_id = ?", [question_id]).fetchone()
+    return tuple(row) if row else (0, 0)
+
+def touch_questions(db, question_ids: list[int] | None = None):
+    "Mark the questions (default: all) changed, after a write of data their pages show that the triggers do not watch"
+    where = f"WHERE question_id IN ({','.join('?' * len(question_ids))})" if question_ids else ""
+    db.execute(f"UPDATE question_versions SET version = version + 1, modified = CAST(strftime('%s', 'now') AS INTEGER) {where}",
+               question_ids or [])
+
+class FragmentCache:
+    "LRU of rendered HTML keyed by `(route, question_id, version)` and bounded to `max_bytes`"
+    def __init__(self, db, max_bytes: int = 16 * 1024 * 1024, enabled: bool = True):
+        self.db, self.max_bytes, self.enabled = db, max_bytes, enabled
+        self.entries, self.size = OrderedDict(), 0
+        self.stats = dict(hits=0, misses=0, evictions=0)
+        # Pages are rendered on several reader threads at once
+        self.lock = threading.Lock()
+
+    def render(self, route: str, question_id: int, build: Callable[[], object], db=None):
+        "The HTML of `build()` for this route and question, rendered only when the question has changed"
+        if not self.enabled: return build()
+        key = (route, question_id, question_version(db or self.db, question_id))
+        with self.lock:
+            if (html := self.entries.get(key)) is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return NotStr(html)
+            self.stats['misses'] += 1
+        # Rendered outside the lock; two threads missing on the same key both render it, which is harmless
+        html = to_xml(build())
+        with self.lock:
+            self.size += len(html) - len(self.entries.get(key, ""))
+            self.entries[key] = html
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats['evictions'] += 1
+        return NotStr(html)
+
+    def summary(self) -> dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return dict(self.stats, lookups=lookups, hit_rate=self.stats['hits'] / lookups if lookups else 0.0,
+                    entries=len(self.entries), bytes=self.size, enabled=self.enabled)
@@ -0,0 +1,199 @@
+"""LLM backends used to produce the comparison answer for a question.
+
+Every backend implements `LLMClient`: an async `generate(question, urls)` that
+returns `(answer, sources)`, an async iterator `stream(question, urls)` of answer
+text chunks, `sources(answer, urls)` to pick the sources of a streamed answer,
+and `aclose()`. `SimulatedLLM` wraps `simulate_llm_response` for debug mode,
+citing the first candidate sources it is offered;
+`HTTPLLM` talks to an OpenAI-compatible chat completions endpoint over a pooled
+connection, with a concurrency limit, per-request timeouts, retries with
+backoff and a circuit breaker.
+"""
+import asyncio, json, os, random, re, time
+from typing import AsyncIterator, List, Protocol
+
+import httpx
+
+PROMPT_TEMPLATE = """Answer the question below as accurately as you can.
+Cite the URLs you relied on. Candidate sources:
+{urls}
+
+Question: {question}"""
+
+class LLMError(Exception):
+    "The LLM backend could not produce an answer"
+
+class CircuitOpenError(LLMError):
+    "Requests are being rejected because the backend has been failing"
+
+class MalformedResponseError(LLMError):
+    "The backend answered, but not with a chat completion"
+
+class LLMClient(Protocol):
+    model: str
+    async def generate(self, question: str, urls: List[str]) -> tuple[str, List[str]]: ...
+    def stream(self, question: str, urls: List[str]) -> AsyncIterator[str]: ...
+    def sources(self, answer: str, urls: List[str]) -> List[str]: ...
+    async def aclose(self) -> None: ...
+
+# Cited by the simulated LLM when it is offered no candidate sources
+PLACEHOLDER_SOURCES = ["https://example.com/doc1", "https://example.com/doc2"]
+
+def simulate_llm_response(question: str, urls: List[str]) -> tuple:
+    """Debug function to simulate LLM response when API is not available"""
+    # Cites the first two candidate sources in the text, as a real model would, so streamed answers keep them
+    cited = urls[:2]
+    return (
+        "This is a simulated LLM answer that would normally come from the API. "
+        "It demonstrates how the system works without needing the actual LLM service."
+        + (f" Sources: {' '.join(cited)}" if cited else ""),
+        cited or PLACEHOLDER_SOURCES
+    )
+
+class SimulatedLLM:
+    "`LLMClient` that returns `simulate_llm_response` without any network access"
+    model = "simulated"
+    async def generate(self, question: str, urls: List[str]) -> tuple[str, List[str]]:
+        return simulate_llm_response(question, urls)
+    async def stream(self, question: str, urls: List[str]) -> AsyncIterator[str]:
+        words = simulate_llm_response(question, urls)[0].split(" ")
+        for i, word in enumerate(words): yield word if i == len(words) - 1 else word + " "
+    def sources(self, answer: str, urls: List[str]) -> List[str]:
+        return extract_sources(answer) or PLACEHOLDER_SOURCES
+    async def aclose(self): pass
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures. After `reset_after` seconds it is half-open: one trial
+    request goes through while the rest keep failing fast, and the trial's outcome closes or reopens it."""
+    def __init__(self, threshold: int = 5, reset_after: float = 30.0):
+        self.threshold, self.reset_after = threshold, reset_after
+        self.failures, self.opened_at, self.trial = 0, None, False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_after
+
+    def check(self) -> bool:
+        "Raise `CircuitOpenError` unless a request may go ahead; True if it is the half-open trial, which must `end_trial`"
+        if self.opened_at is None: return False
+        if self.is_open or self.trial: raise CircuitOpenError(f"LLM backend unavailable, retrying in {self.reset_after:.0f}s")
+        self.trial = True
+        return True
+
+    def end_trial(self):
+        # A trial that ended without a success or failure, e.g. cancelled or rejected, lets the next request try
+        self.trial = False
+
+    def record_success(self):
+        self.failures, self.opened_at = 0, None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold: self.opened_at = time.monotonic()
+
+_URL_RE = re.compile(r'(?:https?|file)://[^\s<>()"\']+')
+
+def extract_sources(text: str) -> List[str]:
+    "URLs cited in `text`, in order of first appearance"
+    return list(dict.fromkeys(u.rstrip('.,;:!?]') for u in _URL_RE.findall(text)))
+
+class HTTPLLM:
+    "`LLMClient` for an OpenAI-compatible `/chat/completions` endpoint"
+    def __init__(self, base_url: str, model: str, api_key: str | None = None, max_concurrency: int = 8,
+                 timeout: float = 60.0, retries: int = 3, backoff: float = 0.5,
+                 breaker_threshold: int = 5, breaker_reset: float = 30.0):
+        self.base_url, self.model, self.api_key = base_url.rstrip('/'), model, api_key
+        self.max_concurrency, self.timeout = max_concurrency, timeout
+        self.retries, self.backoff = retries, backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = None
+
+    @classmethod
+    def from_env(cls):
+        "Configure from the `LLM_*` environment variables"
+        env = os.environ
+        return cls(env.get("LLM_BASE_URL", "http://localhost:8001/v1"), env.get("LLM_MODEL", "gpt-4o-mini"),
+                   api_key=env.get("LLM_API_KEY"),
+                   max_concurrency=int(env.get("LLM_MAX_CONCURRENCY", 8)),
+                   timeout=float(env.get("LLM_TIMEOUT", 60)),
+                   retries=int(env.get("LLM_RETRIES", 3)))
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop; one pool shared by all requests
+        if self._client is None:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, headers=headers, timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency))
+        return self._client
+
+    def payload(self, question: str, urls: List[str]) -> dict:
+        prompt = PROMPT_TEMPLATE.format(question=question, urls="\n".join(urls) or "(none)")
+        return dict(model=self.model, messages=[dict(role="user", content=prompt)])
+
+    async def _post(self, payload: dict) -> str:
+        async with self._semaphore:
+            r = await self.client.post("/chat/completions", json=payload)
+        if r.status_code == 429 or r.status_code >= 500: r.raise_for_status()
+        if r.status_code >= 400: raise LLMError(f"LLM request rejected: {r.status_code} {r.text[:200]}")
+        try: return r.json()["choices"][0]["message"]["content"]
+        except (ValueError, LookupError, TypeError) as e:
+            raise MalformedResponseError(f"Malformed LLM response: {r.text[:200]}") from e
+
+    async def generate(self, question: str, urls: List[str]) -> tuple[str, List[str]]:
+        trial = self.breaker.check()
+        payload = self.payload(question, urls)
+        try:
+            for attempt in range(self.retries + 1):
+                # A malformed 200 is retried like a server error
+                try: answer = await self._post(payload)
+                except (httpx.TransportError, httpx.HTTPStatusError, MalformedResponseError) as e:
+                    self.breaker.record_failure()
+                    if attempt == self.retries or self.breaker.is_open:
+                        raise LLMError(f"LLM request failed after {attempt + 1} attempts: {e!r}") from e
+                    # Exponential backoff with jitter
+                    await asyncio.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+                else:
+                    self.breaker.record_success()
+                    return answer, self.sources(answer, urls)
+        finally:
+            if trial: self.breaker.end_trial()
+
+    async def stream(self, question: str, urls: List[str]) -> AsyncIterator[str]:
+        "Yield answer text as the backend produces it; unlike `generate`, failures are not retried"
+        trial = self.breaker.check()
+        payload = dict(self.payload(question, urls), stream=True)
+        try:
+            async with self._semaphore, self.client.stream("POST", "/chat/completions", json=payload) as r:
+                if r.status_code >= 400:
+                    await r.aread()
+                    if r.status_code == 429 or r.status_code >= 500: r.raise_for_status()
+                    raise LLMError(f"LLM request rejected: {r.status_code} {r.text[:200]}")
+                # Server-sent events: `data: {json chunk}` lines, terminated by `data: [DONE]`
+                async for line in r.aiter_lines():
+                    if not line.startswith("data:"): continue
+                    data = line[5:].strip()
+                    if data == "[DONE]": break
+                    try: chunk = json.loads(data)["choices"][0]["delta"].get("content")
+                    except (ValueError, LookupError, TypeError, AttributeError) as e:
+                        raise MalformedResponseError(f"Malformed LLM stream chunk: {data[:200]}") from e
+                    if chunk: yield chunk
+        except (httpx.TransportError, httpx.HTTPStatusError, MalformedResponseError) as e:
+            self.breaker.record_failure()
+            raise LLMError(f"LLM stream failed: {e!r}") from e
+        finally:
+            if trial: self.breaker.end_trial()
+        self.breaker.record_success()
+
+    def sources(self, answer: str, urls: List[str]) -> List[str]:
+        return extract_sources(answer)
+
+    async def aclose(self):
+        if self._client is not None: await self._client.aclose()
+        self._client = None
+
+def client_from_env(debug: bool) -> LLMClient:
+    "The simulated backend in debug mode, otherwise the HTTP backend configured from the environment"
+    return SimulatedLLM() if debug else HTTPLLM.from_env()
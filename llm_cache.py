@@ -0,0 +1,164 @@
+"""Two-tier cache of LLM answers.
+
+Answers are keyed on a hash of the model, the prompt template, the question
+text and the sorted URL list, so every annotator of a question shares one LLM
+call. Lookups go through an in-memory LRU first and then the `llm_cache` SQLite
+table, whose rows expire after a TTL and are evicted least-recently-used once
+the table exceeds its row limit.
+
+The cache has one owner: a thread of its own runs every lookup and write, on
+the cache's connection and LRU alike, so the event loop never waits on SQLite
+and no two threads ever share either. Should another connection hold the write
+lock past the busy timeout, a hit's last use goes unrecorded and a new answer
+is kept in memory only.
+"""
+import asyncio, contextvars, hashlib, json, logging, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List
+
+import apsw
+
+from llm import PROMPT_TEMPLATE, LLMClient
+
+log = logging.getLogger("rag-eval.llm-cache")
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_question ON llm_cache(question);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used);
+"""
+
+def cache_key(model: str, question: str, urls: List[str]) -> str:
+    return hashlib.sha256(json.dumps([model, PROMPT_TEMPLATE, question, sorted(urls)]).encode()).hexdigest()
+
+class LLMCache:
+    "In-memory LRU in front of the persistent `llm_cache` table, both used only from the cache's own thread"
+    def __init__(self, db, memory_size: int = 256, ttl: float = 7 * 86400, max_rows: int = 10_000):
+        self.db, self.memory_size, self.ttl, self.max_rows = db, memory_size, ttl, max_rows
+        self.memory = OrderedDict()  # key -> (question, answer, sources, created_at)
+        self.stats = dict(memory_hits=0, disk_hits=0, misses=0, evictions=0, busy=0)
+        self._owner = ThreadPoolExecutor(1, thread_name_prefix="llm-cache")
+
+    async def _run(self, fn, *args):
+        # As in `DBPool`, the copied context lets the request's metrics count the cache's statements
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._owner, ctx.run, fn, *args)
+
+    async def get(self, key: str) -> tuple[str, List[str]] | None:
+        return await self._run(self._get, key)
+
+    async def put(self, key: str, question: str, answer: str, sources: List[str]):
+        await self._run(self._put, key, question, answer, sources)
+
+    async def invalidate(self, question: str) -> int:
+        "Forget every cached answer for `question`, returning the number of entries removed"
+        return await self._run(self._invalidate, question)
+
+    async def summary(self) -> dict:
+        "Hit/miss counters plus the current size of both tiers"
+        return await self._run(self._summary)
+
+    def close(self):
+        self._owner.shutdown(wait=True)
+        self.db.conn.close()
+
+    def _get(self, key):
+        now = time.time()
+        if key in self.memory:
+            question, answer, sources, created_at = self.memory[key]
+            if now - created_at < self.ttl:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return answer, sources
+            del self.memory[key]
+        row = self.db.execute("SELECT question, answer, sources, created_at FROM llm_cache WHERE key = ? AND created_at > ?",
+                              [key, now - self.ttl]).fetchone()
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+        # WAL lets the lookup itself run alongside any writer, but bumping `last_used` needs the write lock
+        try: self.db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", [now, key])
+        except apsw.BusyError:
+            log.warning("LLM cache busy; last use of a hit not recorded")
+            self.stats['busy'] += 1
+        question, answer, sources, created_at = row[0], row[1], json.loads(row[2]), row[3]
+        self._remember(key, (question, answer, sources, created_at))
+        self.stats['disk_hits'] += 1
+        return answer, sources
+
+    def _put(self, key, question, answer, sources):
+        now = time.time()
+        self._remember(key, (question, answer, sources, now))
+        try:
+            with self.db.conn: evicted = self._store(key, question, answer, sources, now)
+        except apsw.BusyError:
+            log.warning("LLM cache busy; answer kept in memory only")
+            self.stats['busy'] += 1
+            return
+        self.stats['evictions'] += evicted
+
+    def _store(self, key, question, answer, sources, now) -> int:
+        self.db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                        [key, question, answer, json.dumps(sources), now, now])
+        # Drop expired rows, then the least recently used ones beyond the size limit
+        self.db.execute("DELETE FROM llm_cache WHERE created_at <= ?", [now - self.ttl])
+        evicted = self.db.conn.changes()
+        self.db.execute("""DELETE FROM llm_cache WHERE key IN (
+            SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)""", [self.max_rows])
+        return evicted + self.db.conn.changes()
+
+    def _invalidate(self, question):
+        # A busy database raises to the caller, after the memory tier is cleared
+        for key in [k for k, v in self.memory.items() if v[0] == question]: del self.memory[key]
+        self.db.execute("DELETE FROM llm_cache WHERE question = ?", [question])
+        return self.db.conn.changes()
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size: self.memory.popitem(last=False)
+
+    def _summary(self):
+        lookups = self.stats['memory_hits'] + self.stats['disk_hits'] + self.stats['misses']
+        hits = lookups - self.stats['misses']
+        return dict(self.stats, lookups=lookups, hit_rate=hits / lookups if lookups else 0.0,
+                    memory_entries=len(self.memory),
+                    disk_entries=self.db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0])
+
+class CachedLLM:
+    "`LLMClient` that answers from an `LLMCache` when possible; pass `refresh=True` to skip the lookup"
+    def __init__(self, client: LLMClient, cache: LLMCache):
+        self.client, self.cache, self.model = client, cache, client.model
+
+    async def generate(self, question: str, urls: List[str], refresh: bool = False) -> tuple[str, List[str]]:
+        key = cache_key(self.model, question, urls)
+        if not refresh and (hit := await self.cache.get(key)) is not None: return hit
+        answer, sources = await self.client.generate(question, urls)
+        await self.cache.put(key, question, answer, sources)
+        return answer, sources
+
+    async def stream(self, question: str, urls: List[str], refresh: bool = False) -> AsyncIterator[str]:
+        key = cache_key(self.model, question, urls)
+        if not refresh and (hit := await self.cache.get(key)) is not None:
+            yield hit[0]
+            return
+        chunks = []
+        async for chunk in self.client.stream(question, urls):
+            chunks.append(chunk)
+            yield chunk
+        answer = "".join(chunks)
+        await self.cache.put(key, question, answer, self.client.sources(answer, urls))
+
+    def sources(self, answer: str, urls: List[str]) -> List[str]:
+        return self.client.sources(answer, urls)
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -1,232 +1,225 @@
 from fasthtml.common import (
     A, Button, Card, Container, Div, Form, Grid, Group, H2, H3, H4, Hidden,
-    Input, Li, P, Textarea, Title, Titled, Ul, Label, Style,
-    FastHTML, fast_app, serve,
-    RedirectResponse, database
+    Input, Li, P, Textarea, Titled, Ul, Label, Script,
+    Table, Thead, Tbody, Tr, Th, Td,
+    APIRouter, FastHTML, fast_app, EventStream, sse_message,
+    RedirectResponse, StreamingResponse, UploadFile, Link, Response, HttpHeader
 )
+from starlette.middleware import Middleware
+import asyncio, csv, hashlib, io, json, logging, os, time
 from typing import List
-from collections import OrderedDict
-
-# Initialize database
-db = database('data/rag.db')
-
-questions,urls,answers = db.t.questions,db.t.urls,db.t.answers
-
-# Get or create tables using the tables collection (t)
-if 'questions' not in db.t:
-    questions.create(dict(id=int, text=str), pk='id')
-    urls.create(dict(id=int, question_id=int, url=str, source=str), pk='id')
-    answers.create(dict(
-        id=int,
-        question_id=int,
-        user_answer=str,
-        llm_answer=str,
-        llm_sources=str,
-        final_answer=str,
-        url_ranking=str,
-        url_relevance=str
-    ), pk='id')
-else:
-    # Get existing tables
-    questions = db.t.questions
-    urls = db.t.urls
-    answers = db.t.answers
-
-# Get dataclasses from tables
-Question = questions.dataclass()
-Url = urls.dataclass()
-Answer = answers.dataclass()
-
-
-app, rt = fast_app(htmlkw={'data-theme': 'light'}, hdrs=[Style("""
-    /* Global styles */
-    :root {
-        --primary-color: #4361ee;
-        --secondary-color: #3f37c9;
-        --accent-color: #4895ef;
-        --success-color: #4cc9f0;
-        --background-color: #f8f9fa;
-        --text-color: #212529;
-        --border-radius: 8px;
-        --spacing-sm: 0.5rem;
-        --spacing-md: 1rem;
-        --spacing-lg: 2rem;
-    }
-
-    body {
-        background-color: var(--background-color);
-        color: var(--text-color);
-        line-height: 1.6;
-    }
-
-    /* Typography */
-    h1, h2, h3, h4 {
-        margin-bottom: var(--spacing-md);
-        color: var(--text-color);
-    }
-
-    h1 { font-size: 2.5rem; }
-    h2 { font-size: 2rem; }
-    h3 { font-size: 1.75rem; }
-    h4 { font-size: 1.5rem; }
-
-    /* Layout */
-    .container {
-        max-width: 1200px;
-        margin: 0 auto;
-        padding: var(--spacing-lg);
-    }
-
-    .grid {
-        gap: var(--spacing-md);
-    }
-
-    /* Cards */
-    .card {
-        background: white;
-        border-radius: var(--border-radius);
-        padding: var(--spacing-lg);
-        margin-bottom: var(--spacing-lg);
-        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    }
-
-    .stats-card {
-        background: linear-gradient(to right, #ffffff, #f8f9fa);
-    }
-
-    /* Forms */
-    input, textarea {
-        border: 1px solid #dee2e6;
-        border-radius: var(--border-radius);
-        padding: var(--spacing-sm);
-        width: 100%;
-        margin-bottom: var(--spacing-md);
-    }
-
-    textarea {
-        min-height: 150px;
-    }
-
-    /* Buttons */
-    .button-grid {
-        display: grid;
-        grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-        gap: var(--spacing-md);
-        margin: var(--spacing-lg) 0;
-    }
-
-    button, .button {
-        background-color: var(--primary-color);
-        color: white;
-        border: none;
-        border-radius: var(--border-radius);
-        padding: var(--spacing-sm) var(--spacing-md);
-        cursor: pointer;
-        transition: background-color 0.3s ease;
-    }
-
-    button:hover, .button:hover {
-        background-color: var(--secondary-color);
-    }
-
-    button.outline, .button.outline {
-        background-color: transparent;
-        border: 2px solid var(--primary-color);
-        color: var(--primary-color);
-    }
-
-    button.outline:hover, .button.outline:hover {
-        background-color: var(--primary-color);
-        color: white;
-    }
-
-    /* Lists */
-    .question-list {
-        list-style: none;
-        padding: 0;
-    }
-
-    .question-list li {
-        padding: var(--spacing-md);
-        margin-bottom: var(--spacing-sm);
-        background: white;
-        border-radius: var(--border-radius);
-        box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-        transition: transform 0.2s ease;
-    }
-
-    .question-list li:hover {
-        transform: translateX(5px);
-    }
-
-    .url-list {
-        list-style: none;
-        padding: 0;
-    }
-
-    .url-list li {
-        padding: var(--spacing-sm);
-        margin-bottom: var(--spacing-sm);
-        background: #f8f9fa;
-        border-radius: var(--border-radius);
-    }
-
-    /* Answer sections */
-    .answer-text {
-        background: #f8f9fa;
-        padding: var(--spacing-md);
-        border-radius: var(--border-radius);
-        margin-bottom: var(--spacing-md);
-    }
-
-    .answer-section {
-        margin: var(--spacing-lg) 0;
-    }
-
-    /* URL ranking section */
-    .url-ranking {
-        list-style: none;
-        padding: 0;
-    }
-
-    .url-ranking li {
-        padding: var(--spacing-md);
-        margin-bottom: var(--spacing-sm);
-        background: #f8f9fa;
-        border-radius: var(--border-radius);
-    }
-
-    /* Stats list */
-    .stats-list {
-        list-style: none;
-        padding: 0;
-    }
-
-    .stats-list li {
-        padding: var(--spacing-md);
-        margin-bottom: var(--spacing-sm);
-        background: #f8f9fa;
-        border-radius: var(--border-radius);
-        border-left: 4px solid var(--primary-color);
-    }
-""")])
-
-# Debug mode for LLM simulation
-DEBUG_MODE = True
-
-def simulate_llm_response(question: str, urls: List[str]) -> tuple:
-    """Debug function to simulate LLM response when API is not available"""
-    return (
-        "This is a simulated LLM answer that would normally come from the API. "
-        "It demonstrates how the system works without needing the actual LLM service.",
-        ["https://example.com/doc1", "https://example.com/doc2"]
+import apsw
+
+from agreement import dataset_agreement, question_agreement, rebuild_agreement
+from answer_scores import PAIRS, score_missing, score_summary
+from bulk_import import format_for, import_records, read_records
+from canonical_urls import url_hash
+from compression import CompressionMiddleware
+from conditional import not_modified, page_etag, validators
+from config import AppConfig
+from corpus import CorpusIndex, CorpusLLM
+from dbpool import DBPool
+from dedupe import closest_question, index_questions
+from export import export_chunks
+from fragment_cache import FragmentCache, question_stamp, touch_questions
+from llm import LLMError, client_from_env
+from llm_cache import CachedLLM, LLMCache
+from metrics import InstrumentedLLM, Metrics, MetricsMiddleware
+from migrations import migrate
+from pregenerate import pregenerate, staged_answer
+from retrieval_metrics import DEFAULT_KS, DatasetMetrics, export_lines, lowest_questions, question_metrics
+from search import search_questions
+from summaries import top_answers, top_sources
+from transactions import transaction, write_stats
+
+# Created by `create_app` from its `AppConfig`; `open_resources` fills in the database and LLM objects below
+config: AppConfig = None
+# Per-route latency, SQL and LLM time, served on /metrics; RAG_SLOW_REQUEST_MS logs slower requests with their queries
+metrics: Metrics = None
+# Dataset-wide retrieval metrics for /retrieval-metrics, recomputed after any question changes
+retrieval_metrics: DatasetMetrics = None
+# Dataset-wide annotator agreement for /agreement, recomputed the same way
+annotator_agreement: DatasetMetrics = None
+app: FastHTML = None
+
+# Opened on the first request or at startup, whichever comes first, so importing this module or calling
+# `create_app` touches neither the database nor the LLM backend
+pool = db = questions = urls = answers = llm_cache = base_llm = llm_client = fragments = scoring = None
+
+def setup_connection(conn_db):
+    "Give a pooled or background connection the same row classes and instrumentation as `db`"
+    for table in (conn_db.t.questions, conn_db.t.urls, conn_db.t.answers): table.dataclass()
+    metrics.watch_sqlite(conn_db.conn)
+
+def open_resources():
+    "Open the database and LLM client for `config`, once per app; only ever called from the event loop"
+    global pool, db, questions, urls, answers, llm_cache, base_llm, llm_client, fragments, scoring
+    if pool is not None: return
+    # Handlers read through `config.db_readers` read-only connections and write through a single writer thread,
+    # so SQLite never blocks the event loop; with no readers queries run inline on one connection
+    new_pool = DBPool(config.db_path, readers=config.db_readers, setup=setup_connection)
+    # Bring the schema up to date; `db` is the writer connection. Safe when several workers start at once
+    db = new_pool.writer
+    migrate(db)
+    metrics.watch_sqlite(db.conn)
+    questions, urls, answers = db.t.questions, db.t.urls, db.t.answers
+    for table in (questions, urls, answers): table.dataclass()
+    new_pool.open_readers()
+    # LLM answers are cached per (model, prompt, question, URLs); see llm_cache.py
+    llm_cache = LLMCache(new_pool.open(read_only=False), memory_size=config.llm_cache_memory,
+                         ttl=config.llm_cache_ttl, max_rows=config.llm_cache_max_rows)
+    base_llm = client_from_env(config.debug_mode)
+    # With an index built by `cli.py index-corpus`, the best-matching local documents are offered to the LLM
+    # as candidate sources; in debug mode the simulated LLM then cites them
+    if config.corpus_index: base_llm = CorpusLLM(base_llm, CorpusIndex(config.corpus_index), k=config.corpus_top_k)
+    llm_client = CachedLLM(InstrumentedLLM(base_llm, metrics), llm_cache)
+    # Rendered pages are cached until their question changes
+    fragments = FragmentCache(db, max_bytes=config.fragment_cache_bytes, enabled=config.fragment_cache)
+    # Question id -> the task scoring its new and edited answers; see `score_later`
+    scoring = {}
+    # Set last: it is what marks the resources as open
+    pool = new_pool
+
+def background_tasks() -> list:
+    "The app's pregeneration and loop lag tasks, if started, and its answer scoring tasks"
+    started = [getattr(app.state, name, None) for name in ("pregeneration", "loop_lag")]
+    return [task for task in started if task] + list(scoring.values())
+
+async def close_resources():
+    if pool is None: return
+    tasks = background_tasks()
+    for task in tasks: task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await llm_client.aclose()
+    close_connections()
+
+def close_connections():
+    "Close the database connections `open_resources` opened, once no task uses them"
+    global pool
+    llm_cache.close()
+    pool.close()
+    pool = None
+
+async def ensure_open():
+    # Requests served without a lifespan, e.g. through httpx's ASGITransport, open the resources here
+    if pool is None: open_resources()
+
+# Shingle similarity at which a new question redirects to, or is offered, the closest existing one
+DUPLICATE_REDIRECT, DUPLICATE_SUGGEST = 0.9, 0.5
+log = logging.getLogger("rag-eval")
+
+# The stylesheet is served under a hash of its content, so browsers can cache it indefinitely
+STYLESHEET = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "style.css"), "rb").read()
+STYLESHEET_DIGEST = hashlib.sha256(STYLESHEET).hexdigest()[:16]
+
+def start_pregeneration():
+    if config.pregenerate:
+        conn = pool.open(read_only=False)
+        task = app.state.pregeneration = asyncio.create_task(pregenerate(
+            conn, base_llm, workers=config.pregenerate_workers, rate=config.pregenerate_rate))
+        # `pregenerate` is done with the connection once the task finishes, even when cancelled
+        task.add_done_callback(lambda _: conn.conn.close())
+
+# Answers scored per writer turn, so scoring a question with many answers never holds up other writes for long
+SCORE_BATCH = 50
+
+def score_later(question_id: int):
+    "Score the question's new and edited answers in the background, once the write that changed them has committed"
+    # One task per question at a time; a write that commits while it runs is picked up by its next batch
+    if question_id not in scoring: scoring[question_id] = asyncio.create_task(score_question(question_id))
+
+async def score_question(question_id: int):
+    def score_batch():
+        with transaction(db, "score answers"):
+            count = score_missing(db, question_id, batch_size=SCORE_BATCH, limit=SCORE_BATCH)
+            # The question's pages show its scores, which the version triggers do not watch
+            if count: touch_questions(db, [question_id])
+        return count
+    try:
+        while await pool.write(score_batch): pass
+    except Exception:
+        log.exception("Scoring the answers of question %s failed", question_id)
+    finally:
+        scoring.pop(question_id, None)
+
+def start_metrics():
+    app.state.loop_lag = asyncio.create_task(metrics.sample_loop_lag())
+
+# Routes are collected here and added to each app `create_app` builds
+rt = APIRouter()
+
+def create_app(app_config: AppConfig | None = None) -> FastHTML:
+    "Build the app for `app_config`, or for the environment; the module serves one app at a time"
+    global config, metrics, retrieval_metrics, annotator_agreement, app
+    if pool is not None:
+        # The previous app was never shut down: stop its tasks if their event loop is still around,
+        # and close its connections before this app opens its own
+        for task in background_tasks():
+            if not task.get_loop().is_closed(): task.cancel()
+        close_connections()
+    config = app_config or AppConfig.from_env()
+    metrics = Metrics(slow_request_ms=config.slow_request_ms)
+    retrieval_metrics = DatasetMetrics()
+    annotator_agreement = DatasetMetrics(dataset_agreement)
+    app, _ = fast_app(htmlkw={'data-theme': 'light'}, before=[ensure_open],
+                      on_startup=[open_resources, start_pregeneration, start_metrics], on_shutdown=[close_resources],
+                      middleware=[Middleware(MetricsMiddleware, metrics=metrics), Middleware(CompressionMiddleware)], hdrs=[
+        Script(src="https://unpkg.com/htmx-ext-sse@2.2.2/sse.js"),
+        # Served once and cached by the browser; see /stylesheet/{digest}
+        Link(rel="stylesheet", href=f"/stylesheet/{STYLESHEET_DIGEST}")
+    ])
+    rt.to_app(app)
+    return app
+
+# No .css extension here: fast_app's static file route claims every *.css path
+@rt("/stylesheet/{digest}")
+def get(request, digest: str):
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'W/"{STYLESHEET_DIGEST}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]: return Response(status_code=304, headers=headers)
+    # Older digests still get the current stylesheet, but only briefly cached
+    if digest != STYLESHEET_DIGEST: headers["Cache-Control"] = "public, max-age=300"
+    return Response(STYLESHEET, media_type="text/css", headers=headers)
+
+# Number of questions per page of search results on / and /top-answers
+SEARCH_PAGE_SIZE = 20
+
+def question_link(q, target: str):
+    "Link to a question on the home page (`questions`) or its /top-answers summary (`top-answers`)"
+    if target == "top-answers": return A(q['text'], href=f"/top-answers/{q['id']}")
+    return A(q['text'], hx_get=f"/questions/{q['id']}", hx_target="#question-section")
+
+def load_more_item(**hx):
+    "A 'load more' list item for the end of a page; `hx` requests the next page, which replaces the item when clicked"
+    return Li(Button("Load more", cls="outline", hx_target="closest li", hx_swap="outerHTML", **hx))
+
+def search_items(rdb, q: str = "", target: str = "questions", offset: int = 0):
+    "One page of search results as list items, ending with a 'load more' item if more remain"
+    rows = search_questions(rdb, q, SEARCH_PAGE_SIZE + 1, offset)
+    page, has_more = rows[:SEARCH_PAGE_SIZE], len(rows) > SEARCH_PAGE_SIZE
+    items = [Li(question_link(r, target)) for r in page]
+    if has_more:
+        items.append(load_more_item(hx_get="/search", hx_vals={"q": q, "target": target, "offset": offset + SEARCH_PAGE_SIZE}))
+    return items
+
+def question_search(rdb, target: str):
+    "Search box and the results list it updates, starting with the most recent questions"
+    items = search_items(rdb, target=target)
+    return Div(
+        Input(type="search", name="q", placeholder="Search questions and answers",
+              hx_get="/search", hx_vals={"target": target},
+              hx_trigger="input changed delay:300ms, search",
+              hx_target="#question-results"),
+        Ul(*(items or [Li("No questions yet")]), id="question-results", cls="question-list")
     )
 
-@rt("/")
-def get():
-    # Get existing questions
-    existing_questions = questions()
-    
+@rt("/search")
+async def get(q: str = "", target: str = "questions", offset: int = 0):
+    items = await pool.read(search_items, q, target, offset)
+    # The first page replaces the list's contents; later pages replace the "load more" item
+    return tuple(items) if items or offset else Li("No matching questions")
+
+def home_page(rdb):
+    "Everything on / below the title; cached until the question list changes"
     # Create form for new question submission
     new_question_form = Form(
         Group(
@@ -237,50 +230,124 @@ def get():
         hx_target="#question-section"
     )
     
-    # Create list of existing questions
-    question_list = Ul(
-        *[Li(
-            A(q.text, hx_get=f"/questions/{q.id}", hx_target="#question-section")
-        ) for q in existing_questions],
-        cls="question-list"
-    ) if existing_questions else P("No questions yet")
+    # Bulk import form for seeding evaluation sets
+    import_form = Form(
+        Group(
+            Input(type="file", name="file", accept=".jsonl,.json,.csv"),
+            Button("Import Questions", type="submit", cls="outline")
+        ),
+        hx_post="/import",
+        hx_encoding="multipart/form-data",
+        hx_target="#import-result"
+    )
 
     # Add links to best answers and top answers pages
     best_answers_link = A("View Questions with Multiple Answers", href="/best-answers", cls="button outline")
     top_answers_link = A("View Top Answers & Sources", href="/top-answers", cls="button outline")
+    export_link = A("Export Dataset (JSONL)", href="/export?format=jsonl", cls="button outline")
+    metrics_link = A("Retrieval Metrics", href="/retrieval-metrics", cls="button outline")
+    scores_link = A("Answer Similarity", href="/answer-scores", cls="button outline")
+    agreement_link = A("Annotator Agreement", href="/agreement", cls="button outline")
 
-    return Titled("RAG Evaluation Tool",
-        Container(
-            H2("Submit a New Question"),
-            new_question_form,
-            H2("Or Choose an Existing Question"),
-            Div(best_answers_link, top_answers_link, cls="button-grid"),
-            question_list,
-            Div(id="question-section")
-        )
+    return Container(
+        H2("Submit a New Question"),
+        new_question_form,
+        H3("Or Import Questions from JSONL/CSV"),
+        import_form,
+        Div(id="import-result"),
+        H2("Or Choose an Existing Question"),
+        Div(best_answers_link, top_answers_link, export_link, metrics_link, scores_link, agreement_link, cls="button-grid"),
+        question_search(rdb, "questions"),
+        Div(id="question-section")
     )
 
+@rt("/")
+async def get():
+    return Titled("RAG Evaluation Tool", await pool.read(lambda rdb: fragments.render("/", 0, lambda: home_page(rdb), rdb)))
+
 @rt("/questions")
 async def post(request):
     # Get question from form data
     form_data = await request.form()
     question_text = form_data.get("question", "")
-    
-    # Check if question already exists
-    existing = questions(where="text = ?", where_args=[question_text])
-    if existing:
-        # If exists, redirect to existing question
-        return redirect_to_question(existing[0].id)
-    
-    # Insert new question if it doesn't exist
-    q = questions.insert(dict(text=question_text))
-    return redirect_to_question(q.id)
+    force = bool(form_data.get("force"))
 
-@rt("/questions/{id}")
-def get(id: int):
-    q = questions[id]
+    # The duplicate checks share the insert's transaction, whose write lock keeps other requests and workers
+    # from adding the same question in between
+    def add_question():
+        with transaction(db, "POST /questions"):
+            # Check if question already exists
+            existing = questions(where="text = ?", where_args=[question_text])
+            if existing:
+                # If exists, redirect to existing question
+                return redirect_to_question(existing[0].id)
+
+            # Near-duplicates: redirect to trivial variants, suggest rewordings unless the user insists
+            if not force and (match := closest_question(db, question_text)):
+                match_id, match_text, similarity = match
+                if similarity >= DUPLICATE_REDIRECT: return redirect_to_question(match_id)
+                if similarity >= DUPLICATE_SUGGEST: return duplicate_suggestion(question_text, match_id, match_text)
+
+            # Insert new question if it doesn't exist
+            q = questions.insert(dict(text=question_text))
+            index_questions(db, [(q.id, q.text)])
+        return redirect_to_question(q.id)
+    return await pool.write(add_question)
+
+def duplicate_suggestion(question_text: str, match_id: int, match_text: str):
+    return Card(
+        H3("A similar question already exists"),
+        P(match_text, cls="answer-text"),
+        Div(
+            Button("Use this question", hx_get=f"/questions/{match_id}", hx_target="#question-section", cls="primary"),
+            Form(
+                Hidden(name="question", value=question_text),
+                Hidden(name="force", value="1"),
+                Button("Submit as a new question", type="submit", cls="outline"),
+                hx_post="/questions",
+                hx_target="#question-section"
+            ),
+            cls="button-grid"
+        ),
+        cls="card"
+    )
+
+@rt("/import")
+async def post(file: UploadFile):
+    # Read the upload as a text stream so large files are never held in memory; utf-8-sig drops the BOM
+    # spreadsheet exports start with, which would otherwise end up in the first CSV header
+    f = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        stats = await pool.write(import_records, db, read_records(f, format_for(file.filename or "")))
+    except (ValueError, KeyError, csv.Error) as e:
+        return Card(H3("Import Failed"), P(f"Chunks completed before the error were kept. {e}"), cls="card")
+    return Card(
+        H3("Import Complete"),
+        P(f"Imported {stats['rows']} rows in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s): "
+          f"{stats['questions_inserted']} new questions, {stats['urls_inserted']} new URLs."),
+        cls="card"
+    )
+
+def export_stream(format: str):
+    "Export chunks read through a connection of their own, closed when the download ends"
+    rdb = pool.open()
+    try: yield from export_chunks(rdb, format)
+    finally: rdb.conn.close()
+
+@rt("/export")
+def get(format: str = "jsonl"):
+    if format not in ("jsonl", "csv"): return P(f"Unsupported export format: {format}")
+    # Records are produced lazily from database cursors while the response is sent
+    return StreamingResponse(
+        export_stream(format),
+        media_type="application/x-ndjson" if format == "jsonl" else "text/csv",
+        headers={"Content-Disposition": f'attachment; filename="rag-eval.{format}"'}
+    )
+
+def question_card(rdb, id: int):
+    q = rdb.t.questions[id]
     # Fixed query syntax for FastLite
-    existing_urls = urls(where="question_id = ?", where_args=[id])
+    existing_urls = rdb.t.urls(where="question_id = ?", where_args=[id])
     
     # URL submission form
     url_form = Form(
@@ -304,6 +371,7 @@ def get(id: int):
         Group(
             H3("Write Your Perfect Answer"),
             Textarea(id="user_answer", name="user_answer", rows=10, placeholder="Write your answer here, referencing the URLs where appropriate"),
+            Label(Input(type="checkbox", name="refresh_llm"), "Generate a fresh LLM answer instead of a cached one"),
             Button("Submit Answer", type="submit", cls="primary")
         ),
         hx_post=f"/questions/{id}/user-answer",
@@ -311,63 +379,84 @@ def get(id: int):
         cls="answer-section"
     )
     
+    # Drop cached LLM answers so the next submission asks the model again
+    clear_cache = Button("Clear Cached LLM Answers", cls="outline",
+                         hx_post=f"/questions/{id}/llm-cache/invalidate", hx_swap="outerHTML")
+    
     return Card(
         H2(f"Question: {q.text}"),
         url_form,
         url_list,
         answer_form,
+        clear_cache,
         Div(id="answer-section"),
         cls="card"
     )
 
+async def conditional_page(request, route: str, id: int, page):
+    "`page(rdb)` with validators for question `id`, or a 304 without rendering it if the client's copy is current"
+    def respond(rdb):
+        # Read before the page, so a write in between can only make the tag older than the page, never newer
+        version, modified = question_stamp(rdb, id)
+        etag = page_etag(route, id, version, htmx="hx-request" in request.headers)
+        headers = validators(etag, modified)
+        if not_modified(request.headers, etag, modified): return Response(status_code=304, headers=headers)
+        return page(rdb), *(HttpHeader(k, v) for k, v in headers.items())
+    return await pool.read(respond)
+
+@rt("/questions/{id}")
+async def get(request, id: int):
+    return await conditional_page(request, "questions", id, lambda rdb: question_card(rdb, id))
+
 @rt("/questions/{id}/urls")
 async def post(request, id: int):
     # Get URL from form data
     form_data = await request.form()
     url = form_data.get("url", "")
-    # Insert new URL
-    urls.insert(dict(question_id=id, url=url, source="user"))
-    # Return updated URL list
-    url_list = urls(where="question_id = ?", where_args=[id])
+    def add_url():
+        # Insert new URL; a variant of one the question already has marks that one as user-submitted instead
+        with transaction(db, "POST /questions/{id}/urls"):
+            db.execute("""
+                INSERT INTO urls (question_id, url, source, canonical_hash) VALUES (?, ?, 'user', ?)
+                ON CONFLICT (question_id, canonical_hash) DO UPDATE SET source = 'user'
+            """, [id, url, url_hash(url)])
+        # Return updated URL list
+        return urls(where="question_id = ?", where_args=[id])
+    url_list = await pool.write(add_url)
     return Ul(*[Li(u.url) for u in url_list], cls="url-list")
 
-@rt("/questions/{id}/user-answer")
-async def post(request, id: int):
-    # Get user answer from form data
-    form_data = await request.form()
-    user_answer = form_data.get("user_answer", "")
-    
-    # Get URLs for this question
-    url_list = urls(where="question_id = ?", where_args=[id])
-    url_texts = [u.url for u in url_list]
-    
-    # Get LLM answer (or simulate in debug mode)
-    if DEBUG_MODE:
-        llm_answer, llm_sources = simulate_llm_response(questions[id].text, url_texts)
-    else:
-        # TODO: Implement actual LLM API call
-        llm_answer, llm_sources = simulate_llm_response(questions[id].text, url_texts)
-    
-    # Store LLM sources as URLs
-    for source in llm_sources:
-        if not urls(where="url = ? AND question_id = ?", where_args=[source, id]):
-            urls.insert(dict(question_id=id, url=source, source="llm"))
-    
-    # Store answers
-    answer = answers.insert(dict(
-        question_id=id,
-        user_answer=user_answer,
-        llm_answer=llm_answer,
-        llm_sources=",".join(llm_sources),
-        final_answer="",
-        url_ranking="",
-        url_relevance=""
-    ))
-    
-    # Get combined unique sources
-    all_urls = urls(where="question_id = ?", where_args=[id])
-    
-    # Show comparison view
+def url_rating_list(all_urls, **kwargs):
+    "Rank and relevance inputs for every URL of a question"
+    return Ul(*[Li(
+        Grid(
+            # Rank input for sorting
+            Input(type="number", 
+                  name=f"rank_{u.id}", 
+                  value="0", 
+                  min="0", 
+                  max=str(len(all_urls)),
+                  style="width: 60px;"),
+            # URL display
+            P(u.url),
+            # Relevance toggle switch
+            Group(
+                Input(
+                    type="checkbox",
+                    role="switch",
+                    name=f"relevant_{u.id}",
+                    id=f"relevant_{u.id}"
+                ),
+                Label("Relevant", for_=f"relevant_{u.id}")
+            ),
+            # Source indicator
+            P(f"Source: {u.source}", 
+              style="color: var(--pico-muted-color);")
+        )
+    ) for u in all_urls], 
+    cls="url-ranking", **kwargs)
+
+def comparison_card(id: int, answer_id: int, user_answer: str, llm_card, all_urls, rating_list_kw=None, **kwargs):
+    "The side-by-side answer comparison with the final answer form"
     return Card(
         H3("Compare Answers"),
         Grid(
@@ -376,43 +465,12 @@ async def post(request, id: int):
                 P(user_answer, cls="answer-text"),
                 header="User Generated"
             ),
-            Card(
-                H4("LLM Answer"),
-                P(llm_answer, cls="answer-text"),
-                P("Sources:", ", ".join(llm_sources)),
-                header="AI Generated"
-            )
+            llm_card
         ),
         Form(
             H3("Submit Final Perfect Answer"),
             P("Review and rate all sources:"),
-            Ul(*[Li(
-                Grid(
-                    # Rank input for sorting
-                    Input(type="number", 
-                          name=f"rank_{u.id}", 
-                          value="0", 
-                          min="0", 
-                          max=str(len(all_urls)),
-                          style="width: 60px;"),
-                    # URL display
-                    P(u.url),
-                    # Relevance toggle switch
-                    Group(
-                        Input(
-                            type="checkbox",
-                            role="switch",
-                            name=f"relevant_{u.id}",
-                            id=f"relevant_{u.id}"
-                        ),
-                        Label("Relevant", for_=f"relevant_{u.id}")
-                    ),
-                    # Source indicator
-                    P(f"Source: {u.source}", 
-                      style="color: var(--pico-muted-color);")
-                )
-            ) for u in all_urls], 
-            cls="url-ranking"),
+            url_rating_list(all_urls, **(rating_list_kw or {})),
             H3("Write Final Answer"),
             Textarea(
                 id="final_answer",
@@ -421,32 +479,275 @@ async def post(request, id: int):
                 placeholder="Write the perfect answer combining the best of both responses"
             ),
             Button("Submit Final Answer", type="submit", cls="primary"),
-            hx_post=f"/questions/{id}/final-answer/{answer.id}",
+            hx_post=f"/questions/{id}/final-answer/{answer_id}",
             hx_target="#final-section"
         ),
         Div(id="final-section"),
-        cls="card"
+        cls="card",
+        **kwargs
+    )
+
+def candidate_urls(rdb, id: int) -> List[str]:
+    "URLs annotators submitted for a question, offered to the LLM as candidate sources"
+    # The LLM's own earlier sources are left out so the prompt, and its cache key, stay stable
+    return [u.url for u in rdb.t.urls(where="question_id = ? AND source = 'user'", where_args=[id])]
+
+def answer_context(rdb, id: int):
+    "The question's text, all its URLs and the candidate sources offered to the LLM"
+    return rdb.t.questions[id].text, rdb.t.urls(where="question_id = ?", where_args=[id]), candidate_urls(rdb, id)
+
+def store_llm_sources(id: int, llm_sources):
+    "Add LLM sources to the question's URLs unless already present"
+    # The unique (question_id, canonical_hash) index skips sources the question already has
+    db.conn.cursor().executemany(
+        "INSERT OR IGNORE INTO urls (question_id, url, source, canonical_hash) VALUES (?, ?, 'llm', ?)",
+        [(id, source, url_hash(source)) for source in llm_sources])
+
+@rt("/questions/{id}/user-answer")
+async def post(request, id: int):
+    # Get user answer from form data
+    form_data = await request.form()
+    user_answer = form_data.get("user_answer", "")
+    
+    refresh = bool(form_data.get("refresh_llm"))
+    
+    # Get URLs for this question
+    question_text, url_list, url_texts = await pool.read(answer_context, id)
+    
+    if config.stream_llm:
+        # Store the user's answer right away; the LLM half is filled in when its stream finishes
+        def insert_answer():
+            with transaction(db, "POST /questions/{id}/user-answer"):
+                return answers.insert(dict(
+                    question_id=id,
+                    user_answer=user_answer,
+                    llm_answer="",
+                    llm_sources="",
+                    final_answer="",
+                    url_ranking="",
+                    url_relevance=""
+                ))
+        answer = await pool.write(insert_answer)
+        # The LLM answer, its sources and the updated rating list arrive over SSE
+        llm_card = Card(
+            H4("LLM Answer"),
+            P(cls="answer-text", sse_swap="token", hx_swap="beforeend"),
+            Div(sse_swap="sources"),
+            header="AI Generated"
+        )
+        return comparison_card(id, answer.id, user_answer, llm_card, url_list,
+                               rating_list_kw=dict(sse_swap="ratings", hx_swap="outerHTML"),
+                               hx_ext="sse", sse_connect=f"/questions/{id}/llm-stream/{answer.id}" + ("?refresh=1" if refresh else ""),
+                               sse_close="done")
+    
+    # Use the pre-generated LLM answer if there is one, otherwise ask the LLM (simulated in debug mode)
+    staged = None if refresh else await pool.read(staged_answer, id, base_llm.model, question_text, url_texts)
+    if staged:
+        llm_answer, llm_sources = staged
+    else:
+        try:
+            llm_answer, llm_sources = await llm_client.generate(question_text, url_texts, refresh=refresh)
+        except LLMError as e:
+            return Card(H3("LLM Unavailable"), P(str(e)), cls="card")
+    
+    def save_answer():
+        with transaction(db, "POST /questions/{id}/user-answer"):
+            # Store LLM sources as URLs
+            store_llm_sources(id, llm_sources)
+            
+            # Store answers
+            answer = answers.insert(dict(
+                question_id=id,
+                user_answer=user_answer,
+                llm_answer=llm_answer,
+                llm_sources=",".join(llm_sources),
+                final_answer="",
+                url_ranking="",
+                url_relevance=""
+            ))
+        # Get combined unique sources
+        return answer, urls(where="question_id = ?", where_args=[id])
+    answer, all_urls = await pool.write(save_answer)
+    score_later(id)
+    
+    # Show comparison view
+    llm_card = Card(
+        H4("LLM Answer"),
+        P(llm_answer, cls="answer-text"),
+        P("Sources:", ", ".join(llm_sources)),
+        header="AI Generated"
+    )
+    return comparison_card(id, answer.id, user_answer, llm_card, all_urls)
+
+async def aiter_of(*items):
+    for item in items: yield item
+
+async def llm_answer_events(id: int, record, refresh: bool = False):
+    "SSE events for question `id`'s streamed LLM answer `record`: `token`s, then `sources`, `ratings` and `done`"
+    aid = record.id
+    question_text, _, url_texts = await pool.read(answer_context, id)
+    if record.llm_answer and not refresh:
+        # Already completed, e.g. the browser reconnected after the stream ended
+        llm_answer, llm_sources, ttfb = record.llm_answer, [s for s in record.llm_sources.split(",") if s], None
+        yield sse_message(llm_answer, event="token")
+    else:
+        start, ttfb, chunks = time.perf_counter(), None, []
+        # A pre-generated answer is sent as a single chunk
+        staged = None if refresh else await pool.read(staged_answer, id, base_llm.model, question_text, url_texts)
+        try:
+            async for chunk in (aiter_of(staged[0]) if staged else
+                                llm_client.stream(question_text, url_texts, refresh=refresh)):
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                    log.info("LLM stream for answer %s: first token after %.0f ms", aid, ttfb * 1000)
+                chunks.append(chunk)
+                yield sse_message(chunk, event="token")
+        except LLMError as e:
+            yield sse_message(P(f"LLM unavailable: {e}"), event="sources")
+            yield sse_message("", event="done")
+            return
+        # Complete the answer row now that the whole answer is known
+        llm_answer = "".join(chunks)
+        llm_sources = staged[1] if staged else llm_client.sources(llm_answer, url_texts)
+        def complete_answer():
+            with transaction(db, "GET /questions/{id}/llm-stream/{aid}"):
+                # Without `refresh`, a second connection that streamed the same answer at the same time writes nothing
+                db.execute("UPDATE answers SET llm_answer = ?, llm_sources = ? WHERE id = ? AND question_id = ?"
+                           + ("" if refresh else " AND llm_answer = ''"), [llm_answer, ",".join(llm_sources), aid, id])
+                if db.conn.changes(): store_llm_sources(id, llm_sources)
+        await pool.write(complete_answer)
+        score_later(id)
+        log.info("LLM stream for answer %s: completed in %.0f ms", aid, (time.perf_counter() - start) * 1000)
+    
+    yield sse_message(Div(
+        P("Sources:", ", ".join(llm_sources)),
+        *([P(f"First token after {ttfb * 1000:.0f} ms", style="color: var(--pico-muted-color);")] if ttfb is not None else [])
+    ), event="sources")
+    all_urls = await pool.read(lambda rdb: rdb.t.urls(where="question_id = ?", where_args=[id]))
+    yield sse_message(url_rating_list(all_urls), event="ratings")
+    yield sse_message("", event="done")
+
+@rt("/questions/{id}/llm-stream/{aid}")
+async def get(id: int, aid: int, refresh: bool = False):
+    # The answer must belong to the question: the stream writes the question's LLM answer into it
+    records = await pool.read(lambda rdb: rdb.t.answers(where="question_id = ? AND id = ?", where_args=[id, aid]))
+    if not records: return Response("No such answer to this question", status_code=404)
+    return EventStream(llm_answer_events(id, records[0], refresh))
+
+@rt("/questions/{id}/llm-cache/invalidate")
+async def post(id: int):
+    question_text = await pool.read(lambda rdb: rdb.t.questions[id].text)
+    # On the cache's own thread and connection, like its lookups
+    try: removed = await llm_cache.invalidate(question_text)
+    except apsw.BusyError: return P("The database is busy; try again in a moment.")
+    return P(f"Cleared {removed} cached LLM answer{'s' if removed != 1 else ''}.")
+
+@rt("/metrics")
+def get():
+    return Response(metrics.exposition(), media_type="text/plain; version=0.0.4")
+
+@rt("/write-stats")
+def get():
+    rows = write_stats.summary()
+    return Titled("Write Latency",
+        Container(
+            Card(
+                Ul(*[Li(
+                    f"{r['name']}: {r['count']} writes, mean {r['mean_ms']:.2f} ms, "
+                    f"p50 {r['p50_ms']:.2f} ms, p95 {r['p95_ms']:.2f} ms, max {r['max_ms']:.2f} ms"
+                ) for r in rows], cls="stats-list") if rows else P("No writes yet"),
+                header="Per-route write transactions",
+                cls="stats-card"
+            ),
+            A("Back to Home", href="/", cls="button outline")
+        )
+    )
+
+@rt("/fragment-cache")
+def get():
+    stats = fragments.summary()
+    return Titled("Page Fragment Cache",
+        Container(
+            Card(
+                Ul(
+                    Li(f"Enabled: {'yes' if stats['enabled'] else 'no'}"),
+                    Li(f"Hit rate: {stats['hit_rate']:.1%} of {stats['lookups']} lookups"),
+                    Li(f"Hits: {stats['hits']}"),
+                    Li(f"Misses: {stats['misses']}"),
+                    Li(f"Evictions: {stats['evictions']}"),
+                    Li(f"Entries: {stats['entries']} ({stats['bytes'] / 1024:.1f} KiB)"),
+                    cls="stats-list"
+                ),
+                header="Cache Statistics",
+                cls="stats-card"
+            ),
+            A("Back to Home", href="/", cls="button outline")
+        )
+    )
+
+@rt("/llm-cache")
+async def get():
+    stats = await llm_cache.summary()
+    return Titled("LLM Response Cache",
+        Container(
+            Card(
+                Ul(
+                    Li(f"Hit rate: {stats['hit_rate']:.1%} of {stats['lookups']} lookups"),
+                    Li(f"Memory hits: {stats['memory_hits']}"),
+                    Li(f"Disk hits: {stats['disk_hits']}"),
+                    Li(f"Misses: {stats['misses']}"),
+                    Li(f"Evictions: {stats['evictions']}"),
+                    Li(f"Entries: {stats['memory_entries']} in memory, {stats['disk_entries']} on disk"),
+                    cls="stats-list"
+                ),
+                header="Cache Statistics",
+                cls="stats-card"
+            ),
+            A("Back to Home", href="/", cls="button outline")
+        )
     )
 
+def form_ratings(form_data, url_list) -> list[tuple[int, int, int]]:
+    "Read the `rank_<id>`/`relevant_<id>` inputs into `(url_id, rank, relevant)` tuples"
+    ratings = []
+    for u in url_list:
+        try: rank = int(form_data.get(f"rank_{u.id}", "0") or 0)
+        except ValueError: rank = 0
+        relevant = 1 if form_data.get(f"relevant_{u.id}") else 0
+        ratings.append((u.id, rank, relevant))
+    return ratings
+
+def save_url_ratings(ratings, where: str, where_args, fanout: bool = False):
+    """Store `ratings` for every answer `a` matching `where`, replacing earlier ratings of the same URLs.
+
+    `fanout` marks them as copies of one submission rather than each answer's own, which agreement leaves out."""
+    # One statement for the whole answers x ratings fan-out; the ratings travel as a JSON array
+    db.execute(f"""
+        INSERT INTO url_ratings (answer_id, url_id, rank, relevant, fanout)
+        SELECT a.id, json_extract(r.value, '$[0]'), json_extract(r.value, '$[1]'), json_extract(r.value, '$[2]'), ?
+        FROM answers a, json_each(?) r
+        WHERE {where}
+        ON CONFLICT (answer_id, url_id) DO UPDATE SET rank = excluded.rank, relevant = excluded.relevant, fanout = excluded.fanout
+    """, [int(fanout), json.dumps(ratings), *where_args])
+
 @rt("/questions/{qid}/final-answer/{aid}")
 async def post(request, qid: int, aid: int):
     # Get form data
     form_data = await request.form()
     final_answer = form_data.get("final_answer", "")
     
-    # Extract URL rankings and relevance from form
-    url_list = urls(where="question_id = ?", where_args=[qid])
-    url_data = []
-    for u in url_list:
-        rank = form_data.get(f"rank_{u.id}", "0")
-        relevant = "1" if form_data.get(f"relevant_{u.id}") else "0"
-        url_data.append(f"{u.url}:{rank}:{relevant}")
-    
-    # Update answer with final version and URL data
-    answers.update(dict(
-        final_answer=final_answer,
-        url_ranking=",".join(url_data)
-    ), aid)
+    def save_final_answer():
+        # Extract URL rankings and relevance from form
+        ratings = form_ratings(form_data, urls(where="question_id = ?", where_args=[qid]))
+        
+        # Update answer with final version and store its URL ratings;
+        # the summary tables are updated by triggers in the same transaction
+        with transaction(db, "POST /questions/{qid}/final-answer/{aid}"):
+            answers.update(dict(final_answer=final_answer), aid)
+            save_url_ratings(ratings, "a.id = ?", [aid])
+    await pool.write(save_final_answer)
+    # Rescores the answer, whose final answer changed
+    score_later(qid)
     
     return Card(
         H3("Evaluation Complete"),
@@ -455,25 +756,40 @@ async def post(request, qid: int, aid: int):
         cls="card"
     )
 
+# Number of questions per page on /best-answers
+BEST_ANSWERS_PAGE_SIZE = 50
+
+def questions_with_answers(rdb, after: int = 0, limit: int = BEST_ANSWERS_PAGE_SIZE):
+    "Questions with at least one answer record and id > `after`, with their total answer count"
+    # Each answer record holds both a user and an LLM answer, hence the factor of 2
+    return rdb.q("""
+        SELECT q.id, q.text, COUNT(*) * 2 AS total_answers
+        FROM questions q JOIN answers a ON a.question_id = q.id
+        WHERE q.id > ?
+        GROUP BY q.id
+        ORDER BY q.id
+        LIMIT ?
+    """, [after, limit])
+
+def best_answer_items(rdb, after: int = 0):
+    "One page of /best-answers list items, ending with a 'load more' item if more remain"
+    rows = questions_with_answers(rdb, after, BEST_ANSWERS_PAGE_SIZE + 1)
+    page, has_more = rows[:BEST_ANSWERS_PAGE_SIZE], len(rows) > BEST_ANSWERS_PAGE_SIZE
+    items = [Li(
+        A(f"{r['text']} ({r['total_answers']} answers)",
+          href=f"/best-answers/{r['id']}")
+    ) for r in page]
+    if has_more: items.append(load_more_item(hx_get=f"/best-answers?after={page[-1]['id']}"))
+    return items
+
 @rt("/best-answers")
-def get():
-    # Get questions with multiple answers
-    questions_with_answers = []
-    for q in questions():
-        # Count total number of answers (both user and LLM)
-        answer_records = answers(where="question_id = ?", where_args=[q.id])
-        total_answers = sum(2 for a in answer_records)  # Each record has both user and LLM answer
-        if total_answers >= 2:
-            questions_with_answers.append((q, total_answers))
-    
+async def get(after: int = 0):
+    items = await pool.read(best_answer_items, after)
+    # htmx "load more" requests only need the next page of items
+    if after: return tuple(items)
+
     # Create list of questions with multiple answers
-    question_list = Ul(
-        *[Li(
-            A(f"{q.text} ({count} answers)", 
-              href=f"/best-answers/{q.id}")
-        ) for q, count in questions_with_answers],
-        cls="question-list"
-    ) if questions_with_answers else P("No questions with multiple answers yet")
+    question_list = Ul(*items, cls="question-list") if items else P("No questions with multiple answers yet")
 
     return Titled("Questions with Multiple Answers",
         Container(
@@ -484,10 +800,8 @@ def get():
         )
     )
 
-@rt("/best-answers/{id}")
-def get(id: int):
-    q = questions[id]
-    answer_records = answers(where="question_id = ?", where_args=[id])
+def best_answers_detail(rdb, id: int, q):
+    answer_records = rdb.t.answers(where="question_id = ?", where_args=[id])
     
     # Create a list of all answers (both user and LLM)
     all_answers = []
@@ -510,7 +824,7 @@ def get(id: int):
         })
     
     # Get all URLs for this question
-    all_urls = urls(where="question_id = ?", where_args=[id])
+    all_urls = rdb.t.urls(where="question_id = ?", where_args=[id])
     
     # Create pairs of answers for comparison
     answer_pairs = []
@@ -518,98 +832,78 @@ def get(id: int):
         if i + 1 < len(all_answers):
             answer_pairs.append((all_answers[i], all_answers[i + 1]))
     
-    return Titled(f"Select Best Answer for: {q.text}",
-        Container(
-            H2(q.text),
-            *[Card(
-                H3("Compare Answers"),
-                Grid(
-                    Card(
-                        H4(pair[0]['type']),
-                        P(pair[0]['text'], cls="answer-text"),
-                        *([] if not pair[0]['sources'] else [P("Sources:", pair[0]['sources'])]),
-                        Form(
-                            Hidden(name="answer_id", value=pair[0]['record_id']),
-                            Hidden(name="answer_type", value="user" if pair[0]['type'] == 'User Answer' else "llm"),
-                            Hidden(name="question_id", value=id),
-                            Button("Select as Best Answer", type="submit", cls="outline"),
-                            hx_post=f"/best-answers/{id}/select"
-                        ),
-                        cls="card"
+    return Container(
+        H2(q.text),
+        *[Card(
+            H3("Compare Answers"),
+            Grid(
+                Card(
+                    H4(pair[0]['type']),
+                    P(pair[0]['text'], cls="answer-text"),
+                    *([] if not pair[0]['sources'] else [P("Sources:", pair[0]['sources'])]),
+                    Form(
+                        Hidden(name="answer_id", value=pair[0]['record_id']),
+                        Hidden(name="answer_type", value="user" if pair[0]['type'] == 'User Answer' else "llm"),
+                        Hidden(name="question_id", value=id),
+                        Button("Select as Best Answer", type="submit", cls="outline"),
+                        hx_post=f"/best-answers/{id}/select"
                     ),
-                    Card(
-                        H4(pair[1]['type']),
-                        P(pair[1]['text'], cls="answer-text"),
-                        *([] if not pair[1]['sources'] else [P("Sources:", pair[1]['sources'])]),
-                        Form(
-                            Hidden(name="answer_id", value=pair[1]['record_id']),
-                            Hidden(name="answer_type", value="user" if pair[1]['type'] == 'User Answer' else "llm"),
-                            Hidden(name="question_id", value=id),
-                            Button("Select as Best Answer", type="submit", cls="outline"),
-                            hx_post=f"/best-answers/{id}/select"
-                        ),
-                        cls="card"
-                    )
+                    cls="card"
                 ),
-                cls="card"
-            ) for pair in answer_pairs],
-            H3("Rate All Sources"),
-            Form(
-                P("Review and rate all sources:"),
-                Ul(*[Li(
-                    Grid(
-                        # Rank input for sorting
-                        Input(type="number", 
-                              name=f"rank_{u.id}", 
-                              value="0", 
-                              min="0", 
-                              max=str(len(all_urls)),
-                              style="width: 60px;"),
-                        # URL display
-                        P(u.url),
-                        # Relevance toggle switch
-                        Group(
-                            Input(
-                                type="checkbox",
-                                role="switch",
-                                name=f"relevant_{u.id}",
-                                id=f"relevant_{u.id}"
-                            ),
-                            Label("Relevant", for_=f"relevant_{u.id}")
-                        ),
-                        # Source indicator
-                        P(f"Source: {u.source}", 
-                          style="color: var(--pico-muted-color);")
-                    )
-                ) for u in all_urls], 
-                cls="url-ranking"),
-                Button("Save Source Ratings", type="submit", cls="primary"),
-                hx_post=f"/best-answers/{id}/rate-sources",
-                hx_target="#rating-result"
+                Card(
+                    H4(pair[1]['type']),
+                    P(pair[1]['text'], cls="answer-text"),
+                    *([] if not pair[1]['sources'] else [P("Sources:", pair[1]['sources'])]),
+                    Form(
+                        Hidden(name="answer_id", value=pair[1]['record_id']),
+                        Hidden(name="answer_type", value="user" if pair[1]['type'] == 'User Answer' else "llm"),
+                        Hidden(name="question_id", value=id),
+                        Button("Select as Best Answer", type="submit", cls="outline"),
+                        hx_post=f"/best-answers/{id}/select"
+                    ),
+                    cls="card"
+                )
             ),
-            Div(id="rating-result"),
-            A("Back to Questions", href="/best-answers", cls="button outline")
-        )
+            cls="card"
+        ) for pair in answer_pairs],
+        H3("Rate All Sources"),
+        Form(
+            P("Review and rate all sources:"),
+            url_rating_list(all_urls),
+            Button("Save Source Ratings", type="submit", cls="primary"),
+            hx_post=f"/best-answers/{id}/rate-sources",
+            hx_target="#rating-result"
+        ),
+        Div(id="rating-result"),
+        A("Back to Questions", href="/best-answers", cls="button outline")
     )
 
+@rt("/best-answers/{id}")
+async def get(request, id: int):
+    def page(rdb):
+        q = rdb.t.questions[id]
+        return Titled(f"Select Best Answer for: {q.text}",
+                      fragments.render("/best-answers/{id}", id, lambda: best_answers_detail(rdb, id, q), rdb))
+    return await conditional_page(request, "best-answers", id, page)
+
 @rt("/best-answers/{id}/select")
 async def post(request, id: int):
     form_data = await request.form()
     answer_id = int(form_data.get("answer_id"))
     answer_type = form_data.get("answer_type")
     
-    # Get the selected answer record
-    selected_record = answers[answer_id]
-    
-    # Get the selected answer text based on type
-    selected_answer = selected_record.user_answer if answer_type == "user" else selected_record.llm_answer
-    
-    # Update all answers for this question to mark this as best
-    other_answers = answers(where="question_id = ?", where_args=[id])
-    for a in other_answers:
-        answers.update(dict(
-            final_answer=selected_answer
-        ), a.id)
+    def select_answer():
+        # Get the selected answer record
+        selected_record = answers[answer_id]
+        
+        # Get the selected answer text based on type
+        selected_answer = selected_record.user_answer if answer_type == "user" else selected_record.llm_answer
+        
+        # Update all answers for this question to mark this as best
+        with transaction(db, "POST /best-answers/{id}/select"):
+            db.execute("UPDATE answers SET final_answer = ? WHERE question_id = ?", [selected_answer, id])
+    await pool.write(select_answer)
+    score_later(id)
     
     return Card(
         H3("Best Answer Selected"),
@@ -623,22 +917,16 @@ async def post(request, id: int):
     # Get form data
     form_data = await request.form()
     
-    # Get all URLs for this question
-    url_list = urls(where="question_id = ?", where_args=[id])
-    
-    # Extract URL rankings and relevance from form
-    url_data = []
-    for u in url_list:
-        rank = form_data.get(f"rank_{u.id}", "0")
-        relevant = "1" if form_data.get(f"relevant_{u.id}") else "0"
-        url_data.append(f"{u.url}:{rank}:{relevant}")
-    
-    # Update all answers for this question with the URL data
-    answer_records = answers(where="question_id = ?", where_args=[id])
-    for a in answer_records:
-        answers.update(dict(
-            url_ranking=",".join(url_data)
-        ), a.id)
+    def rate_sources():
+        # Extract URL rankings and relevance from form
+        ratings = form_ratings(form_data, urls(where="question_id = ?", where_args=[id]))
+        
+        # Apply the ratings to every answer for this question
+        with transaction(db, "POST /best-answers/{id}/rate-sources"):
+            save_url_ratings(ratings, "a.question_id = ?", [id], fanout=True)
+            # The agreement triggers leave ratings replaced by fan-out copies to this; see agreement.py
+            rebuild_agreement(db, id)
+    await pool.write(rate_sources)
     
     return Card(
         H3("Source Ratings Saved"),
@@ -647,82 +935,208 @@ async def post(request, id: int):
         cls="card"
     )
 
+def top_answers_page(rdb):
+    return Container(
+        H2("Select a Question"),
+        P("Click on a question to see its top answers and most relevant sources."),
+        question_search(rdb, "top-answers"),
+        A("Back to Home", href="/", cls="button outline")
+    )
+
 @rt("/top-answers")
-def get():
-    # Get all questions
-    all_questions = questions()
+async def get():
+    return Titled("Top Answers & Sources",
+                  await pool.read(lambda rdb: fragments.render("/top-answers", 0, lambda: top_answers_page(rdb), rdb)))
+
+def top_answers_detail(rdb, id: int, q):
+    # Both lists come from the incrementally maintained summary tables
+    sorted_answers = top_answers(rdb, id)
+    sorted_sources = top_sources(rdb, id)
+    retrieval = question_metrics(rdb, id)
+    similarity = score_summary(rdb, id)
+    agreement = question_agreement(rdb, id)
     
-    # Create list of questions
-    question_list = Ul(
-        *[Li(
-            A(q.text, href=f"/top-answers/{q.id}")
-        ) for q in all_questions],
-        cls="question-list"
-    ) if all_questions else P("No questions yet")
+    return Container(
+        H2(q.text),
+        Card(
+            H3("Most Selected Answers"),
+            Ul(*[Li(
+                P(f"Selected {a['count']} times:"),
+                P(a['final_answer'], cls="answer-text")
+            ) for a in sorted_answers], cls="stats-list") if sorted_answers else P("No answers selected yet"),
+            header="Top Answers",
+            cls="stats-card"
+        ),
+        Card(
+            H3("Most Relevant Sources"),
+            Ul(*[Li(
+                f"{s['url']} (marked relevant {s['relevant_count']} times",
+                f", average rank {s['avg_rank']:.1f})" if s['avg_rank'] is not None else ")"
+            ) for s in sorted_sources], cls="stats-list") if sorted_sources else P("No sources marked as relevant yet"),
+            header="Top Sources",
+            cls="stats-card"
+        ),
+        Card(
+            H3("Retrieval Quality of LLM Sources"),
+            *([P(f"Averaged over {retrieval['answers']} rated answer{'s' if retrieval['answers'] != 1 else ''}."),
+               metrics_table(retrieval)] if retrieval else [P("No rated answers with LLM sources yet")]),
+            header="Retrieval Metrics",
+            cls="stats-card"
+        ),
+        Card(
+            H3("How Close the Answers Are"),
+            *([P(f"Averaged over {similarity['scored']} answer record{'s' if similarity['scored'] != 1 else ''}."),
+               similarity_table(similarity)] if similarity['scored'] else [P("No answers scored yet")]),
+            header="Answer Similarity",
+            cls="stats-card"
+        ),
+        Card(
+            H3("Do Annotators Agree on Sources?"),
+            *([P(f"{agreement['items']} URL{'s' if agreement['items'] != 1 else ''} rated by two or more annotators, "
+                 f"{agreement['pairs']} annotator pair{'s' if agreement['pairs'] != 1 else ''}."),
+               agreement_table(agreement)] if agreement['pairs'] else [P("No URL rated by two annotators yet")]),
+            header="Annotator Agreement",
+            cls="stats-card"
+        ),
+        A("Back to Questions", href="/top-answers", cls="button outline")
+    )
 
-    return Titled("Top Answers & Sources",
-        Container(
-            H2("Select a Question"),
-            P("Click on a question to see its top answers and most relevant sources."),
-            question_list,
-            A("Back to Home", href="/", cls="button outline")
+@rt("/top-answers/{id}")
+async def get(request, id: int):
+    def page(rdb):
+        q = rdb.t.questions[id]
+        return Titled(f"Top Answers & Sources for: {q.text}",
+                      fragments.render("/top-answers/{id}", id, lambda: top_answers_detail(rdb, id, q), rdb))
+    return await conditional_page(request, "top-answers", id, page)
+
+def metric_cell(value):
+    return Td(f"{value:.3f}" if value is not None else "–")
+
+def metrics_table(values: dict):
+    "Precision, recall and nDCG at each cutoff, then MRR, from a dict keyed like `precision@5`"
+    return Table(
+        Thead(Tr(Th("Metric"), *[Th(f"@{k}") for k in DEFAULT_KS])),
+        Tbody(
+            *[Tr(Th(label), *[metric_cell(values[f"{name}@{k}"]) for k in DEFAULT_KS])
+              for name, label in (("precision", "Precision"), ("recall", "Recall"), ("ndcg", "nDCG"))],
+            Tr(Th("MRR"), metric_cell(values["mrr"]), *[Td() for _ in DEFAULT_KS[1:]])
         )
     )
 
-@rt("/top-answers/{id}")
-def get(id: int):
-    q = questions[id]
-    answer_records = answers(where="question_id = ?", where_args=[id])
-    
-    # Count frequency of each final answer
-    answer_counts = {}
-    for record in answer_records:
-        if record.final_answer:
-            answer_counts[record.final_answer] = answer_counts.get(record.final_answer, 0) + 1
-    
-    # Sort answers by frequency
-    sorted_answers = sorted(answer_counts.items(), key=lambda x: x[1], reverse=True)
-    
-    # Count frequency of relevant sources
-    url_counts = {}
-    for record in answer_records:
-        if record.url_ranking:
-            for url_data in record.url_ranking.split(','):
-                # Split on last two colons to handle URLs containing colons
-                parts = url_data.rsplit(':', 2)
-                if len(parts) == 3:
-                    url, _, relevant = parts
-                    if relevant == "1":
-                        url_counts[url] = url_counts.get(url, 0) + 1
-    
-    # Sort sources by frequency
-    sorted_sources = sorted(url_counts.items(), key=lambda x: x[1], reverse=True)
-    
-    return Titled(f"Top Answers & Sources for: {q.text}",
+# Row labels of the similarity table, one per scored pair of answers
+PAIR_LABELS = {"llm_user": "LLM vs. user answer", "llm_final": "LLM vs. final answer", "user_final": "User vs. final answer"}
+
+def similarity_table(means: dict):
+    "Token F1, ROUGE-L and TF-IDF cosine per pair of answers, from a `score_summary`"
+    return Table(
+        Thead(Tr(Th("Pair"), Th("Token F1"), Th("ROUGE-L"), Th("TF-IDF cosine"))),
+        Tbody(*[Tr(Th(PAIR_LABELS[prefix]), *[metric_cell(means[f"{prefix}_{m}"]) for m in ("f1", "rouge_l", "cosine")])
+                for _, _, prefix in PAIRS])
+    )
+
+@rt("/answer-scores")
+async def get():
+    summary = await pool.read(score_summary)
+    return Titled("Answer Similarity",
         Container(
-            H2(q.text),
-            Card(
-                H3("Most Selected Answers"),
-                Ul(*[Li(
-                    P(f"Selected {count} times:"),
-                    P(answer, cls="answer-text")
-                ) for answer, count in sorted_answers], cls="stats-list") if sorted_answers else P("No answers selected yet"),
-                header="Top Answers",
-                cls="stats-card"
-            ),
             Card(
-                H3("Most Relevant Sources"),
-                Ul(*[Li(
-                    f"{url} (marked relevant {count} times)"
-                ) for url, count in sorted_sources], cls="stats-list") if sorted_sources else P("No sources marked as relevant yet"),
-                header="Top Sources",
+                P(f"{summary['scored']} answer records scored" +
+                  (f", {summary['pending']} waiting to be scored." if summary['pending'] else ".")),
+                similarity_table(summary),
+                header="Dataset",
                 cls="stats-card"
             ),
-            A("Back to Questions", href="/top-answers", cls="button outline")
+            A("Back to Home", href="/", cls="button outline")
+        )
+    )
+
+# Number of lowest-scoring questions listed on /retrieval-metrics
+WORST_QUESTIONS = 10
+
+def retrieval_metrics_page(rdb):
+    result = retrieval_metrics.get(rdb)
+    key = f"ndcg@{DEFAULT_KS[len(DEFAULT_KS) // 2]}"
+    worst = lowest_questions(result, key, WORST_QUESTIONS)
+    texts = dict(rdb.execute(f"SELECT id, text FROM questions WHERE id IN ({','.join('?' * len(worst))})",
+                             [qid for qid, _ in worst]).fetchall()) if worst else {}
+    return Container(
+        Card(
+            P(f"LLM-cited sources judged against annotator ratings: {result['answers']} rated answers "
+              f"across {result['questions']} questions, averaged per question."),
+            metrics_table(result['overall']),
+            header="Dataset",
+            cls="stats-card"
+        ),
+        Card(
+            Ul(*[Li(A(texts.get(qid, f"Question {qid}"), href=f"/top-answers/{qid}"), f" ({key} {score:.3f})")
+                 for qid, score in worst], cls="stats-list") if worst else P("No rated answers with LLM sources yet"),
+            header=f"Lowest {key}",
+            cls="stats-card"
+        ),
+        Div(
+            A("Export Per-Question Metrics (CSV)", href="/retrieval-metrics/export?format=csv", cls="button outline"),
+            A("Export Per-Question Metrics (JSONL)", href="/retrieval-metrics/export?format=jsonl", cls="button outline"),
+            A("Back to Home", href="/", cls="button outline"),
+            cls="button-grid"
         )
     )
 
+@rt("/retrieval-metrics")
+async def get():
+    return Titled("Retrieval Metrics", await pool.read(retrieval_metrics_page))
+
+@rt("/retrieval-metrics/export")
+async def get(format: str = "csv"):
+    if format not in ("jsonl", "csv"): return P(f"Unsupported export format: {format}")
+    result = await pool.read(retrieval_metrics.get)
+    return StreamingResponse(
+        (line.encode() for line in export_lines(result, format)),
+        media_type="application/x-ndjson" if format == "jsonl" else "text/csv",
+        headers={"Content-Disposition": f'attachment; filename="retrieval-metrics.{format}"'}
+    )
+
+# What each agreement figure measures, in the order shown
+AGREEMENT_LABELS = {
+    "fleiss_kappa": "Fleiss' kappa (relevance)",
+    "krippendorff_alpha": "Krippendorff's alpha (relevance)",
+    "cohen_kappa": "Cohen's kappa (relevance, mean over pairs)",
+    "spearman_rho": "Spearman's rho (rank, mean over pairs)",
+}
+
+def agreement_table(values: dict):
+    return Table(Tbody(*[Tr(Th(label), metric_cell(values[name])) for name, label in AGREEMENT_LABELS.items()]))
+
+def agreement_page(rdb):
+    result = annotator_agreement.get(rdb)
+    overall = result['overall']
+    worst = lowest_questions(result, "krippendorff_alpha", WORST_QUESTIONS)
+    texts = dict(rdb.execute(f"SELECT id, text FROM questions WHERE id IN ({','.join('?' * len(worst))})",
+                             [qid for qid, _ in worst]).fetchall()) if worst else {}
+    return Container(
+        Card(
+            P(f"{overall['items']} URLs rated by two or more annotators, {overall['pairs']} annotator pairs. "
+              "Kappa and alpha pool every URL; 1 is perfect agreement and 0 is what chance alone would give."),
+            agreement_table(overall),
+            header="Dataset",
+            cls="stats-card"
+        ),
+        Card(
+            Ul(*[Li(A(texts.get(qid, f"Question {qid}"), href=f"/top-answers/{qid}"), f" (alpha {alpha:.3f})")
+                 for qid, alpha in worst], cls="stats-list") if worst else P("No URL rated by two annotators yet"),
+            header="Least Agreement",
+            cls="stats-card"
+        ),
+        A("Back to Home", href="/", cls="button outline")
+    )
+
+@rt("/agreement")
+async def get():
+    return Titled("Annotator Agreement", await pool.read(agreement_page))
+
 def redirect_to_question(id: int):
     return RedirectResponse(f"/questions/{id}", status_code=303)
 
-serve()
+if __name__ == "__main__":
+    # A development server that reloads on changes; `python cli.py serve` runs the app with several workers
+    import uvicorn
+    uvicorn.run("main:create_app", factory=True, host="0.0.0.0", port=int(os.environ.get("PORT", 5001)), reload=True)
@@ -0,0 +1,161 @@
+"""Request instrumentation, exposed in the Prometheus text format.
+
+`MetricsMiddleware` times every request and labels it with its route template
+(`/questions/{id}`, not `/questions/42`). While the request runs, a context
+variable collects the SQL statements SQLite reports through the connection's
+profile hook and the time spent waiting on the LLM, so each route also gets
+histograms of statements per request and SQL and LLM seconds. A background
+task samples event-loop lag. With a slow-request threshold set, requests over
+it are logged together with the statements they ran.
+"""
+import asyncio, logging, time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import AsyncIterator, List
+
+from starlette.routing import Match
+
+from llm import LLMClient
+
+log = logging.getLogger("rag-eval.metrics")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+class Histogram:
+    "Cumulative-bucket histogram per label set, as Prometheus expects"
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.buckets = name, help, buckets
+        self.series = {}
+
+    def observe(self, labels: tuple, value: float):
+        counts, total = self.series.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+        counts[bisect_left(self.buckets, value)] += 1
+        self.series[labels] = (counts, total + value)
+
+    def exposition(self, label_names: tuple) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.series.items()):
+            base = ",".join(f'{k}="{v}"' for k, v in zip(label_names, labels))
+            sep = "," if base else ""
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {cumulative}')
+            braces = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{braces} {total}")
+            lines.append(f"{self.name}_count{braces} {cumulative}")
+        return lines
+
+class RequestStats:
+    "SQL and LLM work done on behalf of one request"
+    __slots__ = ("sql_count", "sql_seconds", "llm_seconds", "queries")
+    def __init__(self, keep_queries: bool):
+        self.sql_count, self.sql_seconds, self.llm_seconds = 0, 0.0, 0.0
+        self.queries = [] if keep_queries else None
+
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+class Metrics:
+    "All collected series plus the hooks that feed them"
+    def __init__(self, slow_request_ms: float | None = None):
+        self.slow_request_ms = slow_request_ms
+        self.requests = Histogram("rag_request_duration_seconds", "Request latency by route")
+        self.sql_statements = Histogram("rag_request_sql_statements", "SQL statements per request by route", COUNT_BUCKETS)
+        self.sql_time = Histogram("rag_request_sql_seconds", "Time spent in SQLite per request by route")
+        self.llm_time = Histogram("rag_request_llm_seconds", "Time spent waiting on the LLM per request by route")
+        self.loop_lag = Histogram("rag_event_loop_lag_seconds", "Delay of a periodic event-loop wakeup beyond its schedule")
+        self.statuses = {}
+
+    def watch_sqlite(self, conn):
+        "Count statements run on `conn` against the current request"
+        def profile(sql: str, nanoseconds: int):
+            if (stats := current_request.get()) is None: return
+            stats.sql_count += 1
+            stats.sql_seconds += nanoseconds / 1e9
+            if stats.queries is not None: stats.queries.append((sql.strip(), nanoseconds / 1e6))
+        conn.set_profile(profile)
+
+    def record_llm(self, seconds: float):
+        if (stats := current_request.get()) is not None: stats.llm_seconds += seconds
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        labels = (method, route)
+        self.requests.observe(labels, seconds)
+        self.sql_statements.observe(labels, stats.sql_count)
+        self.sql_time.observe(labels, stats.sql_seconds)
+        self.llm_time.observe(labels, stats.llm_seconds)
+        key = (method, route, str(status))
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+        if self.slow_request_ms is not None and seconds * 1000 >= self.slow_request_ms:
+            log.warning("Slow request %s %s: %.1f ms, %d SQL statements (%.1f ms), LLM %.1f ms\n%s",
+                        method, route, seconds * 1000, stats.sql_count, stats.sql_seconds * 1000, stats.llm_seconds * 1000,
+                        "\n".join(f"  {ms:8.2f} ms  {sql}" for sql, ms in stats.queries or []))
+
+    async def sample_loop_lag(self, interval: float = 0.1):
+        "Run forever, recording how late each `interval` wakeup is"
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.loop_lag.observe((), max(0.0, loop.time() - expected))
+
+    def exposition(self) -> str:
+        labels = ("method", "route")
+        lines = ["# HELP rag_requests_total Requests by route and status", "# TYPE rag_requests_total counter"]
+        lines += [f'rag_requests_total{{method="{m}",route="{r}",status="{s}"}} {n}'
+                  for (m, r, s), n in sorted(self.statuses.items())]
+        for h in (self.requests, self.sql_statements, self.sql_time, self.llm_time): lines += h.exposition(labels)
+        lines += self.loop_lag.exposition(())
+        return "\n".join(lines) + "\n"
+
+def route_template(scope) -> str:
+    "The path pattern of the route that handled `scope`"
+    for route in getattr(scope.get("app"), "routes", []):
+        if route.matches(scope)[0] == Match.FULL: return getattr(route, "path", scope["path"])
+    return "unmatched"
+
+class MetricsMiddleware:
+    "ASGI middleware recording each HTTP request in `metrics`"
+    def __init__(self, app, metrics: Metrics):
+        self.app, self.metrics = app, metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http": return await self.app(scope, receive, send)
+        stats = RequestStats(keep_queries=self.metrics.slow_request_ms is not None)
+        token = current_request.set(stats)
+        status = 500
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start": status = message["status"]
+            await send(message)
+        start = time.perf_counter()
+        try: await self.app(scope, receive, send_status)
+        finally:
+            current_request.reset(token)
+            self.metrics.record_request(scope["method"], route_template(scope), status, time.perf_counter() - start, stats)
+
+class InstrumentedLLM:
+    "`LLMClient` wrapper reporting time spent in the wrapped client to `metrics`"
+    def __init__(self, client: LLMClient, metrics: Metrics):
+        self.client, self.metrics, self.model = client, metrics, client.model
+
+    async def generate(self, question: str, urls: List[str]) -> tuple[str, List[str]]:
+        start = time.perf_counter()
+        try: return await self.client.generate(question, urls)
+        finally: self.metrics.record_llm(time.perf_counter() - start)
+
+    async def stream(self, question: str, urls: List[str]) -> AsyncIterator[str]:
+        # Only time spent waiting for tokens counts, not time the consumer spends between them
+        tokens = self.client.stream(question, urls).__aiter__()
+        while True:
+            start = time.perf_counter()
+            try: token = await tokens.__anext__()
+            except StopAsyncIteration: return
+            finally: self.metrics.record_llm(time.perf_counter() - start)
+            yield token
+
+    def sources(self, answer: str, urls: List[str]) -> List[str]:
+        return self.client.sources(answer, urls)
+
+    async def aclose(self): await self.client.aclose()
@@ -0,0 +1,215 @@
+"""Versioned schema migrations for the RAG evaluation database.
+
+The schema version is stored in SQLite's `user_version` pragma. Each migration
+runs in its own transaction together with the version bump, so an interrupted
+upgrade leaves the database at the last fully applied version. The transaction
+takes the write lock before it re-reads the version, so when several worker
+processes start on the same database each migration is applied exactly once.
+"""
+
+import re
+
+from agreement import AGREEMENT_TRIGGER_NAMES, create_agreement, rebuild_agreement
+from answer_scores import SCORE_SCHEMA, SCORE_TRIGGERS, recount_terms, score_missing
+from canonical_urls import url_hash
+from dedupe import DEDUPE_SCHEMA, index_missing
+from fragment_cache import create_versions, replace_version_triggers
+from llm_cache import CACHE_SCHEMA
+from pregenerate import PREGEN_SCHEMA
+from search import create_search, rebuild_search, replace_search
+from summaries import create_summaries, rebuild_summaries
+
+MIGRATIONS = []
+
+def migration(fn):
+    "Register `fn(db)` as the next schema migration"
+    MIGRATIONS.append(fn)
+    return fn
+
+def schema_version(db) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(db, target: int | None = None) -> int:
+    "Apply pending migrations up to `target` (default: latest) and return the new version"
+    version = schema_version(db)
+    target = len(MIGRATIONS) if target is None else target
+    for number in range(version + 1, target + 1):
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have applied it while this one waited for the lock
+            if schema_version(db) >= number:
+                db.commit()
+                continue
+            MIGRATIONS[number - 1](db)
+            db.execute(f"PRAGMA user_version = {number}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return schema_version(db)
+
+@migration
+def create_base_tables(db):
+    # Databases created before migrations existed already have these tables
+    db.t.questions.create(dict(id=int, text=str), pk='id', if_not_exists=True)
+    db.t.urls.create(dict(id=int, question_id=int, url=str, source=str), pk='id', if_not_exists=True)
+    db.t.answers.create(dict(
+        id=int,
+        question_id=int,
+        user_answer=str,
+        llm_answer=str,
+        llm_sources=str,
+        final_answer=str,
+        url_ranking=str,
+        url_relevance=str
+    ), pk='id', if_not_exists=True)
+
+@migration
+def add_lookup_indexes(db):
+    # Merge duplicate question texts into the oldest row so the unique index can be built
+    dupes = db.q("""
+        SELECT q.id AS id, keep.id AS keep_id FROM questions q
+        JOIN (SELECT text, MIN(id) AS id FROM questions GROUP BY text HAVING COUNT(*) > 1) keep
+          ON q.text = keep.text AND q.id != keep.id
+    """)
+    for d in dupes:
+        db.execute("UPDATE urls SET question_id = ? WHERE question_id = ?", [d['keep_id'], d['id']])
+        db.execute("UPDATE answers SET question_id = ? WHERE question_id = ?", [d['keep_id'], d['id']])
+        db.execute("DELETE FROM questions WHERE id = ?", [d['id']])
+
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_text ON questions(text)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_urls_question_id ON urls(question_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_urls_question_id_url ON urls(question_id, url)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_answers_question_id ON answers(question_id)")
+
+# Legacy `answers.url_ranking` entries look like `url:rank:relevant`, joined with commas.
+# Splitting on `:<digits>:<0|1>` boundaries keeps URLs that contain commas intact.
+# The rank is the raw form value, so it may be empty; it is stored as 0.
+_LEGACY_RATING = re.compile(r'(.+?):(-?\d*):([01])(?:,|$)')
+
+def parse_legacy_ranking(url_ranking: str) -> list[tuple[str, int, int]]:
+    "Parse a legacy `url_ranking` string into `(url, rank, relevant)` tuples"
+    return [(url, int(rank) if rank.lstrip('-') else 0, int(relevant))
+            for url, rank, relevant in _LEGACY_RATING.findall(url_ranking or '')]
+
+@migration
+def add_url_ratings(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS url_ratings (
+            answer_id INTEGER NOT NULL,
+            url_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL DEFAULT 0,
+            relevant INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (answer_id, url_id)
+        )
+    """)
+    # Covers the per-URL relevance and rank aggregates on /top-answers/{id}
+    db.execute("CREATE INDEX IF NOT EXISTS idx_url_ratings_url ON url_ratings(url_id, relevant, rank)")
+
+    # Backfill from the legacy strings, resolving URLs against the answer's question
+    rows = db.execute("SELECT id, question_id, url_ranking FROM answers WHERE url_ranking != ''").fetchall()
+    for answer_id, question_id, url_ranking in rows:
+        url_ids = {}
+        for url_id, url in db.execute("SELECT id, url FROM urls WHERE question_id = ? ORDER BY id", [question_id]):
+            url_ids.setdefault(url, url_id)
+        db.conn.cursor().executemany(
+            "INSERT OR REPLACE INTO url_ratings (answer_id, url_id, rank, relevant) VALUES (?, ?, ?, ?)",
+            [(answer_id, url_ids[url], rank, relevant)
+             for url, rank, relevant in parse_legacy_ranking(url_ranking) if url in url_ids])
+
+@migration
+def add_summary_tables(db):
+    create_summaries(db)
+    rebuild_summaries(db)
+
+@migration
+def add_llm_cache(db):
+    db.executescript(CACHE_SCHEMA)
+
+@migration
+def add_pregeneration_tables(db):
+    db.executescript(PREGEN_SCHEMA)
+
+@migration
+def add_question_search(db):
+    create_search(db)
+    rebuild_search(db)
+
+@migration
+def add_near_duplicate_index(db):
+    db.executescript(DEDUPE_SCHEMA)
+    index_missing(db)
+
+@migration
+def add_canonical_url_hashes(db):
+    if "canonical_hash" not in db.t.urls.columns_dict: db.execute("ALTER TABLE urls ADD COLUMN canonical_hash TEXT")
+    db.conn.cursor().executemany("UPDATE urls SET canonical_hash = ? WHERE id = ?",
+                                 [(url_hash(url), uid) for uid, url in db.execute("SELECT id, url FROM urls").fetchall()])
+
+    # Merge each group of equivalent URLs into its oldest row, which becomes user-sourced if any duplicate was
+    dupes = db.q("""
+        SELECT u.id AS id, keep.id AS keep_id, u.source AS source FROM urls u
+        JOIN (SELECT question_id, canonical_hash, MIN(id) AS id FROM urls
+              GROUP BY question_id, canonical_hash HAVING COUNT(*) > 1) keep
+          ON u.question_id = keep.question_id AND u.canonical_hash = keep.canonical_hash AND u.id != keep.id
+    """)
+    for d in dupes:
+        # Ratings move to the kept row unless the answer already rated it
+        db.execute("UPDATE OR IGNORE url_ratings SET url_id = ? WHERE url_id = ?", [d['keep_id'], d['id']])
+        db.execute("DELETE FROM url_ratings WHERE url_id = ?", [d['id']])
+        if d['source'] == 'user': db.execute("UPDATE urls SET source = 'user' WHERE id = ?", [d['keep_id']])
+        db.execute("DELETE FROM urls WHERE id = ?", [d['id']])
+
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_urls_question_hash ON urls(question_id, canonical_hash)")
+    rebuild_summaries(db)
+
+@migration
+def add_question_versions(db):
+    create_versions(db)
+
+@migration
+def add_answer_scores(db):
+    db.executescript(SCORE_SCHEMA)
+    score_missing(db)
+
+@migration
+def add_agreement_counts(db):
+    create_agreement(db)
+    rebuild_agreement(db)
+
+@migration
+def add_version_timestamps(db):
+    if "modified" not in db.t.question_versions.columns_dict:
+        db.execute("ALTER TABLE question_versions ADD COLUMN modified INTEGER NOT NULL DEFAULT 0")
+    # When earlier versions were made is unknown; they count from the upgrade, and so do questions never changed since
+    now = "CAST(strftime('%s', 'now') AS INTEGER)"
+    db.execute(f"UPDATE question_versions SET modified = {now} WHERE modified = 0")
+    db.execute(f"INSERT OR IGNORE INTO question_versions (question_id, version, modified) SELECT id, 0, {now} FROM questions")
+    replace_version_triggers(db)
+
+@migration
+def index_answers_separately(db):
+    # question_search held each question's answers concatenated, rebuilt in full by every answer write
+    replace_search(db)
+    rebuild_search(db)
+
+@migration
+def retire_rescored_terms(db):
+    # Rescored answers were added to the document frequencies again without their old texts leaving them
+    db.executescript("".join(f"DROP TRIGGER IF EXISTS {name};\n" for name in SCORE_TRIGGERS) + SCORE_SCHEMA)
+    recount_terms(db)
+
+@migration
+def count_agreement_pairs_on_read(db):
+    # agreement_pairs was kept by the url_ratings triggers, one row per two annotators of a URL
+    db.executescript("".join(f"DROP TRIGGER IF EXISTS {name};\n" for name in AGREEMENT_TRIGGER_NAMES) +
+                     "DROP TABLE IF EXISTS agreement_pairs;\n")
+    create_agreement(db)
+
+@migration
+def count_annotators_not_fanout_copies(db):
+    # Ratings copied onto every answer from /best-answers counted as independent annotators, and pairs were
+    # counted on read. Which existing ratings were copies is not recorded: they all stay annotators' own
+    db.executescript("".join(f"DROP TRIGGER IF EXISTS {name};\n" for name in AGREEMENT_TRIGGER_NAMES))
+    create_agreement(db)
+    rebuild_agreement(db)
@@ -0,0 +1,136 @@
+"""Background pre-generation of LLM answers for the whole question set.
+
+`pregenerate` walks `questions` in id order, asks the LLM about each question
+and its annotator-submitted URLs in parallel batches, and stores the results
+in the `llm_pregenerated` staging table. The user-answer handler reads from
+that table, so annotators don't wait on the model. Progress is saved after
+every batch in `pregen_progress`, so an interrupted run resumes where it
+stopped; questions whose staged answer still matches their current URL set
+are skipped.
+
+Only the LLM calls run on the event loop. Every query and write goes to a
+thread that owns `db` for the length of the run, and each batch's answers are
+staged together with its progress in one transaction. A batch that finds the
+database busy past the timeout is retried, so the app's writers are never made
+to wait on it, nor it on them, with the loop blocked.
+"""
+import asyncio, json, logging, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import apsw
+
+from llm import LLMClient, LLMError
+from llm_cache import cache_key
+
+log = logging.getLogger("rag-eval.pregenerate")
+
+PREGEN_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_pregenerated (
+    question_id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pregen_progress (
+    model TEXT PRIMARY KEY,
+    last_question_id INTEGER NOT NULL,
+    generated INTEGER NOT NULL,
+    skipped INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+class RateLimiter:
+    "Token bucket allowing `rate` acquisitions per second, with bursts of up to `burst`"
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.updated = float(burst), time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def staged_answer(db, question_id: int, model: str, question: str, urls: List[str]) -> tuple[str, List[str]] | None:
+    "The pre-generated `(answer, sources)` for a question, if it was made for the current URL set"
+    row = db.execute("SELECT answer, sources FROM llm_pregenerated WHERE question_id = ? AND key = ?",
+                     [question_id, cache_key(model, question, urls)]).fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+def progress(db, model: str) -> dict | None:
+    rows = db.q("SELECT * FROM pregen_progress WHERE model = ?", [model])
+    return rows[0] if rows else None
+
+def _next_batch(db, cursor: int, batch_size: int) -> tuple[list, dict, dict]:
+    "The questions after `cursor`, with their user URLs and the keys of their staged answers"
+    batch = db.q("SELECT id, text FROM questions WHERE id > ? ORDER BY id LIMIT ?", [cursor, batch_size])
+    ids = [q['id'] for q in batch]
+    marks = ",".join("?" * len(ids))
+    # One query each for the batch's URLs and already staged answers
+    urls = {}
+    for r in db.q(f"SELECT question_id, url FROM urls WHERE source = 'user' AND question_id IN ({marks}) ORDER BY id", ids):
+        urls.setdefault(r['question_id'], []).append(r['url'])
+    staged = {r['question_id']: r['key'] for r in db.q(f"SELECT question_id, key FROM llm_pregenerated WHERE question_id IN ({marks})", ids)}
+    return batch, urls, staged
+
+def _save_batch(db, rows: list, model: str, cursor: int, totals: dict):
+    with db.conn:
+        db.conn.executemany("INSERT OR REPLACE INTO llm_pregenerated VALUES (?, ?, ?, ?, ?)", rows)
+        db.execute("INSERT OR REPLACE INTO pregen_progress VALUES (?, ?, ?, ?, ?, ?)",
+                   [model, cursor, totals['generated'], totals['skipped'], totals['failed'], time.time()])
+
+async def pregenerate(db, client: LLMClient, workers: int = 8, batch_size: int = 64, rate: float | None = None,
+                      restart: bool = False, report: Callable[[dict], None] | None = None) -> dict:
+    "Pre-generate answers for every question after the saved cursor, returning cumulative totals"
+    limiter = RateLimiter(rate, burst=workers) if rate else None
+    pool = asyncio.Semaphore(workers)
+    owner = ThreadPoolExecutor(1, thread_name_prefix="pregenerate")
+    run = lambda fn, *args: asyncio.get_running_loop().run_in_executor(owner, fn, db, *args)
+    try:
+        state = None if restart else await run(progress, client.model)
+        cursor = state['last_question_id'] if state else 0
+        totals = {k: state[k] if state else 0 for k in ('generated', 'skipped', 'failed')}
+
+        async def generate(question_id, question, urls, key):
+            async with pool:
+                if limiter: await limiter.acquire()
+                try: answer, sources = await client.generate(question, urls)
+                except LLMError:
+                    totals['failed'] += 1
+                    return
+            totals['generated'] += 1
+            return question_id, key, answer, json.dumps(sources), time.time()
+
+        while True:
+            batch, urls, staged = await run(_next_batch, cursor, batch_size)
+            if not batch: break
+            jobs = []
+            for q in batch:
+                q_urls = urls.get(q['id'], [])
+                key = cache_key(client.model, q['text'], q_urls)
+                if staged.get(q['id']) == key: totals['skipped'] += 1
+                else: jobs.append(generate(q['id'], q['text'], q_urls, key))
+            rows = [row for row in await asyncio.gather(*jobs) if row]
+
+            cursor = batch[-1]['id']
+            while True:
+                try:
+                    await run(_save_batch, rows, client.model, cursor, totals)
+                    break
+                except apsw.BusyError:
+                    log.warning("Database busy; retrying the batch ending at question %d", cursor)
+                    await asyncio.sleep(1)
+            if report: report(dict(totals, last_question_id=cursor))
+        return totals
+    finally:
+        owner.shutdown(wait=True)
@@ -0,0 +1,172 @@
+"""Retrieval quality of the LLM's cited sources, judged against annotators' ratings.
+
+Each answer record with LLM sources and URL ratings is one retrieval: the
+sources the LLM cited, in citation order, are the ranked list, and that
+record's ratings are the judgments. A cited source is relevant when the
+annotator marked its URL relevant; for nDCG the annotator's rank also grades
+it, so citing the source they ranked first ahead of the others scores higher.
+Rankings are padded into `(answers x depth)` matrices, so precision@k,
+recall@k, reciprocal rank and nDCG@k come out of a few array operations for
+every answer at once. Per-question figures are means over the question's
+answers; dataset figures are means over questions, so heavily annotated
+questions do not dominate.
+"""
+import csv, io, json, threading
+from typing import Iterator
+
+import numpy as np
+
+from canonical_urls import url_hash
+
+DEFAULT_KS = (1, 3, 5, 10)
+
+def metric_names(ks=DEFAULT_KS) -> list[str]:
+    return [f"{m}@{k}" for m in ("precision", "recall", "ndcg") for k in ks] + ["mrr"]
+
+def load_rankings(db, question_id: int | None = None, depth: int = max(DEFAULT_KS)) -> dict:
+    "Relevance, gain and ideal-gain matrices for every rated answer with LLM sources, plus their question ids"
+    where, args = ("AND a.question_id = ?", [question_id]) if question_id is not None else ("", [])
+    answers = db.execute(f"""
+        SELECT a.id, a.question_id, a.llm_sources FROM answers a
+        WHERE a.llm_sources != '' AND EXISTS (SELECT 1 FROM url_ratings r WHERE r.answer_id = a.id) {where}
+        ORDER BY a.id""", args).fetchall()
+    ratings = db.execute(f"""
+        SELECT r.answer_id, u.canonical_hash, r.rank, r.relevant, u.url
+        FROM answers a JOIN url_ratings r ON r.answer_id = a.id JOIN urls u ON u.id = r.url_id
+        WHERE a.llm_sources != '' {where}
+        ORDER BY r.answer_id""", args).fetchall()
+    n = len(answers)
+    row_of = {aid: i for i, (aid, _, _) in enumerate(answers)}
+    r_row = np.fromiter((row_of[r[0]] for r in ratings), np.int64, len(ratings))
+    r_rank = np.fromiter((r[2] for r in ratings), np.float64, len(ratings))
+    r_rel = np.fromiter((r[3] for r in ratings), np.float64, len(ratings))
+
+    # Relevant URLs gain n + 1 - rank among the n URLs the annotator rated, or 1 when left unranked
+    rated = np.bincount(r_row, minlength=n)
+    r_gain = r_rel * np.where(r_rank > 0, np.maximum(rated[r_row] + 1 - r_rank, 1), 1)
+    # The ideal list holds each answer's gains in descending order
+    order = np.lexsort((-r_gain, r_row))
+    starts = np.concatenate(([0], np.cumsum(rated)[:-1])) if n else np.zeros(0, np.int64)
+    position = np.arange(len(order)) - starts[r_row[order]]
+    keep = position < depth
+    ideal = np.zeros((n, depth))
+    ideal[r_row[order][keep], position[keep]] = r_gain[order][keep]
+
+    # Cited sources are matched to the rated URLs by canonical form; repeats of one URL count once.
+    # Most sources are stored verbatim, so only the others pay for canonicalizing
+    verbatim, judged = {(r[0], r[4]): i for i, r in enumerate(ratings)}, None
+    cells, judgments = [], []
+    for i, (aid, _, sources) in enumerate(answers):
+        seen = set()
+        for source in sources.split(","):
+            if not source: continue
+            j = verbatim.get((aid, source))
+            h = ratings[j][1] if j is not None else url_hash(source)
+            if h in seen: continue
+            seen.add(h)
+            if j is None:
+                if judged is None: judged = {(r[0], r[1]): i for i, r in enumerate(ratings)}
+                j = judged.get((aid, h))
+            if j is not None:
+                cells.append((i, len(seen) - 1))
+                judgments.append(j)
+            if len(seen) == depth: break
+    cells = np.array(cells, np.int64).reshape(-1, 2)
+    judgments = np.array(judgments, np.int64)
+    relevance, gain = np.zeros((n, depth)), np.zeros((n, depth))
+    relevance[cells[:, 0], cells[:, 1]] = r_rel[judgments]
+    gain[cells[:, 0], cells[:, 1]] = r_gain[judgments]
+    return dict(question_ids=np.array([q for _, q, _ in answers], np.int64), relevance=relevance, gain=gain, ideal=ideal,
+                relevant=np.bincount(r_row, weights=r_rel, minlength=n))
+
+def answer_metrics(rankings: dict, ks=DEFAULT_KS) -> dict[str, np.ndarray]:
+    "Every metric for every answer; NaN where it is undefined because nothing was marked relevant"
+    relevance, relevant = rankings['relevance'], rankings['relevant']
+    depth = relevance.shape[1]
+    discount = 1 / np.log2(np.arange(2, depth + 2))
+    hits = np.cumsum(relevance, axis=1)
+    dcg, idcg = np.cumsum(rankings['gain'] * discount, axis=1), np.cumsum(rankings['ideal'] * discount, axis=1)
+    judged = relevant > 0
+    metrics = {}
+    for k in ks:
+        c = min(k, depth) - 1
+        metrics[f"precision@{k}"] = hits[:, c] / k
+        metrics[f"recall@{k}"] = np.where(judged, hits[:, c] / np.maximum(relevant, 1), np.nan)
+        metrics[f"ndcg@{k}"] = np.where(idcg[:, c] > 0, dcg[:, c] / np.where(idcg[:, c] > 0, idcg[:, c], 1), np.nan)
+    first_hit = relevance.argmax(axis=1)
+    metrics["mrr"] = np.where(judged, np.where(relevance.any(axis=1), 1 / (first_hit + 1), 0.0), np.nan)
+    return {name: metrics[name] for name in metric_names(ks)}
+
+def group_means(groups: np.ndarray, metrics: dict[str, np.ndarray]) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    "Distinct `groups` and, per metric, the mean of its defined values in each group"
+    keys, index = np.unique(groups, return_inverse=True)
+    means = {}
+    for name, values in metrics.items():
+        defined = ~np.isnan(values)
+        totals = np.bincount(index, weights=np.where(defined, values, 0.0), minlength=len(keys))
+        counts = np.bincount(index, weights=defined, minlength=len(keys))
+        means[name] = np.divide(totals, counts, out=np.full(len(keys), np.nan), where=counts > 0)
+    return keys, means
+
+def _nanmean(values: np.ndarray) -> float | None:
+    defined = values[~np.isnan(values)]
+    return float(defined.mean()) if len(defined) else None
+
+def question_metrics(db, question_id: int, ks=DEFAULT_KS) -> dict | None:
+    "Mean metrics over one question's rated answers, or None if none has LLM sources and ratings"
+    rankings = load_rankings(db, question_id, max(ks))
+    if not len(rankings['question_ids']): return None
+    metrics = answer_metrics(rankings, ks)
+    return dict(answers=len(rankings['question_ids']), **{name: _nanmean(v) for name, v in metrics.items()})
+
+def dataset_metrics(db, ks=DEFAULT_KS) -> dict:
+    "Per-question means and their means across the dataset"
+    rankings = load_rankings(db, depth=max(ks))
+    metrics = answer_metrics(rankings, ks)
+    question_ids, per_question = group_means(rankings['question_ids'], metrics)
+    return dict(ks=tuple(ks), answers=len(rankings['question_ids']), questions=len(question_ids),
+                question_ids=question_ids, answer_counts=np.unique(rankings['question_ids'], return_counts=True)[1],
+                per_question=per_question, overall={name: _nanmean(v) for name, v in per_question.items()})
+
+def lowest_questions(result: dict, metric: str, n: int) -> list[tuple[int, float]]:
+    "`(question_id, value)` for the `n` questions of a `dataset_metrics` or `dataset_agreement` result scoring lowest on `metric`"
+    values = result['per_question'][metric]
+    defined = np.flatnonzero(~np.isnan(values))
+    worst = defined[np.argsort(values[defined], kind="stable")[:n]]
+    return [(int(result['question_ids'][i]), float(values[i])) for i in worst]
+
+class DatasetMetrics:
+    "`compute(db, *args)` (by default `dataset_metrics`), recomputed only after a write to some question"
+    def __init__(self, compute=dataset_metrics):
+        self.compute = compute
+        self.key, self.value = None, None
+        self.lock = threading.Lock()
+
+    def get(self, db, *args) -> dict:
+        # Every rating or answer change bumps its question's version, so their total moves on any change
+        key = (tuple(db.execute("SELECT COUNT(*), TOTAL(version) FROM question_versions").fetchone()), args)
+        with self.lock:
+            if key == self.key: return self.value
+        value = self.compute(db, *args)
+        with self.lock: self.key, self.value = key, value
+        return value
+
+def export_lines(result: dict, fmt: str = "csv") -> Iterator[str]:
+    "One CSV row or JSON line per question of a `dataset_metrics` result"
+    if fmt not in ("jsonl", "csv"): raise ValueError(f"Unsupported export format: {fmt!r}")
+    names = list(result['per_question'])
+    columns = [result['question_ids'], result['answer_counts'], *result['per_question'].values()]
+    # Undefined metrics are empty cells in CSV and null in JSON
+    rows = ([qid, count, *(None if np.isnan(v) else v for v in values)] for qid, count, *values in zip(*(c.tolist() for c in columns)))
+    if fmt == "jsonl":
+        for row in rows: yield json.dumps(dict(zip(["question_id", "answers", *names], row))) + "\n"
+        return
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["question_id", "answers", *names])
+    yield buf.getvalue()
+    for row in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        yield buf.getvalue()
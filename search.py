@@ -0,0 +1,85 @@
+"""Full-text search over questions and their answers.
+
+`question_search` is an FTS5 table with one row per question (rowid = question
+id) holding its text, and `answer_search` one row per answer (rowid = answer
+id) holding its user, LLM and final answers. Triggers on `questions` and
+`answers` keep both current in the same transaction as the write, each
+touching only the row written, so a statement updating many answers costs
+one re-index per answer. A question matches when its text or one of its
+answers contains every word of the query; results are ranked by their best
+BM25 score, with question text weighted above answer text.
+"""
+import re
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS question_search USING fts5(text, tokenize='porter unicode61');
+CREATE VIRTUAL TABLE IF NOT EXISTS answer_search USING fts5(body, question_id UNINDEXED, tokenize='porter unicode61');
+"""
+
+_ANSWER_BODY = "{a}.user_answer || ' ' || {a}.llm_answer || ' ' || {a}.final_answer"
+
+SEARCH_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS question_search_ai AFTER INSERT ON questions BEGIN
+    INSERT INTO question_search (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS question_search_au AFTER UPDATE OF text ON questions BEGIN
+    UPDATE question_search SET text = new.text WHERE rowid = new.id;
+END;
+CREATE TRIGGER IF NOT EXISTS question_search_ad AFTER DELETE ON questions BEGIN
+    DELETE FROM question_search WHERE rowid = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS answer_search_ai AFTER INSERT ON answers BEGIN
+    INSERT INTO answer_search (rowid, body, question_id) VALUES (new.id, {_ANSWER_BODY.format(a='new')}, new.question_id);
+END;
+CREATE TRIGGER IF NOT EXISTS answer_search_au
+AFTER UPDATE OF question_id, user_answer, llm_answer, final_answer ON answers BEGIN
+    UPDATE answer_search SET body = {_ANSWER_BODY.format(a='new')}, question_id = new.question_id WHERE rowid = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS answer_search_ad AFTER DELETE ON answers BEGIN
+    DELETE FROM answer_search WHERE rowid = old.id;
+END;
+"""
+
+_TRIGGER_NAMES = re.findall(r"CREATE TRIGGER IF NOT EXISTS (\w+)", SEARCH_TRIGGERS)
+
+def create_search(db):
+    db.executescript(SEARCH_SCHEMA + SEARCH_TRIGGERS)
+
+def replace_search(db):
+    "Drop the search tables and triggers, whatever their layout, and create the current ones"
+    db.executescript("".join(f"DROP TRIGGER IF EXISTS {name};\n" for name in _TRIGGER_NAMES)
+                     + "DROP TABLE IF EXISTS question_search;\nDROP TABLE IF EXISTS answer_search;\n")
+    create_search(db)
+
+def rebuild_search(db):
+    "Recompute the search index from `questions` and `answers`"
+    with db.conn:
+        db.execute("DELETE FROM question_search")
+        db.execute("DELETE FROM answer_search")
+        db.execute("INSERT INTO question_search (rowid, text) SELECT id, text FROM questions")
+        db.execute(f"INSERT INTO answer_search (rowid, body, question_id) SELECT a.id, {_ANSWER_BODY.format(a='a')}, a.question_id FROM answers a")
+
+def match_expression(query: str) -> str:
+    "An FTS5 query matching every word of `query`, the last one as a prefix so results update while typing"
+    words = re.findall(r"\w+", query)
+    if not words: return ""
+    return " ".join(f'"{w}"' for w in words) + "*"
+
+def search_questions(db, query: str, limit: int = 20, offset: int = 0) -> list[dict]:
+    "Questions matching `query` as `{id, text}` dicts, best match first; the most recent questions if `query` is empty"
+    expr = match_expression(query)
+    if not expr:
+        return db.q("SELECT id, text FROM questions ORDER BY id DESC LIMIT ? OFFSET ?", [limit, offset])
+    # BM25 scores are negative, lower is better; a match in the question text counts ten times one in an answer
+    return db.q("""
+        WITH hits (id, score) AS (
+            SELECT rowid, bm25(question_search) * 10.0 FROM question_search WHERE question_search MATCH :expr
+            UNION ALL
+            SELECT question_id, bm25(answer_search) FROM answer_search WHERE answer_search MATCH :expr
+        )
+        SELECT q.id, q.text
+        FROM hits JOIN questions q ON q.id = hits.id
+        GROUP BY q.id
+        ORDER BY MIN(hits.score), q.id
+        LIMIT :limit OFFSET :offset
+    """, dict(expr=expr, limit=limit, offset=offset))
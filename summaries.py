@@ -0,0 +1,134 @@
+"""Summary tables behind /top-answers/{id}.
+
+`answer_counts` holds how often each final answer was chosen per question, and
+`source_counts` holds relevance and rank totals per question and URL. Both are
+kept current by triggers on `answers` and `url_ratings`, so they change in the
+same transaction as the write that affects them. `rebuild_summaries` recomputes
+them from scratch for repairs.
+"""
+
+SUMMARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answer_counts (
+    question_id INTEGER NOT NULL,
+    final_answer TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (question_id, final_answer)
+);
+CREATE INDEX IF NOT EXISTS idx_answer_counts_rank ON answer_counts(question_id, count);
+
+CREATE TABLE IF NOT EXISTS source_counts (
+    question_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    relevant_count INTEGER NOT NULL,
+    rating_count INTEGER NOT NULL,
+    rank_sum INTEGER NOT NULL,
+    rank_count INTEGER NOT NULL,
+    PRIMARY KEY (question_id, url)
+);
+CREATE INDEX IF NOT EXISTS idx_source_counts_rank ON source_counts(question_id, relevant_count);
+"""
+
+# Rank 0 means "not ranked" and is left out of the rank totals
+_ADD_RATING = """
+    INSERT INTO source_counts (question_id, url, relevant_count, rating_count, rank_sum, rank_count)
+    SELECT question_id, url, {r}.relevant, 1, MAX({r}.rank, 0), {r}.rank > 0 FROM urls WHERE id = {r}.url_id
+    ON CONFLICT (question_id, url) DO UPDATE SET
+        relevant_count = relevant_count + excluded.relevant_count,
+        rating_count = rating_count + 1,
+        rank_sum = rank_sum + excluded.rank_sum,
+        rank_count = rank_count + excluded.rank_count;
+"""
+
+_REMOVE_RATING = """
+    UPDATE source_counts SET
+        relevant_count = relevant_count - {r}.relevant,
+        rating_count = rating_count - 1,
+        rank_sum = rank_sum - MAX({r}.rank, 0),
+        rank_count = rank_count - ({r}.rank > 0)
+    WHERE (question_id, url) = (SELECT question_id, url FROM urls WHERE id = {r}.url_id);
+    DELETE FROM source_counts WHERE rating_count <= 0
+        AND (question_id, url) = (SELECT question_id, url FROM urls WHERE id = {r}.url_id);
+"""
+
+_ADD_ANSWER = """
+    INSERT INTO answer_counts (question_id, final_answer, count) VALUES ({a}.question_id, {a}.final_answer, 1)
+    ON CONFLICT (question_id, final_answer) DO UPDATE SET count = count + 1;
+"""
+
+_REMOVE_ANSWER = """
+    UPDATE answer_counts SET count = count - 1
+    WHERE question_id = {a}.question_id AND final_answer = {a}.final_answer;
+    DELETE FROM answer_counts WHERE count <= 0
+        AND question_id = {a}.question_id AND final_answer = {a}.final_answer;
+"""
+
+SUMMARY_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS url_ratings_summary_insert AFTER INSERT ON url_ratings BEGIN
+    {_ADD_RATING.format(r='NEW')}
+END;
+CREATE TRIGGER IF NOT EXISTS url_ratings_summary_delete AFTER DELETE ON url_ratings BEGIN
+    {_REMOVE_RATING.format(r='OLD')}
+END;
+CREATE TRIGGER IF NOT EXISTS url_ratings_summary_update AFTER UPDATE ON url_ratings BEGIN
+    {_REMOVE_RATING.format(r='OLD')}
+    {_ADD_RATING.format(r='NEW')}
+END;
+
+CREATE TRIGGER IF NOT EXISTS answers_summary_insert AFTER INSERT ON answers
+WHEN NEW.final_answer != '' BEGIN
+    {_ADD_ANSWER.format(a='NEW')}
+END;
+CREATE TRIGGER IF NOT EXISTS answers_summary_delete AFTER DELETE ON answers
+WHEN OLD.final_answer != '' BEGIN
+    {_REMOVE_ANSWER.format(a='OLD')}
+END;
+CREATE TRIGGER IF NOT EXISTS answers_summary_remove_old AFTER UPDATE OF question_id, final_answer ON answers
+WHEN OLD.final_answer != '' AND (OLD.final_answer IS NOT NEW.final_answer OR OLD.question_id != NEW.question_id) BEGIN
+    {_REMOVE_ANSWER.format(a='OLD')}
+END;
+CREATE TRIGGER IF NOT EXISTS answers_summary_add_new AFTER UPDATE OF question_id, final_answer ON answers
+WHEN NEW.final_answer != '' AND (OLD.final_answer IS NOT NEW.final_answer OR OLD.question_id != NEW.question_id) BEGIN
+    {_ADD_ANSWER.format(a='NEW')}
+END;
+"""
+
+def create_summaries(db):
+    "Create the summary tables and the triggers that maintain them"
+    db.executescript(SUMMARY_SCHEMA)
+    db.executescript(SUMMARY_TRIGGERS)
+
+def rebuild_summaries(db, question_id: int | None = None):
+    "Recompute the summary tables from `answers` and `url_ratings`, for one question or all of them"
+    where, args = ("WHERE question_id = ?", [question_id]) if question_id is not None else ("", [])
+    with db.conn:
+        db.execute(f"DELETE FROM answer_counts {where}", args)
+        db.execute(f"DELETE FROM source_counts {where}", args)
+        db.execute(f"""
+            INSERT INTO answer_counts (question_id, final_answer, count)
+            SELECT question_id, final_answer, COUNT(*) FROM answers
+            WHERE final_answer != '' {where.replace('WHERE', 'AND')}
+            GROUP BY question_id, final_answer
+        """, args)
+        db.execute(f"""
+            INSERT INTO source_counts (question_id, url, relevant_count, rating_count, rank_sum, rank_count)
+            SELECT u.question_id, u.url, SUM(r.relevant), COUNT(*), SUM(MAX(r.rank, 0)), SUM(r.rank > 0)
+            FROM url_ratings r JOIN urls u ON u.id = r.url_id
+            {where.replace('question_id', 'u.question_id')}
+            GROUP BY u.question_id, u.url
+        """, args)
+
+def top_answers(db, question_id: int):
+    "Final answers chosen for a question, most frequent first"
+    return db.q("""
+        SELECT final_answer, count FROM answer_counts
+        WHERE question_id = ? ORDER BY count DESC
+    """, [question_id])
+
+def top_sources(db, question_id: int):
+    "Sources of a question marked relevant at least once, with relevance counts and average rank"
+    return db.q("""
+        SELECT url, relevant_count, rating_count, rank_sum * 1.0 / NULLIF(rank_count, 0) AS avg_rank
+        FROM source_counts
+        WHERE question_id = ? AND relevant_count > 0
+        ORDER BY relevant_count DESC, avg_rank
+    """, [question_id])
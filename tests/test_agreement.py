@@ -0,0 +1,51 @@
+from dataclasses import replace
+
+import pytest
+from starlette.testclient import TestClient
+
+import main
+from agreement import question_agreement, rebuild_agreement
+from config import AppConfig
+
+@pytest.fixture
+def client(tmp_path):
+    "The app on a fresh database with one question, 3 answers and 4 URLs"
+    app = main.create_app(replace(AppConfig.from_env(), db_path=str(tmp_path / "rag.db"), pregenerate=False, debug_mode=True))
+    with TestClient(app) as client:
+        main.db.execute("INSERT INTO questions (id, text) VALUES (1, 'q')")
+        for u in range(1, 5): main.db.execute("INSERT INTO urls (id, question_id, url, source) VALUES (?, 1, ?, 'user')",
+                                              [u, f"https://example.com/{u}"])
+        for a in range(1, 4): main.db.execute("INSERT INTO answers (id, question_id, user_answer, llm_answer) VALUES (?, 1, '', '')", [a])
+        yield client
+
+def rate(client, aid: int, relevant: list[int]):
+    data = dict(final_answer="f", **{f"rank_{u}": str(u) for u in range(1, 5)}, **{f"relevant_{u}": "on" for u in relevant})
+    assert client.post(f"/questions/1/final-answer/{aid}", data=data).status_code == 200
+
+def counts(db):
+    return (db.execute("SELECT * FROM agreement_items ORDER BY url_id").fetchall(),
+            db.execute("SELECT * FROM agreement_pairs ORDER BY answer_a, answer_b").fetchall())
+
+def test_triggers_match_rebuild(client):
+    for aid, relevant in [(1, [1, 2]), (2, [2, 3]), (3, [1, 4]), (2, [1, 2, 3])]: rate(client, aid, relevant)
+    assert question_agreement(main.db, 1)['pairs'] == 3
+    live = counts(main.db)
+    rebuild_agreement(main.db)
+    assert counts(main.db) == live
+
+def test_fanout_copies_are_not_annotators(client):
+    rate(client, 1, [1, 2])
+    rate(client, 2, [3, 4])
+    before = question_agreement(main.db, 1)
+    assert before['cohen_kappa'] < 0
+    # Rating the question's sources copies the same ratings onto every answer, including a third one
+    assert client.post("/best-answers/1/rate-sources", data={"relevant_1": "on"}).status_code == 200
+    after = question_agreement(main.db, 1)
+    assert after['pairs'] == after['items'] == 0 and after['cohen_kappa'] is None
+    live = counts(main.db)
+    rebuild_agreement(main.db)
+    assert counts(main.db) == live
+    # An answer's own rating counts again, against the other annotators' own ratings only
+    rate(client, 3, [1])
+    rate(client, 1, [1])
+    assert question_agreement(main.db, 1)['pairs'] == 1
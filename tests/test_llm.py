@@ -0,0 +1,87 @@
+"Retries, timeouts and circuit breaker transitions of `HTTPLLM`, against the stub server in `benchmarks/llm_stub.py`"
+import asyncio, time
+
+import httpx, pytest
+
+from benchmarks.llm_stub import start_stub
+from llm import HTTPLLM, CircuitOpenError, LLMError
+
+@pytest.fixture
+def stub():
+    "Start a stub server configured by keyword arguments; yields its base URL"
+    servers = []
+    def start(**kwargs):
+        server = start_stub(port=0, **kwargs)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.servers[0].sockets[0].getsockname()[1]}/v1"
+    yield start
+    for server in servers: server.should_exit = True
+
+def run(llm: HTTPLLM, *coros):
+    "Await `coros` concurrently on a fresh event loop, returning results and exceptions alike"
+    async def main():
+        try: return await asyncio.gather(*coros, return_exceptions=True)
+        finally: await llm.aclose()
+    return asyncio.run(main())
+
+def test_retries_until_success(stub):
+    llm = HTTPLLM(stub(latency=0, fail_first=2), "stub", retries=3, backoff=0.01)
+    [(answer, sources)] = run(llm, llm.generate("Q?", ["https://a.example"]))
+    assert "https://a.example" in answer and sources == ["https://a.example"]
+    assert llm.breaker.failures == 0
+
+def test_gives_up_after_retries(stub):
+    llm = HTTPLLM(stub(latency=0, failure_rate=1.0), "stub", retries=2, backoff=0.01)
+    [err] = run(llm, llm.generate("Q?", []))
+    assert isinstance(err, LLMError) and "after 3 attempts" in str(err)
+    assert llm.breaker.failures == 3
+
+def test_timeout(stub):
+    llm = HTTPLLM(stub(latency=1.0), "stub", timeout=0.1, retries=1, backoff=0.01)
+    start = time.monotonic()
+    [err] = run(llm, llm.generate("Q?", []))
+    assert isinstance(err, LLMError) and isinstance(err.__cause__, httpx.TimeoutException)
+    assert time.monotonic() - start < 0.9
+
+def test_breaker_opens_and_half_open_allows_one_probe(stub):
+    llm = HTTPLLM(stub(latency=0.05, fail_first=2), "stub", retries=0, breaker_threshold=2, breaker_reset=0.2)
+    assert all(type(e) is LLMError for e in run(llm, llm.generate("Q?", []), llm.generate("Q?", [])))
+    # Open: fails fast without reaching the backend
+    assert isinstance(run(llm, llm.generate("Q?", []))[0], CircuitOpenError)
+    time.sleep(0.25)
+    # Half-open: one probe goes through, the concurrent requests keep failing fast
+    results = run(llm, *(llm.generate("Q?", []) for _ in range(3)))
+    assert sum(isinstance(r, tuple) for r in results) == 1
+    assert sum(isinstance(r, CircuitOpenError) for r in results) == 2
+    # The probe succeeded, so the breaker is closed again
+    assert isinstance(run(llm, llm.generate("Q?", []), llm.generate("Q?", []))[1], tuple)
+
+def test_failed_probe_reopens_breaker(stub):
+    llm = HTTPLLM(stub(latency=0, failure_rate=1.0), "stub", retries=0, breaker_threshold=1, breaker_reset=0.1)
+    run(llm, llm.generate("Q?", []))
+    time.sleep(0.15)
+    [probe] = run(llm, llm.generate("Q?", []))
+    assert type(probe) is LLMError
+    assert llm.breaker.is_open and isinstance(run(llm, llm.generate("Q?", []))[0], CircuitOpenError)
+
+def test_stream(stub):
+    llm = HTTPLLM(stub(latency=0), "stub")
+    async def collect(): return "".join([c async for c in llm.stream("Q?", ["https://a.example"])])
+    [text] = run(llm, collect())
+    assert text.startswith("Stub answer") and "https://a.example" in text
+
+@pytest.mark.parametrize("body", [b"not json", b"{}", b'{"choices": []}', b'{"error": "overloaded"}'])
+def test_malformed_response(body):
+    # Not in the stub's repertoire: a backend or proxy answering 200 with something other than a completion
+    llm = HTTPLLM("http://llm.invalid/v1", "stub", retries=1, backoff=0.01)
+    llm._client = httpx.AsyncClient(base_url=llm.base_url, transport=httpx.MockTransport(lambda r: httpx.Response(200, content=body)))
+    [err] = run(llm, llm.generate("Q?", []))
+    assert isinstance(err, LLMError) and "after 2 attempts" in str(err)
+
+def test_malformed_stream_chunk():
+    llm = HTTPLLM("http://llm.invalid/v1", "stub")
+    llm._client = httpx.AsyncClient(base_url=llm.base_url, transport=httpx.MockTransport(
+        lambda r: httpx.Response(200, content=b'data: {"choices": [{}]}\n\n', headers={"content-type": "text/event-stream"})))
+    async def collect(): return [c async for c in llm.stream("Q?", [])]
+    [err] = run(llm, collect())
+    assert isinstance(err, LLMError) and llm.breaker.failures == 1
@@ -0,0 +1,12 @@
+from migrations import parse_legacy_ranking
+
+def test_parse_legacy_ranking():
+    assert parse_legacy_ranking('http://a:1:1,http://b:-2:0') == [('http://a', 1, 1), ('http://b', -2, 0)]
+    assert parse_legacy_ranking('') == parse_legacy_ranking(None) == []
+
+def test_unranked_url_keeps_next_rating():
+    # An unranked URL must not swallow the rating after it
+    assert parse_legacy_ranking('http://a::1,http://b:2:0') == [('http://a', 0, 1), ('http://b', 2, 0)]
+
+def test_url_with_comma():
+    assert parse_legacy_ranking('http://a/x,y:1:1,http://b:0:0') == [('http://a/x,y', 1, 1), ('http://b', 0, 0)]
@@ -0,0 +1,56 @@
+"""Write transactions for request handlers, with per-route write latency.
+
+`transaction(db, name)` runs the enclosed writes as one unit of work: they are
+committed together when the block exits, or rolled back together if it
+raises. Blocks nest (inner ones become savepoints). The outermost block takes
+the write lock as it starts, with BEGIN IMMEDIATE: a deferred transaction that
+reads before it writes fails at once with "database is locked" if another
+connection or worker process commits in between, whereas BEGIN IMMEDIATE waits
+out the busy timeout. The time each block takes, including the commit, is
+recorded under `name` in `write_stats`.
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class WriteStats:
+    "Count, total and recent samples of write latency per name"
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.counts, self.totals, self.maxima, self.recent = {}, {}, {}, {}
+
+    def record(self, name: str, seconds: float):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.maxima[name] = max(self.maxima.get(name, 0.0), seconds)
+        self.recent.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def summary(self) -> list[dict]:
+        "Per-name latency in milliseconds, with p50/p95 over the recent window"
+        rows = []
+        for name in sorted(self.counts):
+            recent = sorted(self.recent[name])
+            pct = lambda p: recent[min(len(recent) - 1, int(p * len(recent)))] * 1000
+            rows.append(dict(name=name, count=self.counts[name],
+                             mean_ms=self.totals[name] / self.counts[name] * 1000,
+                             p50_ms=pct(0.5), p95_ms=pct(0.95), max_ms=self.maxima[name] * 1000))
+        return rows
+
+write_stats = WriteStats()
+
+@contextmanager
+def transaction(db, name: str):
+    "Run the enclosed writes in one transaction and record its latency under `name`"
+    start = time.perf_counter()
+    try:
+        if db.conn.in_transaction:
+            with db.conn: yield db
+        else:
+            db.execute("BEGIN IMMEDIATE")
+            try: yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+    finally:
+        write_stats.record(name, time.perf_counter() - start)